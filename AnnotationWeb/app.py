@@ -1,13 +1,37 @@
 # app.py (为新UI重构标签定义)
-import os, json, natsort
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import os, sys, json, time, threading, natsort
+from flask import Flask, render_template, request, jsonify, send_from_directory, g, abort, url_for
+from werkzeug.security import safe_join
 from collections import defaultdict
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+# 与 run_annotate 下的脚本共用样本清单模块
+sys.path.append(os.path.join(APP_ROOT, os.pardir, "run_annotate"))
+import sample_manifest
+import annotation_store
+import result_journal
+import file_lock
+import image_preprocess
 IMAGE_DATA_DIR = os.path.join(APP_ROOT, "overlap_visualizations_3_sampled_complete")
 # ANNOTATIONS_FILE = "annotations.json"
 ANNOTATIONS_FILE = "anno_human_ai/gemini.json"
+# 也可以指向 SQLite 标注库 (run_annotate/annotation_store.py)，例如 "annotations.db"：
+# 页面只查询当前应用的数据，保存时只更新一条人工标注，不再整体读写 JSON
+# ANNOTATIONS_FILE = "annotations.db"
+ANNOTATIONS_MODEL = "gemini" # 使用 SQLite 标注库时展示哪个模型的 AI 结果
 ITEMS_PER_PAGE = 1
+# 每个应用先直接渲染 INITIAL_SAMPLES 个样本，其余由 script.js 在滚动时通过 /api/apps/<app>/samples 分页加载
+INITIAL_SAMPLES = 6
+SAMPLES_PAGE_SIZE = 12
+MAX_SAMPLES_PAGE_SIZE = 100
+
+# --- 缩略图 ---
+# 页面默认加载缩略图（点击查看原图），缩略图按需生成并缓存在磁盘上；需要安装 Pillow，否则返回原图
+THUMB_SIZES = (240, 480, 960) # 允许的最长边像素，避免任意尺寸撑爆缓存
+THUMB_DEFAULT_SIZE = 480
+THUMB_SETTINGS = {"format": "WEBP", "quality": 80}
+THUMB_CACHE_DIR = IMAGE_DATA_DIR + ".thumbs"
+IMAGE_MAX_AGE = 86400 # 浏览器缓存时间（秒），过期后凭 ETag 重新验证
 
 # --- ###################### 核心修改: 为新UI设计的标签结构 ###################### ---
 # 我们将两组标签的定义分开，并给予清晰的标题
@@ -42,7 +66,17 @@ app = Flask(__name__)
 
 def deep_defaultdict(): return defaultdict(deep_defaultdict)
 
-def load_annotations():
+_store = None
+
+def get_store():
+    global _store
+    if _store is None and annotation_store.is_store_path(ANNOTATIONS_FILE):
+        _store = annotation_store.AnnotationStore(ANNOTATIONS_FILE)
+    return _store
+
+def load_annotations(app_name=None):
+    store = get_store()
+    if store: return store.to_nested(model=ANNOTATIONS_MODEL, app=app_name)
     if not os.path.exists(ANNOTATIONS_FILE): return deep_defaultdict()
     try:
         with open(ANNOTATIONS_FILE, 'r', encoding='utf-8') as f: data = json.load(f)
@@ -63,42 +97,223 @@ def save_annotations(data):
         if isinstance(item, defaultdict): return {k: convert_to_dict(v) for k, v in item.items()}
         return item
     regular_dict = convert_to_dict(data)
-    with open(ANNOTATIONS_FILE, 'w', encoding='utf-8') as f: json.dump(regular_dict, f, indent=4, ensure_ascii=False)
+    # 先写临时文件再替换，其他进程（或缓存的 mtime 检查）不会读到写了一半的文件
+    result_journal.write_json_atomic(regular_dict, ANNOTATIONS_FILE)
 
-def scan_image_data(root_dir):
-    if not os.path.exists(root_dir): print(f"错误: 图片目录 '{root_dir}' 不存在。"); return {}, []
-    structured_data = defaultdict(lambda: defaultdict(dict))
-    app_names = natsort.natsorted([d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d))])
-    for app_name in app_names:
-        app_path = os.path.join(root_dir, app_name)
-        files = natsort.natsorted(os.listdir(app_path))
-        for filename in files:
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                try: sample_id = filename.split('__')[0]
-                except IndexError: continue
-                relative_path = os.path.join(app_name, filename).replace(os.sep, '/')
-                if '__before' in filename: structured_data[app_name][sample_id]['before'] = relative_path
-                elif '__current' in filename: structured_data[app_name][sample_id]['current'] = relative_path
-                elif '__after' in filename: structured_data[app_name][sample_id]['after'] = relative_path
+# --- 进程内标注缓存 + 追加日志 ---
+# 标注只在第一次请求时解析一次。/annotate 不再重写整个 JSON，而是在文件锁内向
+# `<ANNOTATIONS_FILE>.jsonl` 追加一行并 fsync（与 run_annotate 的结果日志同一格式），
+# 同时更新内存中的缓存；日志超过 COMPACT_JOURNAL_BYTES 时才原子地压缩回 JSON 文件。
+# 其他进程（多个 worker）追加的记录按字节偏移增量回放；只有快照文件本身的
+# mtime 或大小变化（压缩或手工改写）时才重新解析整个文件。
+JOURNAL_FILE = result_journal.journal_path_for(ANNOTATIONS_FILE)
+COMPACT_JOURNAL_BYTES = 1024 * 1024
+_annotations_cache = {"annotations": None, "signature": None, "journal_offset": 0}
+_annotations_lock = threading.Lock() # 进程内线程之间
+_annotations_file_lock = file_lock.FileLock(ANNOTATIONS_FILE + ".lock") # 进程之间
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def add_timing(name, start):
+    """记录本次请求中一个步骤的耗时，由 after_request 写入 Server-Timing 响应头。"""
+    timings = g.setdefault('timings', {})
+    timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+def refresh_annotations_locked():
+    """持有两把锁时调用：把缓存同步到 快照 + 日志 的最新状态并返回。"""
+    cache = _annotations_cache
+    start = time.perf_counter()
+    signature = file_signature(ANNOTATIONS_FILE)
+    journal_size = os.path.getsize(JOURNAL_FILE) if os.path.exists(JOURNAL_FILE) else 0
+    if cache["annotations"] is None or signature != cache["signature"] or journal_size < cache["journal_offset"]:
+        annotations = load_annotations()
+        records, offset = result_journal.read_journal_from(JOURNAL_FILE, 0)
+        for app_name, sample_id, key, value in records:
+            annotations[app_name][sample_id][key] = value
+        cache.update(annotations=annotations, signature=signature, journal_offset=offset)
+        add_timing("parse", start)
+    elif journal_size > cache["journal_offset"]:
+        records, cache["journal_offset"] = result_journal.read_journal_from(JOURNAL_FILE, cache["journal_offset"])
+        for app_name, sample_id, key, value in records:
+            cache["annotations"][app_name][sample_id][key] = value
+        add_timing("replay", start)
+    return cache["annotations"]
+
+def compact_annotations_locked():
+    """把日志折叠进 JSON 快照（原子替换），然后清空日志。中途崩溃只会导致日志被重复回放，结果不变。"""
+    cache = _annotations_cache
+    start = time.perf_counter()
+    save_annotations(cache["annotations"])
+    with open(JOURNAL_FILE, 'w', encoding='utf-8'):
+        pass
+    cache["signature"] = file_signature(ANNOTATIONS_FILE)
+    cache["journal_offset"] = 0
+    add_timing("compact", start)
+
+def get_app_annotations(app_name):
+    """
+    返回一个应用的标注 {sample_id: {...}}。JSON 文件模式下在锁内浅拷贝缓存中该应用的部分：
+    渲染和 jsonify 在锁外进行，而 save_human_labels 会修改缓存里的同一批字典。
+    """
+    store = get_store()
+    if store:
+        start = time.perf_counter()
+        annotations = load_annotations(app_name)
+        add_timing("query", start)
+        return annotations.get(app_name, {})
+    with _annotations_lock, _annotations_file_lock:
+        annotations = refresh_annotations_locked()
+        if app_name not in annotations: return {}
+        return {sid: dict(v) for sid, v in annotations[app_name].items()}
+
+def build_image_index(manifest):
+    app_names = natsort.natsorted(manifest.apps())
     final_data = {}
-    for app_name, samples in structured_data.items():
-        sorted_samples = sorted(samples.items(), key=lambda item: natsort.natsorted(item[0]))
-        final_data[app_name] = [{"id": sid, "images": s_data} for sid, s_data in sorted_samples]
+    for app_name in app_names:
+        samples = manifest.samples(app_name)
+        if not samples: continue
+        final_data[app_name] = []
+        for sid in natsort.natsorted(samples):
+            s_data = {state: f"{app_name}/{samples[sid][state]}" for state in sample_manifest.STATES if samples[sid][state]}
+            final_data[app_name].append({"id": sid, "images": s_data})
     return final_data, app_names
 
-ALL_IMAGE_DATA, ALL_APP_NAMES = scan_image_data(IMAGE_DATA_DIR)
-TOTAL_APPS = len(ALL_APP_NAMES)
+def scan_image_data(root_dir):
+    if not os.path.exists(root_dir): print(f"错误: 图片目录 '{root_dir}' 不存在。"); return {}, []
+    # 使用与标注脚本共用的样本清单，只重新扫描 mtime 变化过的应用目录
+    return build_image_index(sample_manifest.load_manifest(root_dir))
+
+# --- 图片索引 ---
+# 启动时只读取持久化的样本清单（不遍历数据集目录），服务器立即可用；后台线程再按目录 mtime
+# 增量刷新清单，有变化时整体替换 IMAGE_INDEX。之后每隔 IMAGE_INDEX_REFRESH_SECONDS 检查一次新增的样本。
+# 多进程部署 (gunicorn --preload，见 gunicorn.conf.py) 时清单在主进程 fork 前读取一次，各 worker 共享只读的
+# IMAGE_INDEX；线程不会被 fork 继承，所以刷新线程在每个进程处理第一个请求时才启动。
+IMAGE_INDEX_REFRESH_SECONDS = 300 # None 表示只在启动时刷新一次
+IMAGE_INDEX = ({}, []) # (ALL_IMAGE_DATA, ALL_APP_NAMES)，整体替换，请求中只读取一次
+_image_index_ready = threading.Event()
+_image_manifest = None
+_image_index_refresh_pid = None
+_image_index_refresh_lock = threading.Lock()
+
+def load_image_index():
+    global IMAGE_INDEX, _image_manifest
+    if not os.path.exists(IMAGE_DATA_DIR):
+        print(f"错误: 图片目录 '{IMAGE_DATA_DIR}' 不存在。")
+        _image_index_ready.set()
+        return
+    _image_manifest = sample_manifest.SampleManifest(IMAGE_DATA_DIR)
+    IMAGE_INDEX = build_image_index(_image_manifest)
+
+def image_index_refresh_loop(manifest):
+    global IMAGE_INDEX
+    while True:
+        start = time.perf_counter()
+        try:
+            changed = manifest.refresh()
+        except OSError as e:
+            print(f"图片索引刷新失败: {e}")
+            changed = 0
+        if changed:
+            IMAGE_INDEX = build_image_index(manifest)
+            print(f"[pid {os.getpid()}] 图片索引已更新: {changed} 个应用目录有变化，用时 {time.perf_counter() - start:.2f}s。")
+        _image_index_ready.set()
+        if not IMAGE_INDEX_REFRESH_SECONDS: break
+        time.sleep(IMAGE_INDEX_REFRESH_SECONDS)
+
+@app.before_request
+def ensure_image_index_refresh():
+    global _image_index_refresh_pid
+    if _image_index_refresh_pid == os.getpid() or _image_manifest is None: return
+    with _image_index_refresh_lock:
+        if _image_index_refresh_pid == os.getpid(): return
+        _image_index_refresh_pid = os.getpid()
+        threading.Thread(target=image_index_refresh_loop, args=(_image_manifest,),
+                         name="image-index-refresh", daemon=True).start()
+
+load_image_index()
 
 @app.route('/')
 def index():
+    all_image_data, all_app_names = IMAGE_INDEX
+    total_apps = len(all_app_names)
     page = request.args.get('page', 1, type=int)
     if page < 1: page = 1
-    if page > TOTAL_APPS and TOTAL_APPS > 0: page = TOTAL_APPS
+    if page > total_apps and total_apps > 0: page = total_apps
     start_index = (page - 1) * ITEMS_PER_PAGE
-    current_app_name = ALL_APP_NAMES[start_index] if start_index < TOTAL_APPS else None
-    samples_for_app = ALL_IMAGE_DATA.get(current_app_name, [])
-    annotations = load_annotations()
-    return render_template('index.html', app_name=current_app_name, samples=samples_for_app, labels=LABELS, annotations=annotations.get(current_app_name, {}), current_page=page, total_pages=TOTAL_APPS)
+    current_app_name = all_app_names[start_index] if start_index < total_apps else None
+    samples_for_app = all_image_data.get(current_app_name, [])
+    annotations = get_app_annotations(current_app_name)
+    start = time.perf_counter()
+    html = render_template('index.html', app_name=current_app_name, samples=samples_for_app[:INITIAL_SAMPLES], total_samples=len(samples_for_app), page_size=SAMPLES_PAGE_SIZE, labels=LABELS, annotations=annotations, current_page=page, total_pages=total_apps, thumb_size=THUMB_DEFAULT_SIZE, index_building=not _image_index_ready.is_set())
+    add_timing("render", start)
+    return html
+
+@app.route('/api/apps/<app_name>/samples')
+def api_samples(app_name):
+    """
+    一页样本及其标注: ?offset=0&limit=12。每个样本同时带有用 _sample.html 渲染好的
+    "html"，script.js 直接插入页面，与首屏的服务端渲染保持一致。
+    """
+    all_image_data, _ = IMAGE_INDEX
+    if app_name not in all_image_data:
+        return jsonify({"status": "error", "message": "Unknown app"}), 404
+    samples = all_image_data[app_name]
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', SAMPLES_PAGE_SIZE, type=int), 1), MAX_SAMPLES_PAGE_SIZE)
+    page_samples = samples[offset:offset + limit]
+    annotations = get_app_annotations(app_name)
+    start = time.perf_counter()
+    items = []
+    for sample in page_samples:
+        annos = annotations.get(sample['id'], {})
+        items.append({
+            "id": sample['id'],
+            "images": {state: {"thumb": url_for('serve_thumb', size=THUMB_DEFAULT_SIZE, filepath=path),
+                               "full": url_for('serve_image', filepath=path)} for state, path in sample['images'].items()},
+            "annotations": annos,
+            "html": render_template('_sample.html', sample=sample, annos=annos, app_name=app_name, labels=LABELS, thumb_size=THUMB_DEFAULT_SIZE),
+        })
+    add_timing("render", start)
+    next_offset = offset + len(page_samples)
+    return jsonify({
+        "app_name": app_name,
+        "offset": offset,
+        "limit": limit,
+        "total": len(samples),
+        "next_offset": next_offset if next_offset < len(samples) else None,
+        "samples": items,
+    })
+
+def save_human_labels(items):
+    """
+    把一组 (app_name, sample_id, label) 作为一次持久化写入：SQLite 标注库中是一个事务，
+    JSON 文件模式下是文件锁内的一次日志追加 + 一次 fsync。
+    """
+    labelled = [(app_name, sample_id, {"label": label, "annotator": "Human"}) for app_name, sample_id, label in items]
+    store = get_store()
+    if store:
+        start = time.perf_counter()
+        store.put_human_many(labelled)
+        add_timing("write", start)
+        return
+    with _annotations_lock, _annotations_file_lock:
+        # 先补齐崩溃留下的半行 (完整记录只缺换行时补上换行，使其能被读到)，
+        # 再追上其他进程已经追加的记录，这样本进程记录的日志偏移正好是追加前的文件末尾
+        result_journal.repair_tail(JOURNAL_FILE)
+        annotations = refresh_annotations_locked()
+        start = time.perf_counter()
+        _annotations_cache["journal_offset"] = result_journal.append_many_durable(
+            JOURNAL_FILE, [(app_name, sample_id, 'human', human) for app_name, sample_id, human in labelled])
+        for app_name, sample_id, human in labelled:
+            annotations[app_name][sample_id]['human'] = human
+        add_timing("append", start)
+        if _annotations_cache["journal_offset"] > COMPACT_JOURNAL_BYTES:
+            compact_annotations_locked()
 
 @app.route('/annotate', methods=['POST'])
 def annotate():
@@ -106,17 +321,83 @@ def annotate():
     if not all(k in data for k in ['app_name', 'sample_id', 'label']): 
         return jsonify({"status": "error", "message": "Missing data"}), 400
     
-    app_name, sample_id, label = data['app_name'], data['sample_id'], data['label']
-    
-    annotations = load_annotations()
-    annotations[app_name][sample_id]['human'] = {"label": label, "annotator": "Human"}
-    save_annotations(annotations)
+    save_human_labels([(data['app_name'], data['sample_id'], data['label'])])
     return jsonify({"status": "success", "message": "Annotation saved."})
 
+@app.route('/annotate/batch', methods=['POST'])
+def annotate_batch():
+    """script.js 的提交队列每隔几百毫秒把积攒的点击合并成一次请求: {"annotations": [{app_name, sample_id, label}, ...]}"""
+    data = request.get_json(silent=True) or {}
+    entries = data.get('annotations')
+    if not isinstance(entries, list):
+        return jsonify({"status": "error", "message": "Missing annotations"}), 400
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(k), str) for k in ['app_name', 'sample_id', 'label']):
+            return jsonify({"status": "error", "message": f"Missing data in annotation {i}"}), 400
+    # 同一样本在一批中出现多次时，以最后一次点击为准
+    latest = {(e['app_name'], e['sample_id']): e['label'] for e in entries}
+    if latest:
+        save_human_labels([(app_name, sample_id, label) for (app_name, sample_id), label in latest.items()])
+    return jsonify({"status": "success", "message": "Annotations saved.", "saved": len(latest)})
+
+
+@app.after_request
+def add_server_timing(response):
+    # 例如 "Server-Timing: parse;dur=41.20, render;dur=12.70"，可在浏览器开发者工具的 Timing 面板查看
+    timings = g.get('timings')
+    if timings:
+        response.headers['Server-Timing'] = ", ".join(f"{name};dur={dur:.2f}" for name, dur in timings.items())
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """负载均衡/进程管理器用的健康检查：图片目录和标注存储都可读时返回 200，否则 503。"""
+    all_image_data, all_app_names = IMAGE_INDEX
+    checks = {"image_index": {"ready": _image_index_ready.is_set(), "apps": len(all_app_names),
+                              "samples": sum(len(samples) for samples in all_image_data.values())}}
+    healthy = os.path.isdir(IMAGE_DATA_DIR)
+    try:
+        store = get_store()
+        if store:
+            samples = store.conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            checks["annotations"] = {"backend": "sqlite", "file": ANNOTATIONS_FILE, "samples": samples}
+        else:
+            with _annotations_lock, _annotations_file_lock:
+                refresh_annotations_locked()
+                checks["annotations"] = {"backend": "json", "file": ANNOTATIONS_FILE,
+                                         "journal_offset": _annotations_cache["journal_offset"]}
+    except Exception as e:
+        healthy = False
+        checks["annotations"] = {"error": str(e)}
+    return jsonify({"status": "ok" if healthy else "error", "pid": os.getpid(), **checks}), 200 if healthy else 503
 
 @app.route('/images/<path:filepath>')
-def serve_image(filepath): return send_from_directory(IMAGE_DATA_DIR, filepath)
+def serve_image(filepath): return send_from_directory(IMAGE_DATA_DIR, filepath, max_age=IMAGE_MAX_AGE)
+
+@app.route('/thumb/<int:size>/<path:filepath>')
+def serve_thumb(size, filepath):
+    if size not in THUMB_SIZES: abort(404)
+    image_path = safe_join(IMAGE_DATA_DIR, filepath)
+    if image_path is None or not os.path.isfile(image_path): abort(404)
+    st = os.stat(image_path)
+    # 强 ETag 由源文件的 mtime/大小和缩略图参数决定，浏览器重新验证时无需生成缩略图即可返回 304
+    output = THUMB_SETTINGS["format"].lower() if image_preprocess.Image else "original"
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}-{size}-{output}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        start = time.perf_counter()
+        prepared = image_preprocess.preprocess_image(image_path, dict(THUMB_SETTINGS, max_edge=size), THUMB_CACHE_DIR)
+        add_timing("thumb", start)
+        response = app.response_class(prepared.data, mimetype=prepared.mime)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    return response
 
 if __name__ == '__main__':
+    # 仅用于开发调试（单进程、debug=True）。生产环境请用多 worker 的 WSGI 服务器：
+    #   gunicorn -c gunicorn.conf.py app:app                  (Linux/macOS)
+    #   waitress-serve --port=5005 --threads=8 app:app        (Windows)
     if not os.path.exists(IMAGE_DATA_DIR): print(f"警告: 图片目录 '{IMAGE_DATA_DIR}' 不存在。")
     app.run(host='0.0.0.0', port=5005, debug=True)
\ No newline at end of file
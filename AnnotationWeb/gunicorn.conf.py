@@ -0,0 +1,24 @@
+# gunicorn.conf.py (AnnotationWeb 生产模式配置)
+#
+#     cd AnnotationWeb
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# 多个 worker 进程之间的标注状态通过文件锁 + 追加日志 (或 SQLite 标注库) 保持一致；
+# preload_app 让样本清单只在主进程读取一次，fork 后各 worker 共享只读的图片索引。
+# 可用环境变量 ANNOTATIONWEB_BIND / ANNOTATIONWEB_WORKERS / ANNOTATIONWEB_THREADS 覆盖默认值。
+
+import os
+import multiprocessing
+
+chdir = os.path.dirname(os.path.abspath(__file__))  # app.py 中的相对路径以 AnnotationWeb/ 为准
+bind = os.environ.get("ANNOTATIONWEB_BIND", "0.0.0.0:5005")
+workers = int(os.environ.get("ANNOTATIONWEB_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "gthread"
+threads = int(os.environ.get("ANNOTATIONWEB_THREADS", 4))
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+max_requests = 2000        # 定期回收 worker，避免长时间运行后的内存增长
+max_requests_jitter = 200
+accesslog = "-"
+errorlog = "-"
@@ -1,59 +1,200 @@
 // static/script.js (最终交互修正版)
 document.addEventListener('DOMContentLoaded', function() {
     
-    // 我们只选择那些不在'disabled-group'里的标签选项的<label>元素进行监听
-    document.querySelectorAll('.label-group:not(.disabled-group) .label-option label').forEach(label => {
-        label.addEventListener('click', function(event) {
+    const annotationArea = document.getElementById('annotation-area');
+
+    // 样本是分页插入的，所以在外层容器上委托监听，只处理不在'disabled-group'里的标签选项的<label>元素
+    annotationArea.addEventListener('click', function(event) {
+        const label = event.target.closest('.label-group:not(.disabled-group) .label-option label');
+        if (!label) return;
+
+        // 浏览器会自动因为for属性处理radio的选中，我们只需处理后续逻辑
+        // 延迟一小段时间确保DOM更新完毕
+        setTimeout(() => {
+            const labelOptionDiv = label.closest('.label-option');
+            const sampleContainer = label.closest('.sample-container');
+            const group = label.closest('.label-group');
+
+            // 更新UI：移除同组其他选项的'selected'样式，并为当前项添加
+            group.querySelectorAll('.label-option').forEach(opt => {
+                opt.classList.remove('selected');
+            });
+            labelOptionDiv.classList.add('selected');
+
+            // 标记为人工标注
+            sampleContainer.classList.remove('ai-annotated');
+            sampleContainer.classList.add('human-annotated');
             
-            // 浏览器会自动因为for属性处理radio的选中，我们只需处理后续逻辑
-            // 延迟一小段时间确保DOM更新完毕
-            setTimeout(() => {
-                const labelOptionDiv = this.closest('.label-option');
-                const sampleContainer = this.closest('.sample-container');
-                const group = this.closest('.label-group');
-
-                // 更新UI：移除同组其他选项的'selected'样式，并为当前项添加
-                group.querySelectorAll('.label-option').forEach(opt => {
-                    opt.classList.remove('selected');
-                });
-                labelOptionDiv.classList.add('selected');
-
-                // 标记为人工标注
-                sampleContainer.classList.remove('ai-annotated');
-                sampleContainer.classList.add('human-annotated');
-                
-                // 触发保存逻辑
-                handleAnnotation(this);
-            }, 0);
-        });
+            // 触发保存逻辑
+            handleAnnotation(label);
+        }, 0);
     });
 
-    async function handleAnnotation(labelElement) {
+    // 首屏之后的样本: 滚动到页面底部附近时从 /api/apps/<app>/samples 分页加载
+    const loadMore = document.getElementById('load-more');
+    if (loadMore) {
+        let loading = false;
+        let loadBackoffMs = 0;
+        const MAX_LOAD_BACKOFF_MS = 30000;
+        const loadMoreText = loadMore.textContent;
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+        }, { rootMargin: '1000px 0px' });
+
+        async function loadNextPage() {
+            const offset = annotationArea.dataset.nextOffset;
+            if (loading || offset === '') return;
+            loading = true;
+            let succeeded = false;
+            try {
+                const params = new URLSearchParams({ offset: offset, limit: annotationArea.dataset.pageSize });
+                const response = await fetch(`/api/apps/${encodeURIComponent(annotationArea.dataset.appName)}/samples?${params}`);
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const result = await response.json();
+                annotationArea.insertAdjacentHTML('beforeend', result.samples.map(sample => sample.html).join(''));
+                if (result.next_offset === null) {
+                    annotationArea.dataset.nextOffset = '';
+                    observer.disconnect();
+                    loadMore.remove();
+                } else {
+                    annotationArea.dataset.nextOffset = result.next_offset;
+                }
+                succeeded = true;
+            } catch (error) {
+                console.error('加载样本失败:', error);
+            } finally {
+                loading = false;
+            }
+            if (!succeeded) {
+                // 失败后按指数退避重试，不会在底部仍可见时连续发请求；期间滚动触发的 observer 也会重试
+                loadBackoffMs = Math.min(loadBackoffMs ? loadBackoffMs * 2 : 1000, MAX_LOAD_BACKOFF_MS);
+                loadMore.textContent = `加载失败，${Math.round(loadBackoffMs / 1000)} 秒后重试。`;
+                setTimeout(loadIfInView, loadBackoffMs);
+                return;
+            }
+            if (loadBackoffMs) loadMore.textContent = loadMoreText;
+            loadBackoffMs = 0;
+            // 屏幕很高时，加载完一页后底部可能仍在视野内，而 IntersectionObserver 不会再次触发
+            loadIfInView();
+        }
+
+        function loadIfInView() {
+            if (annotationArea.dataset.nextOffset !== '' && loadMore.isConnected && loadMore.getBoundingClientRect().top < window.innerHeight + 1000) {
+                loadNextPage();
+            }
+        }
+
+        observer.observe(loadMore);
+    }
+
+    // --- 标注提交队列 ---
+    // 点击只进入队列（同一样本以最后一次点击为准），每隔 FLUSH_DELAY_MS 合并成一次 /annotate/batch 请求；
+    // 失败时按指数退避重试。未发送成功的标注保存在 localStorage 中，刷新或关闭页面后也不会丢失。
+    const QUEUE_STORAGE_KEY = 'annotationQueue';
+    const FLUSH_DELAY_MS = 300;
+    const MAX_BACKOFF_MS = 30000;
+    const saveStatus = document.getElementById('save-status');
+    let pendingAnnotations = loadQueue();
+    let flushTimer = null;
+    let flushing = false;
+    let backoffMs = 0;
+
+    function queueKey(item) { return item.app_name + '\u0000' + item.sample_id; }
+
+    function loadQueue() {
+        try { return JSON.parse(localStorage.getItem(QUEUE_STORAGE_KEY)) || {}; } catch (error) { return {}; }
+    }
+
+    function saveQueue() {
+        try { localStorage.setItem(QUEUE_STORAGE_KEY, JSON.stringify(pendingAnnotations)); } catch (error) { /* 存储不可用时只保留在内存中 */ }
+    }
+
+    function updateSaveStatus(message) {
+        const count = Object.keys(pendingAnnotations).length;
+        saveStatus.textContent = message || (count ? `${count} 条标注等待保存…` : '');
+        saveStatus.hidden = !saveStatus.textContent;
+    }
+
+    function scheduleFlush(delay) {
+        if (flushTimer === null) flushTimer = setTimeout(flushQueue, delay);
+    }
+
+    function handleAnnotation(labelElement) {
         const sampleContainer = labelElement.closest('.sample-container');
-        const appName = sampleContainer.dataset.appName;
-        const sampleId = sampleContainer.dataset.sampleId;
-        // labelId直接从被点击的<label>的data属性获取
-        const labelId = labelElement.dataset.labelId;
+        const item = {
+            app_name: sampleContainer.dataset.appName,
+            sample_id: sampleContainer.dataset.sampleId,
+            // labelId直接从被点击的<label>的data属性获取
+            label: labelElement.dataset.labelId,
+        };
+        pendingAnnotations[queueKey(item)] = item;
+        saveQueue();
+        updateSaveStatus();
+        scheduleFlush(backoffMs || FLUSH_DELAY_MS);
+    }
 
+    async function flushQueue() {
+        flushTimer = null;
+        const batch = Object.values(pendingAnnotations);
+        if (flushing || !batch.length) return;
+        flushing = true;
         try {
-            const response = await fetch('/annotate', {
+            const response = await fetch('/annotate/batch', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    app_name: appName,
-                    sample_id: sampleId,
-                    label: labelId,
-                }),
+                body: JSON.stringify({ annotations: batch }),
             });
-            const result = await response.json();
-            if (result.status === 'success') {
-                console.log("人工标注已保存:", appName, sampleId, "->", labelId);
+            const result = await response.json().catch(() => ({}));
+            if (response.status >= 400 && response.status < 500) {
+                // 请求本身有问题，重试也不会成功：丢弃这一批，避免永远卡在队列里
+                console.error('标注被服务器拒绝:', result.message, batch);
+            } else if (!response.ok || result.status !== 'success') {
+                throw new Error(result.message || `HTTP ${response.status}`);
             } else {
-                alert('保存失败: ' + result.message);
+                console.log(`人工标注已保存: ${result.saved} 条`);
             }
+            // 只移除已发送、且发送期间没有被再次修改的条目
+            batch.forEach(item => {
+                const key = queueKey(item);
+                if (pendingAnnotations[key] && pendingAnnotations[key].label === item.label) delete pendingAnnotations[key];
+            });
+            saveQueue();
+            backoffMs = 0;
+            updateSaveStatus();
         } catch (error) {
+            backoffMs = Math.min(backoffMs ? backoffMs * 2 : 1000, MAX_BACKOFF_MS);
             console.error('网络或服务器错误:', error);
-            alert('网络或服务器错误，保存失败。');
+            updateSaveStatus(`保存失败，${Math.round(backoffMs / 1000)} 秒后重试（${batch.length} 条标注已暂存在本地）`);
+        } finally {
+            flushing = false;
+            if (Object.keys(pendingAnnotations).length) scheduleFlush(backoffMs || FLUSH_DELAY_MS);
         }
     }
+
+    // 页面上显示队列中尚未保存的选择（例如上次关闭页面前没发出去的标注），分页插入的样本也要处理
+    function applyPendingToPage() {
+        Object.values(pendingAnnotations).forEach(item => {
+            const input = document.getElementById(`human_choice-${item.sample_id}-${item.label}`);
+            const sampleContainer = input && input.closest('.sample-container');
+            if (!sampleContainer || sampleContainer.dataset.appName !== item.app_name || input.checked) return;
+            input.checked = true;
+            input.closest('.label-group').querySelectorAll('.label-option').forEach(opt => opt.classList.remove('selected'));
+            input.closest('.label-option').classList.add('selected');
+            sampleContainer.classList.remove('ai-annotated');
+            sampleContainer.classList.add('human-annotated');
+        });
+    }
+    new MutationObserver(applyPendingToPage).observe(annotationArea, { childList: true });
+    applyPendingToPage();
+
+    window.addEventListener('online', () => { backoffMs = 0; scheduleFlush(0); });
+    window.addEventListener('pagehide', () => {
+        // 尽力在离开页面前发出剩余的标注；队列仍保留在 localStorage 中，下次打开时会重新提交（重复提交无副作用）
+        const batch = Object.values(pendingAnnotations);
+        if (batch.length && navigator.sendBeacon) {
+            navigator.sendBeacon('/annotate/batch', new Blob([JSON.stringify({ annotations: batch })], { type: 'application/json' }));
+        }
+    });
+    updateSaveStatus();
+    scheduleFlush(0);
 });
\ No newline at end of file
@@ -0,0 +1,225 @@
+# annotation_columns.py (所有标注的列式导出)
+#
+# The analysis scripts each re-walk the nested {app: {sample: {"ai": ..., "human": ...}}} files
+# with Python loops. `export` flattens every model file into one table with one row per
+# (file, app, sample):
+#
+#     app, sample, model, source, ai_label, human_label, reason, solution   dictionary-encoded strings
+#     timestamp                                                             datetime64[s] (NaT if unknown)
+#
+# and writes it either as NumPy .npz (always available) or as Parquet when pyarrow is
+# installed and the output ends in .parquet. Loading the .npz is a handful of array reads with
+# no JSON parsing; each string column is an int32 code array (-1 = missing) plus its dictionary,
+# stored Arrow-style as one UTF-8 blob and an offsets array, so no pickling is needed and
+# long reason/solution strings are only decoded when asked for.
+#
+#     python annotation_columns.py export --out annotations.npz ../anno_human_ai_2/*.json
+#     python annotation_columns.py export --out annotations.npz --human gt2.json annotations_2/annotations_*.json
+#     python annotation_columns.py stats --columns annotations.npz
+#
+# eval_benchmark.py (--columns), make_benchmark.py and confirm_benchmark.py (input_columns),
+# and stat_anno.py (columns_path) take the exported file as a fast path.
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+import annotation_stream
+from annotation_store import model_key_for_file
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+STRING_COLUMNS = ('app', 'sample', 'model', 'source', 'ai_label', 'human_label', 'reason', 'solution')
+
+
+class AnnotationColumns:
+    """
+    The exported table. `codes[column]` is an int32 array per string column (-1 = missing) and
+    `timestamp` a datetime64[s] array; dictionaries are decoded lazily by dictionary(column).
+    """
+
+    def __init__(self, codes, timestamp, dictionary_loader):
+        self.codes = codes
+        self.timestamp = timestamp
+        self._dictionary_loader = dictionary_loader
+        self._dictionaries = {}
+        self._lookups = {}
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def dictionary(self, column):
+        """The distinct strings of a column; codes index into this list."""
+        if column not in self._dictionaries:
+            self._dictionaries[column] = self._dictionary_loader(column)
+        return self._dictionaries[column]
+
+    def code(self, column, value):
+        """Code of `value` in a column, or None if it never occurs."""
+        if column not in self._lookups:
+            self._lookups[column] = {v: i for i, v in enumerate(self.dictionary(column))}
+        return self._lookups[column].get(value)
+
+    def equals(self, column, value):
+        """Boolean row mask of column == value."""
+        code = self.code(column, value)
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self.codes[column] == code
+
+    def values(self, column, rows=None):
+        """Decoded strings (None for missing) of a column, for all rows or the given row indices / mask."""
+        dictionary = self.dictionary(column)
+        codes = self.codes[column] if rows is None else self.codes[column][rows]
+        return [dictionary[c] if c >= 0 else None for c in codes.tolist()]
+
+
+def _encode(values):
+    """Dictionary-encodes a list of str/None: (int32 codes, dictionary list)."""
+    lookup = {}
+    codes = np.fromiter((-1 if v is None else lookup.setdefault(v, len(lookup)) for v in values),
+                        dtype=np.int32, count=len(values))
+    return codes, list(lookup)
+
+
+def _pack_strings(strings):
+    """Arrow-style string storage: (uint8 UTF-8 blob, int64 offsets with len(strings) + 1 entries)."""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def _text(value):
+    return value if isinstance(value, str) else None
+
+
+def read_rows(files, human_file=None):
+    """
+    One row per (file, app, sample), or per (app, sample, model) for a consolidated
+    merge_ai_human.py file, streamed from each file. Human labels come from the record itself,
+    or from human_file (e.g. gt2.json) for files that only carry AI results.
+    """
+    human = {}
+    if human_file:
+        for app, sample, info in annotation_stream.iter_records(human_file):
+            if isinstance(info, dict) and isinstance(info.get('human'), dict):
+                human[(app, sample)] = info['human'].get('label')
+    columns = {name: [] for name in STRING_COLUMNS}
+    timestamps = []
+    for path in files:
+        model_name = model_key_for_file(path)
+        source = os.path.basename(path)
+        for app, sample, info in annotation_stream.iter_records(path):
+            if not isinstance(info, dict): continue
+            human_label = info['human'].get('label') if isinstance(info.get('human'), dict) else human.get((app, sample))
+            # A consolidated merge_ai_human.py file gives one row per model of each sample; a sample
+            # without any AI result still gets a row (model missing) for its human label
+            for row_model, ai in (annotation_stream.model_results(info.get('ai'), model_name) or {None: {}}).items():
+                row = {'app': app, 'sample': sample, 'model': row_model, 'source': source,
+                       'ai_label': _text(ai.get('label')), 'human_label': _text(human_label),
+                       'reason': _text(ai.get('reason')), 'solution': _text(ai.get('solution'))}
+                for name in STRING_COLUMNS:
+                    columns[name].append(row[name])
+                # "2025-07-14 14:48:07" as written by the runners (local time, no zone)
+                stamp = ai.get('annotation_timestamp')
+                timestamps.append(stamp.replace(' ', 'T', 1) if isinstance(stamp, str) else 'NaT')
+    try:
+        timestamp = np.array(timestamps, dtype='datetime64[s]')
+    except ValueError:
+        timestamp = np.array([_parse_timestamp(s) for s in timestamps], dtype='datetime64[s]')
+    return columns, timestamp
+
+
+def _parse_timestamp(text):
+    try:
+        return np.datetime64(text, 's')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def export_columns(files, out_path, human_file=None):
+    """Writes the table of `files` to out_path (.parquet needs pyarrow, anything else is .npz). Returns the row count."""
+    columns, timestamp = read_rows(files, human_file)
+    encoded = {name: _encode(values) for name, values in columns.items()}
+    if out_path.endswith('.parquet'):
+        if pa is None:
+            raise RuntimeError("Writing Parquet needs pyarrow; use an .npz output instead.")
+        arrays = {name: pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), pa.array(dictionary, pa.string()))
+                  for name, (codes, dictionary) in encoded.items()}
+        arrays['timestamp'] = pa.array(timestamp)
+        pq.write_table(pa.table(arrays), out_path)
+    else:
+        arrays = {'timestamp': timestamp}
+        for name, (codes, dictionary) in encoded.items():
+            arrays[f'{name}_codes'] = codes
+            arrays[f'{name}_dict_data'], arrays[f'{name}_dict_offsets'] = _pack_strings(dictionary)
+        with open(out_path, 'wb') as f:
+            np.savez(f, **arrays)
+    return len(timestamp)
+
+
+def columns_from_files(files, human_file=None):
+    """The table of `files` as AnnotationColumns in memory, without writing an export."""
+    columns, timestamp = read_rows(files, human_file)
+    encoded = {name: _encode(values) for name, values in columns.items()}
+    return AnnotationColumns({name: codes for name, (codes, _) in encoded.items()}, timestamp,
+                             lambda name: encoded[name][1])
+
+
+def load_columns(path):
+    """Loads an exported .npz or .parquet file as AnnotationColumns."""
+    if path.endswith('.parquet'):
+        if pa is None:
+            raise RuntimeError("Reading Parquet needs pyarrow.")
+        table = pq.read_table(path)
+        codes, dictionaries = {}, {}
+        for name in STRING_COLUMNS:
+            column = table.column(name).combine_chunks()
+            if not pa.types.is_dictionary(column.type):
+                column = column.dictionary_encode()
+            codes[name] = column.indices.fill_null(-1).to_numpy().astype(np.int32)
+            dictionaries[name] = column.dictionary.to_pylist()
+        timestamp = table.column('timestamp').to_numpy().astype('datetime64[s]')
+        return AnnotationColumns(codes, timestamp, dictionaries.__getitem__)
+    npz = np.load(path, allow_pickle=False)
+    codes = {name: npz[f'{name}_codes'] for name in STRING_COLUMNS}
+    return AnnotationColumns(codes, npz['timestamp'],
+                             lambda name: _unpack_strings(npz[f'{name}_dict_data'], npz[f'{name}_dict_offsets']))
+
+
+def stats(columns):
+    result = {'rows': len(columns)}
+    for name in ('model', 'ai_label', 'human_label'):
+        counts = np.bincount(columns.codes[name] + 1, minlength=len(columns.dictionary(name)) + 1)
+        result[name] = {value: int(n) for value, n in zip([None] + columns.dictionary(name), counts) if n}
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export all annotation files into one columnar file, or inspect one.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="Export annotations JSON files (one model per file) to .npz or .parquet.")
+    p_export.add_argument("--out", required=True, help="Output path; .parquet needs pyarrow, anything else is written as .npz.")
+    p_export.add_argument("--human", help="JSON file to take human labels from for files that carry none (e.g. gt2.json).")
+    p_export.add_argument("files", nargs="+")
+    p_stats = sub.add_parser("stats", help="Print row counts per model and label.")
+    p_stats.add_argument("--columns", required=True)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        n = export_columns(args.files, args.out, args.human)
+        print(f"Exported {n} rows from {len(args.files)} file(s) to {args.out}")
+    else:
+        print(json.dumps(stats(load_columns(args.columns)), ensure_ascii=False, indent=2))
@@ -0,0 +1,257 @@
+# annotation_query.py (基于位图索引的标注切片查询)
+#
+# make_benchmark.py, confirm_benchmark.py and friends are each a full scan of the nested JSON
+# with a hard-coded predicate. AnnotationIndex turns the columnar table (annotation_columns.py)
+# into one row per (app, sample) with precomputed bitmaps (NumPy bool arrays):
+#
+#     ai.<model>=<label>    one bitmap per model and AI label
+#     human=<label>         one bitmap per human label
+#     ai_yes_count          number of models answering Yes
+#
+# and answers a filter expression by combining bitmaps instead of walking any JSON:
+#
+#     ai_yes_count>=2 & human=false & app~damai
+#     (ai.gemini=Yes | ai.openai=Yes) & !human=true
+#
+# Fields: app, sample (=, !=, ~ substring, !~), human (a label, true = the positive label
+# '高成本渲染组件遮挡', false = anything else including no label, none = no label),
+# ai.<model> (a label or none), ai_yes_count (=, !=, <, <=, >, >=). Terms combine with
+# & (and), | (or), ! (not) and parentheses; & binds tighter than |. Values may be quoted.
+#
+#     python annotation_query.py --columns annotations.npz "ai_yes_count>=2 & human=false"
+#     python annotation_query.py "human=true & ai.llama=No" ../anno_human_ai_2/*.json --out slice.json
+
+import re
+import json
+import argparse
+
+import numpy as np
+
+import annotation_columns
+
+POSITIVE_HUMAN_LABEL = '高成本渲染组件遮挡'
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<paren>[()])
+  | (?P<term>(?P<field>[A-Za-z_][\w.\-]*)\s*(?P<op>>=|<=|!=|!~|=|~|>|<)\s*(?P<value>"[^"]*"|'[^']*'|[^\s&|()]+))
+  | (?P<logic>[&|!])
+)""", re.VERBOSE)
+
+_COMPARE = {'=': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+
+
+class AnnotationIndex:
+    """
+    Per-sample bitmaps over an annotation_columns.AnnotationColumns table. `samples` is the
+    list of (app, sample) in string order; query() returns indices into it.
+    """
+
+    def __init__(self, columns, positive_human_label=POSITIVE_HUMAN_LABEL):
+        self.positive_human_label = positive_human_label
+        app_codes, sample_codes = columns.codes['app'], columns.codes['sample']
+        n_sample_names = max(len(columns.dictionary('sample')), 1)
+        unique_ids, row_sample = np.unique(app_codes.astype(np.int64) * n_sample_names + sample_codes, return_inverse=True)
+        row_sample = row_sample.reshape(-1)
+        apps, sample_names = columns.dictionary('app'), columns.dictionary('sample')
+        pairs = [(apps[i // n_sample_names], sample_names[i % n_sample_names]) for i in unique_ids.tolist()]
+        order = sorted(range(len(pairs)), key=pairs.__getitem__)
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        row_sample = position[row_sample]
+        self.samples = [pairs[i] for i in order]
+        n = len(self.samples)
+
+        # app and sample names stay dictionary-encoded; string filters only look at the dictionaries
+        self._app_names = apps
+        self._sample_names = sample_names
+        self._app_code = np.empty(n, dtype=np.int64)
+        self._app_code[row_sample] = app_codes
+        self._sample_code = np.empty(n, dtype=np.int64)
+        self._sample_code[row_sample] = sample_codes
+
+        self.ai = {}     # {model: {label: bitmap}}
+        self.human = {}  # {label: bitmap}
+        models, ai_labels, human_labels = columns.dictionary('model'), columns.dictionary('ai_label'), columns.dictionary('human_label')
+        model_codes, ai_codes, human_codes = columns.codes['model'], columns.codes['ai_label'], columns.codes['human_label']
+        for m, model_name in enumerate(models):
+            rows = model_codes == m
+            self.ai[model_name] = {label: self._bitmap(row_sample[rows & (ai_codes == c)]) for c, label in enumerate(ai_labels)}
+        for c, label in enumerate(human_labels):
+            self.human[label] = self._bitmap(row_sample[human_codes == c])
+        self.ai_yes_count = np.zeros(n, dtype=np.int64)
+        for labels in self.ai.values():
+            if 'Yes' in labels: self.ai_yes_count += labels['Yes']
+
+    def _bitmap(self, sample_rows):
+        bitmap = np.zeros(len(self.samples), dtype=bool)
+        bitmap[sample_rows] = True
+        return bitmap
+
+    @property
+    def models(self):
+        return sorted(self.ai)
+
+    def _any_label(self, bitmaps):
+        result = np.zeros(len(self.samples), dtype=bool)
+        for bitmap in bitmaps:
+            result |= bitmap
+        return result
+
+    def _string_filter(self, codes, names, op, value):
+        if op in ('=', '!='):
+            matches = [i for i, name in enumerate(names) if name == value]
+        else:
+            matches = [i for i, name in enumerate(names) if value.lower() in name.lower()]
+        bitmap = np.isin(codes, matches)
+        return ~bitmap if op.startswith('!') else bitmap
+
+    def term(self, field, op, value):
+        """Bitmap of one `field op value` term."""
+        if field in ('app', 'sample'):
+            if op not in ('=', '!=', '~', '!~'):
+                raise ValueError(f"'{field}' supports =, !=, ~ and !~, not '{op}'")
+            if field == 'app':
+                return self._string_filter(self._app_code, self._app_names, op, value)
+            return self._string_filter(self._sample_code, self._sample_names, op, value)
+        if field == 'ai_yes_count':
+            if op not in _COMPARE:
+                raise ValueError(f"'ai_yes_count' supports =, !=, <, <=, > and >=, not '{op}'")
+            try:
+                return _COMPARE[op](self.ai_yes_count, int(value))
+            except ValueError:
+                raise ValueError(f"ai_yes_count needs an integer, got '{value}'") from None
+        if op not in ('=', '!='):
+            raise ValueError(f"'{field}' supports = and !=, not '{op}'")
+        if field == 'human':
+            positive = self.human.get(self.positive_human_label, self._bitmap([]))
+            if value.lower() == 'true': bitmap = positive
+            elif value.lower() == 'false': bitmap = ~positive
+            elif value.lower() == 'none': bitmap = ~self._any_label(self.human.values())
+            else: bitmap = self.human.get(value, self._bitmap([]))
+        elif field.startswith('ai.'):
+            model_name = field[len('ai.'):]
+            if model_name not in self.ai:
+                raise ValueError(f"Unknown model '{model_name}' (known: {', '.join(self.models)})")
+            labels = self.ai[model_name]
+            bitmap = ~self._any_label(labels.values()) if value.lower() == 'none' else labels.get(value, self._bitmap([]))
+        else:
+            raise ValueError(f"Unknown field '{field}' (app, sample, human, ai.<model>, ai_yes_count)")
+        return ~bitmap if op == '!=' else bitmap
+
+    def mask(self, expression):
+        """Boolean mask over `samples` for a filter expression."""
+        return _Parser(self, expression).parse()
+
+    def query(self, expression):
+        """Indices into `samples` matching the expression."""
+        return np.flatnonzero(self.mask(expression))
+
+    def entries(self, indices):
+        """{(app, sample): {'ai': set(models answering Yes), 'human': bool}} for the given samples."""
+        yes = {model_name: labels['Yes'] for model_name, labels in self.ai.items() if 'Yes' in labels}
+        positive = self.human.get(self.positive_human_label, self._bitmap([]))
+        return {self.samples[i]: {'ai': {m for m, bitmap in yes.items() if bitmap[i]}, 'human': bool(positive[i])}
+                for i in np.asarray(indices).tolist()}
+
+
+class _Parser:
+    """Recursive descent over `or := and ('|' and)*`, `and := not ('&' not)*`, `not := '!' not | '(' or ')' | term`."""
+
+    def __init__(self, index, expression):
+        self.index = index
+        self.expression = expression
+        self.tokens = []
+        pos = 0
+        while pos < len(expression):
+            if not expression[pos:].strip(): break
+            match = _TOKEN.match(expression, pos)
+            if not match:
+                raise ValueError(f"Cannot parse query at position {pos}: {expression[pos:]!r}")
+            if match.group('term'):
+                value = match.group('value')
+                if value[0] in '"\'': value = value[1:-1]
+                self.tokens.append(('term', (match.group('field'), match.group('op'), value)))
+            else:
+                self.tokens.append(('op', match.group('paren') or match.group('logic')))
+            pos = match.end()
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def parse(self):
+        if not self.tokens:
+            return np.ones(len(self.index.samples), dtype=bool)
+        result = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected '{self._peek()[1]}' in query {self.expression!r}")
+        return result
+
+    def _or(self):
+        result = self._and()
+        while self._peek() == ('op', '|'):
+            self.pos += 1
+            result = result | self._and()
+        return result
+
+    def _and(self):
+        result = self._not()
+        while self._peek() == ('op', '&'):
+            self.pos += 1
+            result = result & self._not()
+        return result
+
+    def _not(self):
+        kind, value = self._peek()
+        self.pos += 1
+        if (kind, value) == ('op', '!'):
+            return ~self._not()
+        if (kind, value) == ('op', '('):
+            result = self._or()
+            if self._peek() != ('op', ')'):
+                raise ValueError(f"Missing ')' in query {self.expression!r}")
+            self.pos += 1
+            return result
+        if kind == 'term':
+            return self.index.term(*value)
+        raise ValueError(f"Expected a filter term in query {self.expression!r}")
+
+
+def benchmark_json(entries):
+    """{app: {sample: {'ai': [...], 'human': bool}}}, the layout of benchmark_full.json."""
+    result = {}
+    for (app, sample), v in entries.items():
+        result.setdefault(app, {})[sample] = {'ai': sorted(v['ai']), 'human': v['human']}
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Select annotated samples with a filter expression over bitmap indexes.")
+    parser.add_argument("query", help="e.g. \"ai_yes_count>=2 & human=false & app~damai\"")
+    parser.add_argument("files", nargs="*", help="Merged per-model annotation files (e.g. ../anno_human_ai_2/*.json).")
+    parser.add_argument("--columns", help="Columnar export from annotation_columns.py (.npz/.parquet) instead of files.")
+    parser.add_argument("--merged", help="Consolidated merge_ai_human.py file instead of files.")
+    parser.add_argument("--out", help="Write the matching samples as benchmark JSON ({app: {sample: {ai, human}}}).")
+    parser.add_argument("--count", action="store_true", help="Only print the number of matching samples.")
+    args = parser.parse_args()
+    if sum(map(bool, (args.columns, args.merged, args.files))) != 1:
+        parser.error("give exactly one of --columns, --merged or annotation files")
+
+    if args.columns:
+        columns = annotation_columns.load_columns(args.columns)
+    else:
+        columns = annotation_columns.columns_from_files([args.merged] if args.merged else args.files)
+    index = AnnotationIndex(columns)
+    try:
+        matches = index.query(args.query)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{len(matches)} / {len(index.samples)} samples match {args.query!r}")
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_json(index.entries(matches)), f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"Written to {args.out}")
+    elif not args.count:
+        for i in matches.tolist():
+            app, sample = index.samples[i]
+            print(f"{app}\t{sample}")
@@ -0,0 +1,325 @@
+# annotation_store.py (基于 SQLite 的标注存储层)
+#
+# Every tool used to parse and re-dump the whole nested annotations JSON
+# ({app: {sample: {"ai": {...}, "human": {...}}}}) to read or change a single sample.
+# The store keeps the same data in three indexed tables, so a runner or AnnotationWeb
+# can update one sample in place and the evaluation scripts can ask for, e.g., every
+# "Yes" of one model without loading anything else:
+#
+#   samples      (app, sample)
+#   ai_results   (app, sample, model, run) -> label, reason, solution, full result JSON
+#   human_labels (app, sample)             -> label, annotator, full label JSON
+#
+# `model` is the short name the merge/eval scripts already use (annotations_llama.json
+# -> "llama"); `run` distinguishes repeated passes of the same model ("" by default).
+# The JSON layout stays available through import_json / export_json / to_nested:
+#
+#     python annotation_store.py import --db annotations.db --human gt2.json annotations_2/annotations_*.json
+#     python annotation_store.py export --db annotations.db --model llama --out anno_human_ai_2/llama.json
+#     python annotation_store.py stats --db annotations.db
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from collections import defaultdict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    app    TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    PRIMARY KEY (app, sample)
+);
+CREATE TABLE IF NOT EXISTS ai_results (
+    app      TEXT NOT NULL,
+    sample   TEXT NOT NULL,
+    model    TEXT NOT NULL,
+    run      TEXT NOT NULL DEFAULT '',
+    label    TEXT,
+    reason   TEXT,
+    solution TEXT,
+    data     TEXT NOT NULL,
+    created  TEXT,
+    PRIMARY KEY (app, sample, model, run)
+);
+CREATE INDEX IF NOT EXISTS ai_results_model_label ON ai_results (model, run, label);
+CREATE TABLE IF NOT EXISTS human_labels (
+    app       TEXT NOT NULL,
+    sample    TEXT NOT NULL,
+    label     TEXT,
+    annotator TEXT,
+    data      TEXT NOT NULL,
+    updated   TEXT,
+    PRIMARY KEY (app, sample)
+);
+CREATE INDEX IF NOT EXISTS human_labels_label ON human_labels (label);
+"""
+
+
+def deep_defaultdict(): return defaultdict(deep_defaultdict)
+
+
+def is_store_path(path):
+    return os.path.splitext(path)[1].lower() in ('.db', '.sqlite', '.sqlite3')
+
+
+def model_key_for_file(annotations_file):
+    """annotations_2/annotations_llama.json -> "llama", anno_human_ai_2/qwen.json -> "qwen"."""
+    name = os.path.splitext(os.path.basename(annotations_file))[0]
+    return name[len('annotations_'):] if name.startswith('annotations_') else name
+
+
+def normalize_entry(annos):
+    """Brings one legacy sample entry into {"ai": ..., "human": ...} form (bare labels count as human)."""
+    if isinstance(annos, dict):
+        if 'ai' in annos or 'human' in annos: return annos
+        return {'human': annos}
+    if isinstance(annos, str):
+        return {'human': {"label": annos, "annotator": "Human"}}
+    return {}
+
+
+class AnnotationStore:
+    """
+    Annotations of every model plus the human labels in one SQLite file.
+
+    Args:
+        db_path (str): Database file, created on first use.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        # sqlite3 connections must stay on the thread that created them; keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- point updates ---
+
+    def _put_ai(self, conn, app, sample, model, result, run=""):
+        conn.execute("INSERT OR IGNORE INTO samples (app, sample) VALUES (?, ?)", (app, sample))
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_results (app, sample, model, run, label, reason, solution, data, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (app, sample, model, run, result.get('label'), result.get('reason'), result.get('solution'),
+             json.dumps(result, ensure_ascii=False), result.get('annotation_timestamp')))
+
+    def _put_human(self, conn, app, sample, human):
+        conn.execute("INSERT OR IGNORE INTO samples (app, sample) VALUES (?, ?)", (app, sample))
+        conn.execute(
+            "INSERT OR REPLACE INTO human_labels (app, sample, label, annotator, data, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (app, sample, human.get('label'), human.get('annotator'), json.dumps(human, ensure_ascii=False),
+             time.strftime('%Y-%m-%d %H:%M:%S')))
+
+    def put_ai(self, app, sample, model, result, run=""):
+        with self.conn as conn:
+            self._put_ai(conn, app, sample, model, result, run)
+
+    def put_human(self, app, sample, human):
+        with self.conn as conn:
+            self._put_human(conn, app, sample, human)
+
+    def put_human_many(self, items):
+        """(app, sample, human) triples in one transaction."""
+        with self.conn as conn:
+            for app, sample, human in items:
+                self._put_human(conn, app, sample, human)
+
+    def add_samples(self, pairs):
+        with self.conn as conn:
+            conn.executemany("INSERT OR IGNORE INTO samples (app, sample) VALUES (?, ?)", pairs)
+
+    # --- queries ---
+
+    def has_ai(self, app, sample, model, run=""):
+        return self.conn.execute("SELECT 1 FROM ai_results WHERE app = ? AND sample = ? AND model = ? AND run = ?",
+                                 (app, sample, model, run)).fetchone() is not None
+
+    def get_sample(self, app, sample, model, run=""):
+        """{"ai": ..., "human": ...} for one sample, with only the keys that exist."""
+        entry = {}
+        row = self.conn.execute("SELECT data FROM ai_results WHERE app = ? AND sample = ? AND model = ? AND run = ?",
+                                (app, sample, model, run)).fetchone()
+        if row: entry['ai'] = json.loads(row[0])
+        row = self.conn.execute("SELECT data FROM human_labels WHERE app = ? AND sample = ?", (app, sample)).fetchone()
+        if row: entry['human'] = json.loads(row[0])
+        return entry
+
+    def ai_results(self, model=None, run="", label=None, app=None):
+        """Yields (app, sample, model, result_dict); every filter is optional (run=None means any run)."""
+        where, params = self._filters(model=model, run=run, label=label, app=app)
+        for app_, sample, model_, data in self.conn.execute(
+                f"SELECT app, sample, model, data FROM ai_results{where} ORDER BY app, sample", params):
+            yield app_, sample, model_, json.loads(data)
+
+    def human_labels(self, label=None, app=None):
+        """Yields (app, sample, human_dict)."""
+        where, params = self._filters(label=label, app=app)
+        for app_, sample, data in self.conn.execute(
+                f"SELECT app, sample, data FROM human_labels{where} ORDER BY app, sample", params):
+            yield app_, sample, json.loads(data)
+
+    def ai_label_pairs(self, model, label, run=""):
+        """Set of (app, sample) that `model` labelled `label`; served from the (model, run, label) index."""
+        return set(self.conn.execute("SELECT app, sample FROM ai_results WHERE model = ? AND run = ? AND label = ?",
+                                     (model, run, label)).fetchall())
+
+    def human_label_pairs(self, label):
+        return set(self.conn.execute("SELECT app, sample FROM human_labels WHERE label = ?", (label,)).fetchall())
+
+    def sample_pairs(self, app=None):
+        if app is None:
+            return self.conn.execute("SELECT app, sample FROM samples ORDER BY app, sample").fetchall()
+        return self.conn.execute("SELECT app, sample FROM samples WHERE app = ? ORDER BY sample", (app,)).fetchall()
+
+    def models(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT model FROM ai_results ORDER BY model")]
+
+    @staticmethod
+    def _filters(**filters):
+        clauses, params = [], []
+        for column, value in filters.items():
+            if value is None: continue
+            clauses.append(f"{column} = ?")
+            params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    # --- JSON layout adapters ---
+
+    def to_nested(self, model=None, run="", app=None, include_human=True):
+        """
+        Returns the legacy nested layout as a deep_defaultdict: {app: {sample: {"ai": ..., "human": ...}}}.
+        Without `model` only human labels are included (the AnnotationWeb view of a file).
+        """
+        annotations = deep_defaultdict()
+        if include_human:
+            for app_, sample, human in self.human_labels(app=app):
+                annotations[app_][sample]['human'] = human
+        if model is not None:
+            for app_, sample, _, result in self.ai_results(model=model, run=run, app=app):
+                annotations[app_][sample]['ai'] = result
+        return annotations
+
+    def import_json(self, path, model=None, run="", include_ai=True, include_human=True):
+        """
+        Loads an annotations JSON file (runner output, merged file or human-only file) in one
+        transaction. AI results are stored under `model`, defaulting to the file's short name.
+        Returns (ai_count, human_count).
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        model = model or model_key_for_file(path)
+        ai_count = human_count = 0
+        with self.conn as conn:
+            for app, samples in data.items():
+                for sample, annos in samples.items():
+                    entry = normalize_entry(annos)
+                    conn.execute("INSERT OR IGNORE INTO samples (app, sample) VALUES (?, ?)", (app, sample))
+                    if include_ai and isinstance(entry.get('ai'), dict):
+                        self._put_ai(conn, app, sample, model, entry['ai'], run)
+                        ai_count += 1
+                    if include_human and isinstance(entry.get('human'), dict):
+                        self._put_human(conn, app, sample, entry['human'])
+                        human_count += 1
+        return ai_count, human_count
+
+    def export_json(self, path, model=None, run="", include_human=True):
+        """Writes the legacy layout for one model (plus human labels) atomically, sorted like merge_ai_human.py."""
+        data = json.loads(json.dumps(self.to_nested(model=model, run=run, include_human=include_human)))
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+        return sum(len(samples) for samples in data.values())
+
+    def stats(self):
+        conn = self.conn
+        return {
+            "samples": conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0],
+            "human_labels": dict(conn.execute("SELECT label, COUNT(*) FROM human_labels GROUP BY label").fetchall()),
+            "ai_results": {f"{m}{'@' + r if r else ''}": {"total": n, "yes": y} for m, r, n, y in conn.execute(
+                "SELECT model, run, COUNT(*), SUM(label = 'Yes') FROM ai_results GROUP BY model, run ORDER BY model, run")},
+        }
+
+    def writer(self, model, run=""):
+        return StoreWriter(self, model, run)
+
+
+class StoreWriter:
+    """
+    Drop-in for result_journal.ResultJournal when a runner writes to the store: every
+    append is a committed point update, so there is nothing to compact afterwards.
+    """
+
+    def __init__(self, store, model, run=""):
+        self.store = store
+        self.model = model
+        self.run = run
+        self.path = store.db_path
+
+    def append(self, app, sample_id, key, value):
+        if key == 'ai':
+            self.store.put_ai(app, sample_id, self.model, value, self.run)
+        elif key == 'human':
+            self.store.put_human(app, sample_id, value)
+
+    def close(self):
+        pass
+
+    def truncate(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import, export and inspect the SQLite annotation store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="Import annotations JSON files (AI results are stored per file's short model name).")
+    p_import.add_argument("--db", required=True)
+    p_import.add_argument("--human", help="JSON file to take human labels from (e.g. gt2.json); AI results in it are ignored.")
+    p_import.add_argument("--model", help="Model name for the AI results (default: derived from each file name).")
+    p_import.add_argument("--run", default="", help="Run name, to keep several passes of one model apart.")
+    p_import.add_argument("files", nargs="*", help="AI annotations files; their human labels are ignored when --human is given.")
+    p_export = sub.add_parser("export", help="Export one model (plus human labels) in the merged JSON layout.")
+    p_export.add_argument("--db", required=True)
+    p_export.add_argument("--model", help="Model to export; omit for human labels only.")
+    p_export.add_argument("--run", default="")
+    p_export.add_argument("--out", required=True)
+    p_stats = sub.add_parser("stats", help="Print counts per model and per human label.")
+    p_stats.add_argument("--db", required=True)
+    args = parser.parse_args()
+
+    store = AnnotationStore(args.db)
+    if args.command == "import":
+        if args.human:
+            _, n = store.import_json(args.human, include_ai=False)
+            print(f"Imported {n} human labels from {args.human}")
+        for path in args.files:
+            n_ai, n_human = store.import_json(path, model=args.model, run=args.run, include_human=not args.human)
+            print(f"Imported {n_ai} AI results ({args.model or model_key_for_file(path)}) and {n_human} human labels from {path}")
+    elif args.command == "export":
+        n = store.export_json(args.out, model=args.model, run=args.run)
+        print(f"Exported {n} samples to {args.out}")
+    else:
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
@@ -0,0 +1,204 @@
+# annotation_stream.py (标注文件的流式读写)
+#
+# The annotation files are one nested object, {app: {sample: record}}, and json.load holds
+# the whole tree (several times over once scripts copy it around). iter_records reads such a
+# file in chunks and yields one (app, sample, record) at a time, so memory stays bounded by
+# the largest single record:
+#
+#     for app, sample, record in iter_records("anno_human_ai_2/gemini.json"):
+#         ...
+#
+# With with_offsets=True every record also comes with its byte range, and read_record can
+# fetch it again later; merge_ai_human.py uses this to write a key-sorted output without
+# keeping the records in memory. NestedJsonWriter / write_nested_json is the matching
+# streaming writer.
+
+import os
+import json
+
+CHUNK_SIZE = 1 << 20
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:}]"
+_decoder = json.JSONDecoder()
+
+
+class _Scanner:
+    """Character buffer over a text file that can also report byte offsets of positions in it."""
+
+    def __init__(self, f, chunk_size, track_bytes):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.track_bytes = track_bytes
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        # (char index in buf, byte offset in the file) of the last position whose offset was computed
+        self._char_mark = 0
+        self._byte_mark = 0
+
+    def fill(self):
+        """Drops the consumed prefix and reads more; returns False at end of file."""
+        if self.eof: return False
+        if self.pos:
+            if self.track_bytes: self.byte_offset(self.pos)
+            self.buf = self.buf[self.pos:]
+            self._char_mark -= self.pos
+            self.pos = 0
+        # Read at least as much as is buffered, so a large value needs only a few retries
+        data = self.f.read(max(self.chunk_size, len(self.buf)))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def byte_offset(self, index):
+        """Byte offset in the file of buf[index]; index must not go backwards between calls."""
+        self._byte_mark += len(self.buf[self._char_mark:index].encode("utf-8"))
+        self._char_mark = index
+        return self._byte_mark
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.buf[self.pos] if self.pos < len(self.buf) else ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next JSON value. Returns (value, start_index, end_index) in the current buffer."""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill(): continue
+                raise
+            # A number cut at the buffer end ("-25" of "-2500.0", or "-2500" before ".0") decodes
+            # early, so a value only counts once the next character is a delimiter or the file ends
+            if (end == len(self.buf) or self.buf[end] not in _DELIMITERS) and not self.eof and self.fill():
+                continue
+            start, self.pos = self.pos, end
+            return value, start, end
+
+    def members(self):
+        """Yields the keys of the object starting here, leaving the position at each member's value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key, _, _ = self.value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError("Expecting property name", self.buf, self.pos)
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}": return
+            if separator != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buf, self.pos - 1)
+
+
+def iter_records(path, with_offsets=False, chunk_size=CHUNK_SIZE):
+    """
+    Yields (app, sample, record) for every sample of an {app: {sample: record}} file, or
+    (app, sample, record, offset, length) with with_offsets. Apps whose value is not an
+    object are skipped. Raises FileNotFoundError / json.JSONDecodeError like json.load.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        scanner = _Scanner(f, chunk_size, with_offsets)
+        for app in scanner.members():
+            if scanner.peek() != "{":
+                scanner.value()
+                continue
+            for sample in scanner.members():
+                record, start, end = scanner.value()
+                if with_offsets:
+                    offset = scanner.byte_offset(start)
+                    yield app, sample, record, offset, scanner.byte_offset(end) - offset
+                else:
+                    yield app, sample, record
+        if scanner.peek():
+            raise json.JSONDecodeError("Extra data", scanner.buf, scanner.pos)
+
+
+def read_record(f, offset, length):
+    """Reads one record back from a file opened in binary mode, given its iter_records offsets."""
+    f.seek(offset)
+    return json.loads(f.read(length).decode("utf-8"))
+
+
+def model_results(ai, default_model):
+    """
+    {model: result} for a record's "ai" entry. A consolidated merge_ai_human.py file stores
+    {model: result} there; a per-model file stores one result, which belongs to default_model.
+    """
+    if not isinstance(ai, dict) or not ai: return {}
+    if all(isinstance(v, dict) for v in ai.values()): return ai
+    return {default_model: ai}
+
+
+class NestedJsonWriter:
+    """
+    Streams an {app: {sample: record}} file one record at a time; write() must be called in
+    app, sample order. The bytes are the same as json.dump(..., indent=indent, sort_keys=True,
+    ensure_ascii=False). The file goes to a temp file and is renamed into place on close().
+    """
+
+    def __init__(self, path, indent=2):
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._pad, self._pad2 = " " * indent, " " * (2 * indent)
+        self._indent = indent
+        self._tmp_path = f"{path}.tmp{os.getpid()}"
+        self._file = open(self._tmp_path, "w", encoding="utf-8")
+        self._file.write("{")
+        self._app = None
+        self._first = True
+        self.count = 0
+
+    def write(self, app, sample, record):
+        f = self._file
+        if app != self._app:
+            if self._app is not None: f.write(f"\n{self._pad}}},")
+            f.write(f"\n{self._pad}{json.dumps(app, ensure_ascii=False)}: {{")
+            self._app = app
+            self._first = True
+        record_text = json.dumps(record, ensure_ascii=False, indent=self._indent, sort_keys=True).replace("\n", "\n" + self._pad2)
+        f.write(f"{'' if self._first else ','}\n{self._pad2}{json.dumps(sample, ensure_ascii=False)}: {record_text}")
+        self._first = False
+        self.count += 1
+
+    def close(self):
+        self._file.write(f"\n{self._pad}}}\n}}" if self._app is not None else "}")
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type: self.abort()
+        else: self.close()
+
+
+def write_nested_json(path, items, indent=2):
+    """Writes (app, sample, record) items, sorted by app and then sample, with a NestedJsonWriter."""
+    with NestedJsonWriter(path, indent) as writer:
+        for app, sample, record in items:
+            writer.write(app, sample, record)
@@ -3,16 +3,24 @@
 import os
 import json
 import time
-import glob
+import argparse
 from collections import defaultdict
 from google import genai
 from google.genai import types
+import rate_limiter # 共用的自适应限速器
+import result_journal # 追加式结果日志
+import response_cache # 按内容寻址的响应缓存
+import sample_manifest # 预先构建的样本清单
+import batch_annotate # Gemini Batch API 批量提交
+import image_preprocess # 读取图片并按内容识别 MIME 类型 (清单中也可能有 .jpg)
 
 # --- 配置 (Google Gemini) ---
 GOOGLE_API_KEY = "YOUR_GOOGLE_AI_API_KEY_HERE"
 
 # --- 常量 ---
 IMAGE_DATA_ROOT = "overlap_visualizations_3_sampled_complete"
+ORIGINAL_CURRENT_ROOT = r"D:\Code\HapTest\day10_simple" # 原始 current 截图目录（所有脚本共用同一份清单）
+RESPONSE_CACHE = response_cache.ResponseCache() # 以模型、Prompt 和图片哈希为键
 ANNOTATIONS_FILE = "annotations_copy_1.json"
 MODEL_NAME = "gemini-2.5-flash"
 
@@ -55,6 +63,12 @@ PROMPT_INSTRUCTIONS = """
 def deep_defaultdict(): return defaultdict(deep_defaultdict)
 
 def load_annotations():
+    # 先读取快照，再回放上次压缩之后追加到日志中的结果
+    annotations = load_annotations_snapshot()
+    result_journal.replay_journal(annotations, ANNOTATIONS_FILE)
+    return annotations
+
+def load_annotations_snapshot():
     if not os.path.exists(ANNOTATIONS_FILE): return deep_defaultdict()
     try:
         with open(ANNOTATIONS_FILE, 'r', encoding='utf-8') as f: data = json.load(f)
@@ -74,90 +88,181 @@ def save_annotations(data):
         if isinstance(item, defaultdict): return {k: convert_to_dict(v) for k, v in item.items()}
         return item
     regular_dict = convert_to_dict(data)
-    with open(ANNOTATIONS_FILE, 'w', encoding='utf-8') as f: json.dump(regular_dict, f, indent=4, ensure_ascii=False)
+    result_journal.write_json_atomic(regular_dict, ANNOTATIONS_FILE)
+
+_manifest = None
+
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = sample_manifest.load_manifest(IMAGE_DATA_ROOT, original_root=ORIGINAL_CURRENT_ROOT)
+    return _manifest
 
 def find_image_paths(app_name, sample_id):
-    paths = {};
-    for state in ['before', 'current', 'after']:
-        pattern = os.path.join(IMAGE_DATA_ROOT, app_name, f"{sample_id}__{state}*.png")
-        found_files = glob.glob(pattern);
-        if found_files: paths[state] = found_files[0]
-        else: paths[state] = None
-    return paths
+    # 从预先构建的清单中查找，不再对每个状态执行一次 glob
+    return get_manifest().image_paths(app_name, sample_id)
+
+def parse_ai_response(raw_text):
+    """校验模型的原始响应，返回标注字典；无效时打印原因并返回 None。在线与批量模式共用。"""
+    first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
+    if first_brace == -1 or last_brace == -1:
+        print(f"  -> JSON 解析错误: 模型响应中未找到有效的JSON结构。响应: {raw_text}"); return None
+    json_str = raw_text[first_brace : last_brace + 1]
+    try:
+        result = json.loads(json_str)
+    except json.JSONDecodeError as e:
+        print(f"  -> JSON 解析错误: 无法解析提取出的字符串。错误: {e}。提取内容: '{json_str}'"); return None
+
+    if isinstance(result, dict) and 'label' in result and 'reason' in result and 'solution' in result and result['label'] in ['Yes', 'No']:
+        print(f"  -> 成功: AI分类为 {result['label']}。")
+        result['annotator'] = 'AI'
+        result['model_used'] = MODEL_NAME
+        result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        return result
+    else:
+        print(f"  -> 解析错误: AI响应的JSON无效或缺少键。响应: {raw_text}"); return None
 
 def annotate_sample_with_ai(client, app_name, sample_id):
     print(f"正在处理: {app_name} / {sample_id}")
     image_paths = find_image_paths(app_name, sample_id)
     if not all(image_paths.values()): print(f"  -> 跳过: 未能找到全部三张图片。"); return None
 
-    image_parts = []
     try:
-        # 1. 'before' image
-        with open(image_paths['before'], 'rb') as f:
-            image_bytes_before = f.read()
-        image_parts.append(types.Part.from_bytes(data=image_bytes_before, mime_type='image/png'))
-
-        # 2. 'current' image
-        with open(image_paths['current'], 'rb') as f:
-            image_bytes_current = f.read()
-        image_parts.append(types.Part.from_bytes(data=image_bytes_current, mime_type='image/png'))
-
-        # 3. 'after' image
-        with open(image_paths['after'], 'rb') as f:
-            image_bytes_after = f.read()
-        image_parts.append(types.Part.from_bytes(data=image_bytes_after, mime_type='image/png'))
-
+        # before / current / after 三张图片；MIME 类型按文件内容识别，不再一律标为 image/png
+        images = [image_preprocess.preprocess_image(image_paths[state_name]) for state_name in ('before', 'current', 'after')]
     except IOError as e:
         print(f"  -> 跳过: 读取图片文件时出错。错误: {e}")
         return None
 
-    contents = [image_parts[0], image_parts[1], image_parts[2], PROMPT_INSTRUCTIONS]
+    contents = [types.Part.from_bytes(data=image.data, mime_type=image.mime) for image in images] + [PROMPT_INSTRUCTIONS]
+    image_hashes = [response_cache.sha256_bytes(image.data) for image in images]
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=contents
-        )
-        raw_text = response.text
-        first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
-        if first_brace == -1 or last_brace == -1:
-            print(f"  -> JSON 解析错误: 模型响应中未找到有效的JSON结构。响应: {raw_text}"); return None
-        json_str = raw_text[first_brace : last_brace + 1]
-        result = json.loads(json_str)
-
-        if 'label' in result and 'reason' in result and 'solution' in result and result['label'] in ['Yes', 'No']:
-            print(f"  -> 成功: AI分类为 {result['label']}。")
-            result['annotator'] = 'AI'
-            result['model_used'] = MODEL_NAME
-            result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
-            return result
+        cache_key = response_cache.make_key("gemini-2.5-flash", PROMPT_INSTRUCTIONS, image_hashes)
+        raw_text = RESPONSE_CACHE.get(cache_key)
+        if raw_text is not None:
+            print("  -> 命中缓存: 复用已保存的响应。")
         else:
-            print(f"  -> 解析错误: AI响应的JSON无效或缺少键。响应: {response.text}"); return None
-            
-    except json.JSONDecodeError as e:
-        print(f"  -> JSON 解析错误: 无法解析提取出的字符串。错误: {e}。提取内容: '{json_str}'"); return None
+            # 按 429 / RESOURCE_EXHAUSTED 自适应限速，替代固定的 time.sleep
+            limiter = rate_limiter.get_limiter("gemini", "gemini-2.5-flash")
+            response = limiter.call(lambda: client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=contents
+            ), tokens=rate_limiter.estimate_tokens(PROMPT_INSTRUCTIONS, n_images=3))
+            raw_text = response.text
+        result = parse_ai_response(raw_text)
+        if result:
+            RESPONSE_CACHE.put(cache_key, raw_text, "gemini-2.5-flash")
+        return result
     except Exception as e:
         print(f"  -> Gemini API 或其他未知错误: {e}")
         if 'response' in locals() and hasattr(response, 'prompt_feedback'): print(f"  -> Prompt Feedback: {response.prompt_feedback}")
         return None
 
+def run_sequential(client, annotations, journal):
+    manifest = get_manifest()
+    for app_name in manifest.apps():
+        for sample_id in manifest.sample_ids(app_name):
+            if 'ai' in annotations.get(app_name, {}).get(sample_id, {}):
+                print(f"跳过 {app_name}/{sample_id}: 已有AI标注结果。")
+                continue
+            ai_result = annotate_sample_with_ai(client, app_name, sample_id)
+            if ai_result:
+                annotations[app_name][sample_id]['ai'] = ai_result
+                journal.append(app_name, sample_id, 'ai', ai_result)
+
+def ingest_batch(client, state, job_name, annotations, journal, poll_interval):
+    """等待一个已提交的批量任务结束，并像在线结果一样写入日志。"""
+    job = batch_annotate.wait_gemini_batch(client, job_name, poll_interval)
+    image_hashes = state.batches[job_name]["requests"]
+    ingested = failed = 0
+    for custom_id, raw_text, error in batch_annotate.iter_gemini_batch_results(client, job):
+        app_name, sample_id = batch_annotate.split_custom_id(custom_id)
+        print(f"批量结果: {app_name} / {sample_id}")
+        ai_result = parse_ai_response(raw_text) if raw_text is not None else None
+        if ai_result:
+            annotations[app_name][sample_id]['ai'] = ai_result
+            journal.append(app_name, sample_id, 'ai', ai_result)
+            if custom_id in image_hashes:
+                RESPONSE_CACHE.put(response_cache.make_key(MODEL_NAME, PROMPT_INSTRUCTIONS, image_hashes[custom_id]), raw_text, MODEL_NAME)
+            ingested += 1
+        else:
+            if error: print(f"  -> 批量请求失败: {error}")
+            failed += 1
+    state.mark_done(job_name, getattr(job.state, "name", str(job.state)))
+    print(f"批量任务 {job_name} 结束: 写入 {ingested} 条结果，失败 {failed} 条（下次运行时重试）。")
+
+def run_batch(client, annotations, journal, poll_interval):
+    """批量模式: 待标注样本写成 Gemini Batch JSONL 提交，轮询结束后写回标注文件。命中响应缓存的样本不再提交。"""
+    state = batch_annotate.BatchState(ANNOTATIONS_FILE)
+    # 先收取上次中断时已提交的批量任务，避免重复提交
+    for job_name in state.unfinished("gemini", MODEL_NAME):
+        print(f"继续等待上次提交的批量任务 {job_name}...")
+        ingest_batch(client, state, job_name, annotations, journal, poll_interval)
+
+    image_hashes_by_id = {}
+
+    def pending_requests():
+        manifest = get_manifest()
+        for app_name in manifest.apps():
+            for sample_id in manifest.sample_ids(app_name):
+                if 'ai' in annotations.get(app_name, {}).get(sample_id, {}): continue
+                image_paths = find_image_paths(app_name, sample_id)
+                if not all(image_paths.values()): print(f"  -> 跳过 {app_name}/{sample_id}: 未能找到全部三张图片。"); continue
+                try:
+                    images = [image_preprocess.preprocess_image(image_paths[state_name]) for state_name in ('before', 'current', 'after')]
+                except IOError as e:
+                    print(f"  -> 跳过 {app_name}/{sample_id}: 读取图片文件时出错。错误: {e}"); continue
+                image_hashes = [response_cache.sha256_bytes(image.data) for image in images]
+                raw_text = RESPONSE_CACHE.get(response_cache.make_key(MODEL_NAME, PROMPT_INSTRUCTIONS, image_hashes))
+                if raw_text is not None:
+                    ai_result = parse_ai_response(raw_text)
+                    if ai_result:
+                        annotations[app_name][sample_id]['ai'] = ai_result
+                        journal.append(app_name, sample_id, 'ai', ai_result)
+                        continue
+                custom_id = batch_annotate.make_custom_id(app_name, sample_id)
+                image_hashes_by_id[custom_id] = image_hashes
+                yield custom_id, batch_annotate.gemini_request_line(custom_id, [(image.data, image.mime) for image in images], PROMPT_INSTRUCTIONS)
+
+    path_prefix = os.path.join("batches", os.path.splitext(os.path.basename(ANNOTATIONS_FILE))[0])
+    batch_files = batch_annotate.write_batch_files(pending_requests(), path_prefix)
+    if not batch_files:
+        print("没有需要批量提交的样本。")
+        return
+    submitted = []
+    for path, custom_ids in batch_files:
+        job_name = batch_annotate.submit_gemini_batch(client, MODEL_NAME, path)
+        state.add(job_name, "gemini", MODEL_NAME, path, {cid: image_hashes_by_id[cid] for cid in custom_ids})
+        submitted.append(job_name)
+    for job_name in submitted:
+        ingest_batch(client, state, job_name, annotations, journal, poll_interval)
+
 if __name__ == "__main__":
-    if not GOOGLE_API_KEY or "YOUR_GOOGLE_AI_API_KEY_HERE" in GOOGLE_API_KEY:
+    parser = argparse.ArgumentParser(description="使用 Gemini 对样本进行性能标注。")
+    parser.add_argument("--batch", action="store_true", help="通过 Gemini Batch API 提交待标注样本（约半价），轮询完成后写回标注文件。")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="批量模式下查询任务状态的间隔秒数。")
+    parser.add_argument("--base-url", help="Gemini API 地址，离线测试批量模式时指向 mock_batch_server.py (例如 http://127.0.0.1:8765)。")
+    args = parser.parse_args()
+    # 指向本机的 mock_batch_server.py 时不需要真实的 API 密钥
+    is_local = bool(args.base_url) and args.base_url.startswith(("http://127.0.0.1", "http://localhost"))
+    if not is_local and (not GOOGLE_API_KEY or "YOUR_GOOGLE_AI_API_KEY_HERE" in GOOGLE_API_KEY):
         print("错误: 请在auto_annotate.py文件中将 'YOUR_GOOGLE_AI_API_KEY_HERE' 替换为您的真实Google AI API密钥。")
     else:
-        client = genai.Client(api_key=GOOGLE_API_KEY)
+        http_options = types.HttpOptions(base_url=args.base_url) if args.base_url else None
+        client = genai.Client(api_key=GOOGLE_API_KEY, http_options=http_options)
         print("开始AI性能标注流程 (包含解决方案)...")
         annotations = load_annotations()
-        app_dirs = [d for d in os.listdir(IMAGE_DATA_ROOT) if os.path.isdir(os.path.join(IMAGE_DATA_ROOT, d))]
-        for app_name in app_dirs:
-            sample_ids = set(f.split('__')[0] for f in os.listdir(os.path.join(IMAGE_DATA_ROOT, app_name)) if f.lower().endswith('.png'))
-            for sample_id in sorted(list(sample_ids)):
-                if 'ai' in annotations.get(app_name, {}).get(sample_id, {}):
-                    print(f"跳过 {app_name}/{sample_id}: 已有AI标注结果。")
-                    continue
-                ai_result = annotate_sample_with_ai(client, app_name, sample_id)
-                if ai_result:
-                    annotations[app_name][sample_id]['ai'] = ai_result
-                    save_annotations(annotations)
-                time.sleep(2) 
+        journal = result_journal.ResultJournal(ANNOTATIONS_FILE)
+        try:
+            if args.batch:
+                run_batch(client, annotations, journal, args.poll_interval)
+            else:
+                run_sequential(client, annotations, journal)
+        finally:
+            # 压缩: 把日志合并进标注文件，然后清空日志
+            journal.close()
+            save_annotations(annotations)
+            journal.truncate()
+        print(RESPONSE_CACHE.summary())
         print("\nAI性能标注流程结束。")
\ No newline at end of file
@@ -3,11 +3,14 @@
 import os
 import json
 import time
-import glob
 import base64
 import argparse # 新增：用于命令行参数解析
 from collections import defaultdict
 from openai import OpenAI
+import rate_limiter # 共用的自适应限速器
+import result_journal # 追加式结果日志
+import response_cache # 按内容寻址的响应缓存
+import sample_manifest # 预先构建的样本清单
 
 # --- 配置 (OpenAI / OpenRouter) ---
 # 请将此处的 YOUR_OPENROUTER_API_KEY_HERE 替换为你的实际 OpenRouter API 密钥
@@ -18,6 +21,8 @@ OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 # --- 常量 ---
 IMAGE_DATA_ROOT = "overlap_visualizations_3_sampled_complete"
+ORIGINAL_CURRENT_ROOT = r"D:\Code\HapTest\day10_simple" # 原始 current 截图目录（所有脚本共用同一份清单）
+RESPONSE_CACHE = response_cache.ResponseCache() # 以模型、Prompt 和图片哈希为键
 
 # --- 模型配置映射 ---
 MODEL_CONFIGS = {
@@ -78,6 +83,12 @@ def deep_defaultdict(): return defaultdict(deep_defaultdict)
 
 # 传入 annotations_file 参数
 def load_annotations(annotations_file):
+    # 先读取快照，再回放上次压缩之后追加到日志中的结果
+    annotations = load_annotations_snapshot(annotations_file)
+    result_journal.replay_journal(annotations, annotations_file)
+    return annotations
+
+def load_annotations_snapshot(annotations_file):
     if not os.path.exists(annotations_file): return deep_defaultdict()
     try:
         with open(annotations_file, 'r', encoding='utf-8') as f: data = json.load(f)
@@ -98,20 +109,30 @@ def save_annotations(data, annotations_file):
         if isinstance(item, defaultdict): return {k: convert_to_dict(v) for k, v in item.items()}
         return item
     regular_dict = convert_to_dict(data)
-    with open(annotations_file, 'w', encoding='utf-8') as f: json.dump(regular_dict, f, indent=4, ensure_ascii=False)
+    result_journal.write_json_atomic(regular_dict, annotations_file)
+
+_manifest = None
+
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = sample_manifest.load_manifest(IMAGE_DATA_ROOT, original_root=ORIGINAL_CURRENT_ROOT)
+    return _manifest
 
 def find_image_paths(app_name, sample_id):
-    paths = {};
-    for state in ['before', 'current', 'after']:
-        pattern = os.path.join(IMAGE_DATA_ROOT, app_name, f"{sample_id}__{state}*.png")
-        found_files = glob.glob(pattern);
-        if found_files: paths[state] = found_files[0]
-        else: paths[state] = None
-    return paths
+    # 从预先构建的清单中查找，不再对每个状态执行一次 glob
+    return get_manifest().image_paths(app_name, sample_id)
 
 def encode_image(image_path):
+    # 返回 base64 编码以及原始字节的 SHA-256（用作响应缓存的键）
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        image_bytes = image_file.read()
+    return base64.b64encode(image_bytes).decode('utf-8'), response_cache.sha256_bytes(image_bytes)
+
+def get_rate_limiter(model_name):
+    # 可在 MODEL_CONFIGS 中通过可选的 "rpm"/"tpm" 键为每个模型单独配置限速
+    config = next((c for c in MODEL_CONFIGS.values() if c["model_name"] == model_name), {})
+    return rate_limiter.get_limiter("openrouter", model_name, rpm=config.get("rpm"), tpm=config.get("tpm"))
 
 # 传入 model_name 参数
 def annotate_sample_with_ai(client, app_name, sample_id, model_name):
@@ -120,12 +141,14 @@ def annotate_sample_with_ai(client, app_name, sample_id, model_name):
     if not all(image_paths.values()): print(f"  -> 跳过: 未能找到全部三张图片。"); return None
 
     messages_content = []
+    image_hashes = []
     messages_content.append({"type": "text", "text": PROMPT_INSTRUCTIONS})
 
     try:
         for state in ['before', 'current', 'after']:
             if image_paths[state]:
-                base64_image = encode_image(image_paths[state])
+                base64_image, image_hash = encode_image(image_paths[state])
+                image_hashes.append(image_hash)
                 messages_content.append({
                     "type": "image_url",
                     "image_url": {
@@ -137,21 +160,27 @@ def annotate_sample_with_ai(client, app_name, sample_id, model_name):
         return None
 
     try:
-        completion = client.chat.completions.create(
-            model=model_name, # 使用传入的模型名称
-            messages=[
-                {
-                    "role": "user",
-                    "content": messages_content
-                }
-            ],
-            extra_headers={
-                "HTTP-Referer": "https://your-app-domain.com",
-                "X-Title": "Mobile App Performance Annotation Tool",
-            },
-            timeout=180.0
-        )
-        raw_text = completion.choices[0].message.content
+        cache_key = response_cache.make_key(model_name, PROMPT_INSTRUCTIONS, image_hashes)
+        raw_text = RESPONSE_CACHE.get(cache_key)
+        if raw_text is not None:
+            print("  -> 命中缓存: 复用已保存的响应。")
+        else:
+            limiter = get_rate_limiter(model_name)
+            completion = limiter.call(lambda: client.chat.completions.create(
+                model=model_name, # 使用传入的模型名称
+                messages=[
+                    {
+                        "role": "user",
+                        "content": messages_content
+                    }
+                ],
+                extra_headers={
+                    "HTTP-Referer": "https://your-app-domain.com",
+                    "X-Title": "Mobile App Performance Annotation Tool",
+                },
+                timeout=180.0
+            ), tokens=rate_limiter.estimate_tokens(PROMPT_INSTRUCTIONS, n_images=3))
+            raw_text = completion.choices[0].message.content
 
         first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
         if first_brace == -1 or last_brace == -1:
@@ -164,6 +193,7 @@ def annotate_sample_with_ai(client, app_name, sample_id, model_name):
             result['annotator'] = 'AI'
             result['model_used'] = model_name # 记录使用的模型名称
             result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            RESPONSE_CACHE.put(cache_key, raw_text, model_name)
             return result
         else:
             print(f"  -> 解析错误: AI响应的JSON无效或缺少键。响应: {raw_text}"); return None
@@ -204,19 +234,25 @@ if __name__ == "__main__":
         print(f"开始AI性能标注流程 (模型: {selected_model_name}, 标注文件: {selected_annotations_file})...")
         annotations = load_annotations(selected_annotations_file) # 传入标注文件路径
         
-        app_dirs = [d for d in os.listdir(IMAGE_DATA_ROOT) if os.path.isdir(os.path.join(IMAGE_DATA_ROOT, d))]
-        for app_name in app_dirs:
-            sample_ids = set(f.split('__')[0] for f in os.listdir(os.path.join(IMAGE_DATA_ROOT, app_name)) if f.lower().endswith('.png'))
-            for sample_id in sorted(list(sample_ids)):
-                # 检查当前模型是否已经标注过这个样本
-                if 'ai' in annotations.get(app_name, {}).get(sample_id, {}) and \
-                   annotations[app_name][sample_id]['ai'].get('model_used') == selected_model_name:
-                    print(f"跳过 {app_name}/{sample_id}: 已有模型 {selected_model_name} 的AI标注结果。")
-                    continue
+        journal = result_journal.ResultJournal(selected_annotations_file)
+        try:
+            manifest = get_manifest()
+            for app_name in manifest.apps():
+                for sample_id in manifest.sample_ids(app_name):
+                    # 检查当前模型是否已经标注过这个样本
+                    if 'ai' in annotations.get(app_name, {}).get(sample_id, {}) and \
+                       annotations[app_name][sample_id]['ai'].get('model_used') == selected_model_name:
+                        print(f"跳过 {app_name}/{sample_id}: 已有模型 {selected_model_name} 的AI标注结果。")
+                        continue
                 
-                ai_result = annotate_sample_with_ai(client, app_name, sample_id, selected_model_name) # 传入模型名称
-                if ai_result:
-                    annotations[app_name][sample_id]['ai'] = ai_result
-                    save_annotations(annotations, selected_annotations_file) # 传入标注文件路径
-                time.sleep(2) # 保持休眠，避免频繁请求导致API限速
+                    ai_result = annotate_sample_with_ai(client, app_name, sample_id, selected_model_name) # 传入模型名称
+                    if ai_result:
+                        annotations[app_name][sample_id]['ai'] = ai_result
+                        journal.append(app_name, sample_id, 'ai', ai_result) # 每个样本只追加一行，不再重写整个文件
+        finally:
+            # 压缩: 把日志合并进标注文件，然后清空日志
+            journal.close()
+            save_annotations(annotations, selected_annotations_file)
+            journal.truncate()
+        print(RESPONSE_CACHE.summary())
         print("\nAI性能标注流程结束。")
\ No newline at end of file
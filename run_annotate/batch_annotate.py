@@ -0,0 +1,187 @@
+# batch_annotate.py (通过供应商 Batch API 批量提交标注请求)
+#
+# For a full dataset pass latency does not matter, but cost and throughput do. Batch mode
+# turns the pending samples of a runner into provider batch JSONL files (OpenAI batch
+# format for the chat-completions runners, Gemini batch format for the google-genai
+# runners), submits them, polls until they finish and hands every response back to the
+# runner to be parsed and journaled like a normal result.
+#
+# Submitted batches are recorded in `<annotations_file>.batches.json`, so an interrupted
+# run resumes polling the batches it already paid for instead of submitting them again.
+# mock_batch_server.py provides an offline stand-in for the OpenAI endpoints.
+
+import os
+import json
+import time
+import base64
+
+OPENAI_BATCH_ENDPOINT = "/v1/chat/completions"
+# OpenAI accepts up to 200 MB and 50,000 requests per batch input file; Gemini up to 2 GB.
+MAX_BATCH_FILE_BYTES = 190 * 1024 * 1024
+MAX_BATCH_REQUESTS = 50000
+OPENAI_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+GEMINI_TERMINAL_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+def make_custom_id(app_name, sample_id):
+    return f"{app_name}/{sample_id}"
+
+
+def split_custom_id(custom_id):
+    app_name, sample_id = custom_id.split('/', 1)
+    return app_name, sample_id
+
+
+class BatchState:
+    """Batches submitted for one annotations file, persisted as `<annotations_file>.batches.json`."""
+
+    def __init__(self, annotations_file):
+        self.path = os.path.splitext(annotations_file)[0] + ".batches.json"
+        self.batches = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.batches = json.load(f)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.batches, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, batch_id, provider, model_name, input_file, image_hashes):
+        """`image_hashes` maps custom_id -> image hashes, so ingested responses can be stored in the response cache."""
+        self.batches[batch_id] = {
+            "provider": provider, "model": model_name, "input_file": input_file,
+            "status": "submitted", "submitted_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "requests": image_hashes,
+        }
+        self.save()
+
+    def mark_done(self, batch_id, status):
+        self.batches[batch_id]["status"] = status
+        self.batches[batch_id]["requests"] = {}  # no longer needed once ingested
+        self.save()
+
+    def unfinished(self, provider, model_name):
+        return [batch_id for batch_id, b in self.batches.items()
+                if b["provider"] == provider and b["model"] == model_name and b["status"] == "submitted"]
+
+    def in_flight_custom_ids(self, provider, model_name):
+        return {cid for batch_id in self.unfinished(provider, model_name) for cid in self.batches[batch_id]["requests"]}
+
+
+def write_batch_files(lines, path_prefix, max_bytes=MAX_BATCH_FILE_BYTES, max_requests=MAX_BATCH_REQUESTS):
+    """
+    Writes (custom_id, request_dict) pairs into one or more JSONL files that respect the
+    provider's size limits. Returns a list of (path, [custom_ids]).
+    """
+    directory = os.path.dirname(path_prefix)
+    if directory: os.makedirs(directory, exist_ok=True)
+    files = []
+    f, size, custom_ids = None, 0, []
+    for custom_id, request in lines:
+        line = (json.dumps(request, ensure_ascii=False) + "\n").encode('utf-8')
+        if f is not None and (size + len(line) > max_bytes or len(custom_ids) >= max_requests):
+            f.close()
+            f = None
+        if f is None:
+            path = f"{path_prefix}.{time.strftime('%Y%m%d_%H%M%S')}.{len(files):03d}.jsonl"
+            f, size, custom_ids = open(path, 'wb'), 0, []
+            files.append((path, custom_ids))
+        f.write(line)
+        size += len(line)
+        custom_ids.append(custom_id)
+    if f is not None:
+        f.close()
+    return files
+
+
+# --- OpenAI batch format ---
+
+def openai_request_line(custom_id, model_name, messages_content):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": OPENAI_BATCH_ENDPOINT,
+        "body": {"model": model_name, "messages": [{"role": "user", "content": messages_content}]},
+    }
+
+
+def submit_openai_batch(client, path):
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=OPENAI_BATCH_ENDPOINT, completion_window="24h")
+    print(f"  -> Submitted batch {batch.id} ({os.path.basename(path)}).")
+    return batch.id
+
+
+def wait_openai_batch(client, batch_id, poll_interval=60.0):
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+        print(f"  -> Batch {batch_id}: {batch.status}{progress}")
+        if batch.status in OPENAI_TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def iter_openai_batch_results(client, batch):
+    """Yields (custom_id, raw_text, error). raw_text is None when the request failed."""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id: continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip(): continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                choices = response.get("body", {}).get("choices") or [{}]
+                yield record["custom_id"], choices[0].get("message", {}).get("content"), None
+            else:
+                yield record["custom_id"], None, record.get("error") or response.get("body")
+
+
+# --- Gemini batch format ---
+
+def gemini_request_line(custom_id, images, prompt_text):
+    """`images` are (bytes, mime_type) pairs, e.g. from image_preprocess.PreparedImage. Same part order as the live runners: the three images followed by the prompt."""
+    parts = [{"inline_data": {"mime_type": mime_type, "data": base64.b64encode(data).decode('utf-8')}} for data, mime_type in images]
+    parts.append({"text": prompt_text})
+    return {"key": custom_id, "request": {"contents": [{"role": "user", "parts": parts}]}}
+
+
+def submit_gemini_batch(client, model_name, path):
+    uploaded = client.files.upload(file=path, config={"display_name": os.path.basename(path), "mime_type": "jsonl"})
+    job = client.batches.create(model=model_name, src=uploaded.name, config={"display_name": os.path.basename(path)})
+    print(f"  -> Submitted batch {job.name} ({os.path.basename(path)}).")
+    return job.name
+
+
+def wait_gemini_batch(client, job_name, poll_interval=60.0):
+    while True:
+        job = client.batches.get(name=job_name)
+        state = getattr(job.state, "name", str(job.state))
+        print(f"  -> Batch {job_name}: {state}")
+        if state in GEMINI_TERMINAL_STATES:
+            return job
+        time.sleep(poll_interval)
+
+
+def iter_gemini_batch_results(client, job):
+    """Yields (custom_id, raw_text, error) from a finished file-based Gemini batch job."""
+    dest = getattr(job, "dest", None)
+    if not dest or not getattr(dest, "file_name", None):
+        return
+    content = client.files.download(file=dest.file_name)
+    for line in content.decode('utf-8').splitlines():
+        if not line.strip(): continue
+        record = json.loads(line)
+        response = record.get("response")
+        if not response:
+            yield record.get("key"), None, record.get("error") or record.get("status")
+            continue
+        candidates = response.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        yield record.get("key"), "".join(p.get("text", "") for p in parts), None
@@ -1,23 +1,35 @@
 import json
 import os
+import annotation_columns
+import annotation_query
 
 # 定义输入和输出文件路径
 INPUT_FILE = 'Benchmark/benchmark_full.json'
 OUTPUT_FILE = 'Benchmark/benchmark_false.json'
+# 也可以直接从 annotation_columns.py 导出的列式文件 (.npz/.parquet) 计算，不再读取 INPUT_FILE
+INPUT_COLUMNS = None
+# 列式输入时的筛选条件 (annotation_query.py 语法)，与下面对 JSON 的筛选相同
+COLUMNS_QUERY = 'ai_yes_count>=2 & human=false'
 
 def filter_benchmark_data(input_path, output_path):
     """
     筛选 benchmark_full.json 中 AI 标注数量 >= 2 且 human 为 false 的样本。
 
     Args:
-        input_path (str): 输入 JSON 文件的路径 (benchmark_full.json)。
+        input_path (str): 输入 JSON 文件的路径 (benchmark_full.json)，或列式导出文件 (.npz/.parquet)。
         output_path (str): 输出 JSON 文件的路径 (benchmark_false.json)。
     """
     filtered_data = {}
 
     try:
-        with open(input_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if input_path.endswith(('.npz', '.parquet')):
+            # 直接在位图索引上求交集，得到与下面相同的 {app: {sample: {ai: [...], human: bool}}}
+            index = annotation_query.AnnotationIndex(annotation_columns.load_columns(input_path))
+            filtered_data = annotation_query.benchmark_json(index.entries(index.query(COLUMNS_QUERY)))
+            data = {}
+        else:
+            with open(input_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
     except FileNotFoundError:
         print(f"错误: 未找到文件 {input_path}。请确保文件存在。")
         return
@@ -25,7 +37,7 @@ def filter_benchmark_data(input_path, output_path):
         print(f"错误: 文件 {input_path} 不是有效的 JSON 格式。")
         return
 
-    count_filtered_samples = 0
+    count_filtered_samples = sum(len(samples) for samples in filtered_data.values())
 
     for app, samples in data.items():
         for sample_name, info in samples.items():
@@ -47,4 +59,4 @@ def filter_benchmark_data(input_path, output_path):
     print(f"筛选结果已保存到: {output_path}")
 
 if __name__ == "__main__":
-    filter_benchmark_data(INPUT_FILE, OUTPUT_FILE)
\ No newline at end of file
+    filter_benchmark_data(INPUT_COLUMNS or INPUT_FILE, OUTPUT_FILE)
\ No newline at end of file
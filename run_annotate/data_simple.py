@@ -1,30 +1,147 @@
 import os
+import sys
 import json
+import time
+import errno
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 benchmark_path = 'Benchmark/benchmark_full.json'
 source_root = 'overlap_visualizations_3_sampled_complete'
 target_root = 'simple_benchmark_vis'
+# 抽取方式: 'auto' 依次尝试硬链接、reflink (写时复制克隆，需 btrfs/XFS 等支持)，都不行再复制；
+# 也可以固定为 'hardlink' / 'reflink' / 'symlink' / 'copy'。除 'copy' 外不再占用额外磁盘空间，
+# 失败时 (例如跨设备、文件系统不支持) 该文件退回复制
+link_mode = 'auto'
+# 需要真正复制的文件交给线程池并行处理
+copy_workers = 8
 
-with open(benchmark_path, 'r', encoding='utf-8') as f:
-    benchmark = json.load(f)
-
-for app, samples in benchmark.items():
-    app_src_dir = os.path.join(source_root, app)
-    app_dst_dir = os.path.join(target_root, app)
-    if not os.path.exists(app_src_dir):
-        print(f"源目录不存在: {app_src_dir}")
-        continue
-    os.makedirs(app_dst_dir, exist_ok=True)
-    sample_prefixes = set(samples.keys())
-    for fname in os.listdir(app_src_dir):
-        for sample in sample_prefixes:
-            if fname.startswith(sample):
-                src_file = os.path.join(app_src_dir, fname)
-                dst_file = os.path.join(app_dst_dir, fname)
-                if os.path.isfile(src_file):
-                    shutil.copy2(src_file, dst_file)
-                break  # 一个文件只匹配一个sample前缀即可
-    print(f"已复制 {app_src_dir} -> {app_dst_dir}")
-
-print("全部抽取完成！") 
\ No newline at end of file
+FICLONE = 0x40049409  # Linux ioctl: 让 dst 共享 src 的数据块
+
+_unsupported = set()  # 本次运行中已确认不可用的方式 (如硬链接遇到跨设备)，之后不再尝试
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflink is only implemented for Linux")
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+_LINKERS = {
+    'hardlink': os.link,
+    'reflink': _reflink,
+    'symlink': lambda src, dst: os.symlink(os.path.abspath(src), dst),
+}
+_AUTO_ORDER = ('hardlink', 'reflink')
+
+
+def _is_linked(src, dst):
+    try:
+        return os.path.samefile(src, dst)
+    except OSError:
+        return False
+
+
+def _same_copy(src, dst):
+    """dst 是大小和修改时间都与 src 相同的副本"""
+    try:
+        s, d = os.stat(src), os.lstat(dst)
+    except OSError:
+        return False
+    return s.st_size == d.st_size and s.st_mtime_ns == d.st_mtime_ns
+
+
+def link_file(src, dst, mode=link_mode):
+    """按 mode 把 src 放到 dst。返回实际使用的方式，或 None 表示需要复制"""
+    for method in (_AUTO_ORDER if mode == 'auto' else (mode,) if mode != 'copy' else ()):
+        if method in _unsupported: continue
+        try:
+            _LINKERS[method](src, dst)
+            return method
+        except OSError as e:
+            # 这些错误说明该方式在此文件系统上整体不可用，其余错误只让这一个文件退回复制
+            if e.errno in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+                _unsupported.add(method)
+    return None
+
+
+def copy_file(src, dst):
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def build_prefix_index(samples):
+    """
+    {长度: {该长度的sample前缀}}。文件名只需对每个出现过的前缀长度查一次集合，
+    不再和每个 sample 逐一比较 startswith
+    """
+    index = {}
+    for sample in samples:
+        index.setdefault(len(sample), set()).add(sample)
+    return sorted(index.items())
+
+
+def matches_prefix(fname, prefix_index):
+    return any(fname[:length] in prefixes for length, prefixes in prefix_index if length <= len(fname))
+
+
+def extract(benchmark, source_root, target_root, mode=link_mode, workers=copy_workers):
+    counts = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for app, samples in benchmark.items():
+            app_src_dir = os.path.join(source_root, app)
+            app_dst_dir = os.path.join(target_root, app)
+            if not os.path.exists(app_src_dir):
+                print(f"源目录不存在: {app_src_dir}")
+                continue
+            os.makedirs(app_dst_dir, exist_ok=True)
+            prefix_index = build_prefix_index(samples.keys())
+            n_app = 0
+            with os.scandir(app_src_dir) as entries:
+                for entry in entries:
+                    if not matches_prefix(entry.name, prefix_index) or not entry.is_file(): continue
+                    src_file = entry.path
+                    dst_file = os.path.join(app_dst_dir, entry.name)
+                    n_app += 1
+                    exists = os.path.lexists(dst_file)
+                    # 链接模式下，之前复制出来的文件也要换成链接才能省下空间；'copy' 模式下相同的副本直接跳过
+                    if exists and (_is_linked(src_file, dst_file) or (mode == 'copy' and _same_copy(src_file, dst_file))):
+                        counts['unchanged'] = counts.get('unchanged', 0) + 1
+                        continue
+                    # 已存在的目标先链接到临时文件再替换，链接不可用时不会丢掉一个仍然有效的副本
+                    tmp_file = f"{dst_file}.tmp{os.getpid()}" if exists else dst_file
+                    method = link_file(src_file, tmp_file, mode)
+                    if method:
+                        if exists: os.replace(tmp_file, dst_file)
+                        counts[method] = counts.get(method, 0) + 1
+                    elif exists and _same_copy(src_file, dst_file):
+                        counts['unchanged'] = counts.get('unchanged', 0) + 1
+                    else:
+                        if exists: os.remove(dst_file)
+                        pending.append(pool.submit(copy_file, src_file, dst_file))
+            print(f"已抽取 {app_src_dir} -> {app_dst_dir} ({n_app} 个文件)")
+        for future in pending:
+            method = future.result()
+            counts[method] = counts.get(method, 0) + 1
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    detail = ", ".join(f"{k}: {v}" for k, v in sorted(counts.items()))
+    print(f"共 {total} 个文件 ({detail})，用时 {elapsed:.2f}s，{total / elapsed if elapsed > 0 else 0:.1f} 个文件/秒")
+    return counts
+
+
+if __name__ == "__main__":
+    with open(benchmark_path, 'r', encoding='utf-8') as f:
+        benchmark = json.load(f)
+    extract(benchmark, source_root, target_root)
+    print("全部抽取完成！")
@@ -3,11 +3,16 @@
 import os
 import json
 import time
-import glob
 import base64
 import argparse
 from collections import defaultdict
 from openai import OpenAI
+import rate_limiter
+import result_journal
+import annotation_store
+import response_cache
+import sample_manifest
+import image_preprocess
 
 # --- Configuration (OpenAI / OpenRouter) ---
 # Please replace YOUR_OPENROUTER_API_KEY_HERE with your actual OpenRouter API key
@@ -18,9 +23,14 @@ OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 # --- Constants ---
 IMAGE_DATA_ROOT = "overlap_visualizations_3_sampled_complete"
+ORIGINAL_CURRENT_ROOT = r"D:\Code\HapTest\day10_simple" # original (non-visualized) screenCap images
+RESPONSE_CACHE = response_cache.ResponseCache() # keyed by model, prompt and image hashes
+PREPROCESS_CACHE_DIR = image_preprocess.default_cache_dir(IMAGE_DATA_ROOT)
 ANNOTATIONS_DIR = "annotations_2" # 标注文件存放目录
 
     # --- Model Configuration Mapping ---
+# Optional per-model keys: "rpm"/"tpm" (rate limits) and "preprocess", e.g.
+# {"max_edge": 1280, "format": "JPEG", "quality": 85} to downscale and recompress screenshots before upload.
 MODEL_CONFIGS = {
     "openai": {
         "model_name": "openai/gpt-4o-mini",
@@ -106,6 +116,12 @@ Your response **must** be a single, valid JSON object, without any other explana
 def deep_defaultdict(): return defaultdict(deep_defaultdict)
 
 def load_annotations(annotations_file):
+    # Snapshot first, then replay results journaled since the last compaction
+    annotations = load_annotations_snapshot(annotations_file)
+    result_journal.replay_journal(annotations, annotations_file)
+    return annotations
+
+def load_annotations_snapshot(annotations_file):
     if not os.path.exists(annotations_file): return deep_defaultdict()
     try:
         with open(annotations_file, 'r', encoding='utf-8') as f: data = json.load(f)
@@ -127,41 +143,34 @@ def save_annotations(data, annotations_file):
         if isinstance(item, defaultdict): return {k: convert_to_dict(v) for k, v in item.items()}
         return item
     regular_dict = convert_to_dict(data)
-    with open(annotations_file, 'w', encoding='utf-8') as f: json.dump(regular_dict, f, indent=4, ensure_ascii=False)
+    result_journal.write_json_atomic(regular_dict, annotations_file)
 
-def find_image_paths(app_name, sample_id):
-    """
-    Finds the path for the 'current' image.
-    'before' and 'after' images are no longer needed for this modified script.
-    """
-    paths = {}
-    # Only look for the 'current' image
-    pattern = os.path.join(IMAGE_DATA_ROOT, app_name, f"{sample_id}__current*.png")
-    found_files = glob.glob(pattern)
-    if found_files:
-        paths['current'] = found_files[0]
+_manifest = None
+
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = sample_manifest.load_manifest(IMAGE_DATA_ROOT, original_root=ORIGINAL_CURRENT_ROOT)
+    return _manifest
 
-    import re
-    if paths['current']:
-        current_path = paths['current']
-        current_filename = os.path.basename(current_path)
-        # 匹配 screenCap_数字.png
-        match = re.search(r"(screenCap_\d+)\.png", current_filename)
-        if match:
-            screen_cap_name = match.group(1) + ".png"
-            # 构造原始current图片路径
-            orig_current_path = os.path.join(r"D:\Code\HapTest\day10_simple", app_name, screen_cap_name)
-            if os.path.exists(orig_current_path):
-                paths['current'] = orig_current_path
+def find_image_paths(app_name, sample_id):
+    # Resolved from the prebuilt manifest instead of one glob per state; 'current' is swapped for the original screenCap image when it exists
+    return get_manifest().image_paths(app_name, sample_id, states=('current',), use_original_current=True)
 
-    # for state in ['before', 'current', 'after']:
-    #     print(f"  {state}: {paths.get(state)}")
+def encode_image(image_path, model_name):
+    # Returns the base64 payload, the SHA-256 of the bytes sent (used as response cache key) and their MIME type.
+    # Images are downscaled/recompressed first when the model's config has a "preprocess" entry.
+    prepared = image_preprocess.preprocess_image(image_path, get_model_config(model_name).get("preprocess"), PREPROCESS_CACHE_DIR)
+    image_preprocess.record(model_name, prepared)
+    return base64.b64encode(prepared.data).decode('utf-8'), response_cache.sha256_bytes(prepared.data), prepared.mime
 
-    return paths
+def get_model_config(model_name):
+    return next((c for c in MODEL_CONFIGS.values() if c["model_name"] == model_name), {})
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def get_rate_limiter(model_name):
+    # Per-model RPM/TPM can be set with optional "rpm"/"tpm" keys in MODEL_CONFIGS.
+    config = get_model_config(model_name)
+    return rate_limiter.get_limiter("openrouter", model_name, rpm=config.get("rpm"), tpm=config.get("tpm"))
 
 def annotate_sample_with_ai(client, app_name, sample_id, model_name):
     print(f"Processing: {app_name} / {sample_id} (Model: {model_name})")
@@ -173,16 +182,18 @@ def annotate_sample_with_ai(client, app_name, sample_id, model_name):
         return None
 
     messages_content = []
+    image_hashes = []
     messages_content.append({"type": "text", "text": PROMPT_INSTRUCTIONS})
 
     try:
         # Only process the 'current' image
         current_image_path = image_paths['current']
-        base64_image = encode_image(current_image_path)
+        base64_image, image_hash, mime_type = encode_image(current_image_path, model_name)
+        image_hashes.append(image_hash)
         messages_content.append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/png;base64,{base64_image}"
+                "url": f"data:{mime_type};base64,{base64_image}"
             }
         })
     except IOError as e:
@@ -190,21 +201,27 @@ def annotate_sample_with_ai(client, app_name, sample_id, model_name):
         return None
 
     try:
-        completion = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {
-                    "role": "user",
-                    "content": messages_content
-                }
-            ],
-            extra_headers={
-                "HTTP-Referer": "https://your-app-domain.com",
-                "X-Title": "Mobile App Performance Annotation Tool",
-            },
-            timeout=240.0
-        )
-        raw_text = completion.choices[0].message.content
+        cache_key = response_cache.make_key(model_name, PROMPT_INSTRUCTIONS, image_hashes)
+        raw_text = RESPONSE_CACHE.get(cache_key)
+        if raw_text is not None:
+            print("  -> Cache hit: reusing stored response.")
+        else:
+            limiter = get_rate_limiter(model_name)
+            completion = limiter.call(lambda: client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": messages_content
+                    }
+                ],
+                extra_headers={
+                    "HTTP-Referer": "https://your-app-domain.com",
+                    "X-Title": "Mobile App Performance Annotation Tool",
+                },
+                timeout=240.0
+            ), tokens=rate_limiter.estimate_tokens(PROMPT_INSTRUCTIONS, n_images=1))
+            raw_text = completion.choices[0].message.content
 
         first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
         if first_brace == -1 or last_brace == -1:
@@ -217,6 +234,7 @@ def annotate_sample_with_ai(client, app_name, sample_id, model_name):
             result['annotator'] = 'AI'
             result['model_used'] = model_name
             result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            RESPONSE_CACHE.put(cache_key, raw_text, model_name)
             return result
         else:
             print(f"  -> Parsing error: AI response JSON is invalid or missing keys. Response: {raw_text}"); return None
@@ -236,12 +254,21 @@ if __name__ == "__main__":
         required=True,
         help=f"Specify the model type to use. Options: {', '.join(MODEL_CONFIGS.keys())}"
     )
+    parser.add_argument(
+        "--store",
+        type=str,
+        help="SQLite annotation store (see annotation_store.py) to read and write instead of the JSON annotations file."
+    )
     args = parser.parse_args()
 
     selected_config = MODEL_CONFIGS.get(args.model)
     if not selected_config:
         print(f"Error: Unsupported model type '{args.model}'.")
         exit(1)
+    try:
+        image_preprocess.validate_settings(selected_config.get("preprocess"))
+    except ValueError as e:
+        parser.error(f"MODEL_CONFIGS[{args.model!r}]: {e}")
     
     selected_model_name = selected_config["model_name"]
     selected_annotations_file = os.path.join(ANNOTATIONS_DIR, selected_config["annotations_file"])
@@ -254,20 +281,35 @@ if __name__ == "__main__":
             base_url=OPENROUTER_BASE_URL,
             api_key=OPENAI_API_KEY,
         )
-        print(f"Starting AI performance annotation process (Model: {selected_model_name}, Annotation File: {selected_annotations_file})...")
-        annotations = load_annotations(selected_annotations_file)
-        
-        app_dirs = [d for d in os.listdir(IMAGE_DATA_ROOT) if os.path.isdir(os.path.join(IMAGE_DATA_ROOT, d))]
-        for app_name in app_dirs:
-            sample_ids = set(f.split('__')[0] for f in os.listdir(os.path.join(IMAGE_DATA_ROOT, app_name)) if f.lower().endswith('.png'))
-            for sample_id in sorted(list(sample_ids)):
-                if 'ai' in annotations.get(app_name, {}).get(sample_id, {}) :
-                    print(f"Skipping {app_name}/{sample_id}: Already has AI annotation result for model {annotations[app_name][sample_id]['ai'].get('model_used')}.")
-                    continue
+        if args.store:
+            # Results are stored under the short model name (annotations_llama.json -> "llama"), like the merged files
+            store = annotation_store.AnnotationStore(args.store)
+            store_model = annotation_store.model_key_for_file(selected_annotations_file)
+            print(f"Starting AI performance annotation process (Model: {selected_model_name}, Store: {args.store} [{store_model}])...")
+            annotations = store.to_nested(model=store_model)
+            journal = store.writer(store_model)
+        else:
+            print(f"Starting AI performance annotation process (Model: {selected_model_name}, Annotation File: {selected_annotations_file})...")
+            annotations = load_annotations(selected_annotations_file)
+            journal = result_journal.ResultJournal(selected_annotations_file)
+        try:
+            manifest = get_manifest()
+            for app_name in manifest.apps():
+                for sample_id in manifest.sample_ids(app_name):
+                    if 'ai' in annotations.get(app_name, {}).get(sample_id, {}) :
+                        print(f"Skipping {app_name}/{sample_id}: Already has AI annotation result for model {annotations[app_name][sample_id]['ai'].get('model_used')}.")
+                        continue
                 
-                ai_result = annotate_sample_with_ai(client, app_name, sample_id, selected_model_name)
-                if ai_result:
-                    annotations[app_name][sample_id]['ai'] = ai_result
-                    save_annotations(annotations, selected_annotations_file)
-                time.sleep(1) # Keep a short delay to avoid rate limiting
+                    ai_result = annotate_sample_with_ai(client, app_name, sample_id, selected_model_name)
+                    if ai_result:
+                        annotations[app_name][sample_id]['ai'] = ai_result
+                        journal.append(app_name, sample_id, 'ai', ai_result)
+        finally:
+            # Compaction: fold the journal into the annotations file, then drop it (store writes are already in place)
+            journal.close()
+            if not args.store:
+                save_annotations(annotations, selected_annotations_file)
+                journal.truncate()
+        print(RESPONSE_CACHE.summary())
+        if image_preprocess.summary(): print(image_preprocess.summary())
         print("\nAI performance annotation process finished.")
\ No newline at end of file
@@ -3,11 +3,20 @@
 import os
 import json
 import time
-import glob
 import base64
+import asyncio
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from collections import defaultdict
 from openai import OpenAI
+import rate_limiter
+import result_journal
+import annotation_store
+import response_cache
+import sample_manifest
+import image_preprocess
+import batch_annotate
+import work_queue
 
 # --- Configuration (OpenAI / OpenRouter) ---
 # Please replace YOUR_OPENROUTER_API_KEY_HERE with your actual OpenRouter API key
@@ -16,11 +25,22 @@ OPENAI_API_KEY = "YOUR_OPENROUTER_API_KEY_HERE"
 # OpenRouter.ai specific configuration
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
+# Batch mode (--batch) talks to a provider batch API; OpenRouter has none, so this defaults to OpenAI directly.
+# Point --batch-base-url at mock_batch_server.py to test the flow offline.
+OPENAI_BATCH_API_KEY = "YOUR_OPENAI_API_KEY_HERE"
+OPENAI_BATCH_BASE_URL = "https://api.openai.com/v1"
+
 # --- Constants ---
 IMAGE_DATA_ROOT = "overlap_visualizations_3_sampled_complete"
+ORIGINAL_CURRENT_ROOT = r"D:\Code\HapTest\day10_simple" # original (non-visualized) screenCap images
+RESPONSE_CACHE = response_cache.ResponseCache() # keyed by model, prompt and image hashes
+PREPROCESS_CACHE_DIR = image_preprocess.default_cache_dir(IMAGE_DATA_ROOT)
 ANNOTATIONS_DIR = "annotations" # 标注文件存放目录
 
 # --- Model Configuration Mapping ---
+# Optional per-model keys: "rpm"/"tpm" (rate limits) and "preprocess", e.g.
+# {"max_edge": 1280, "format": "JPEG", "quality": 85} to downscale and recompress screenshots before upload.
+# --batch needs "batch_model_name" (the model id on the OpenAI batch API) for every model not under "openai/".
 MODEL_CONFIGS = {
     "openai": {
         "model_name": "openai/gpt-4o-mini",
@@ -82,6 +102,12 @@ Your response **must** be a single, valid JSON object, without any other explana
 def deep_defaultdict(): return defaultdict(deep_defaultdict)
 
 def load_annotations(annotations_file):
+    # Snapshot first, then replay results journaled since the last compaction
+    annotations = load_annotations_snapshot(annotations_file)
+    result_journal.replay_journal(annotations, annotations_file)
+    return annotations
+
+def load_annotations_snapshot(annotations_file):
     if not os.path.exists(annotations_file): return deep_defaultdict()
     try:
         with open(annotations_file, 'r', encoding='utf-8') as f: data = json.load(f)
@@ -103,119 +129,445 @@ def save_annotations(data, annotations_file):
         if isinstance(item, defaultdict): return {k: convert_to_dict(v) for k, v in item.items()}
         return item
     regular_dict = convert_to_dict(data)
-    with open(annotations_file, 'w', encoding='utf-8') as f: json.dump(regular_dict, f, indent=4, ensure_ascii=False)
+    result_journal.write_json_atomic(regular_dict, annotations_file)
+
+_manifest = None
+
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = sample_manifest.load_manifest(IMAGE_DATA_ROOT, original_root=ORIGINAL_CURRENT_ROOT)
+    return _manifest
 
 def find_image_paths(app_name, sample_id):
-    paths = {};
+    # Resolved from the prebuilt manifest instead of one glob per state; 'current' is swapped for the original screenCap image when it exists
+    return get_manifest().image_paths(app_name, sample_id, use_original_current=True)
+
+def encode_image(image_path, preprocess, model_names):
+    # Returns the base64 payload, the SHA-256 of the bytes sent (used as response cache key) and their MIME type.
+    # Images are downscaled/recompressed first when `preprocess` (a model's "preprocess" config) is set.
+    prepared = image_preprocess.preprocess_image(image_path, preprocess, PREPROCESS_CACHE_DIR)
+    for model_name in model_names:
+        image_preprocess.record(model_name, prepared)
+    return base64.b64encode(prepared.data).decode('utf-8'), response_cache.sha256_bytes(prepared.data), prepared.mime
+
+def get_model_config(model_name):
+    return next((c for c in MODEL_CONFIGS.values() if c["model_name"] == model_name), {})
+
+def get_rate_limiter(model_name):
+    # Per-model RPM/TPM can be set with optional "rpm"/"tpm" keys in MODEL_CONFIGS.
+    config = get_model_config(model_name)
+    return rate_limiter.get_limiter("openrouter", model_name, rpm=config.get("rpm"), tpm=config.get("tpm"))
+
+def build_message_content(image_paths, preprocess, model_names):
+    """Reads and encodes the three images once; the returned payload can be sent to any of `model_names`."""
+    messages_content = []
+    image_hashes = []
+    messages_content.append({"type": "text", "text": PROMPT_INSTRUCTIONS})
     for state in ['before', 'current', 'after']:
-        pattern = os.path.join(IMAGE_DATA_ROOT, app_name, f"{sample_id}__{state}*.png")
-        found_files = glob.glob(pattern);
-        if found_files: paths[state] = found_files[0]
-        else: paths[state] = None
-
-    import re
-    if paths['current']:
-        current_path = paths['current']
-        current_filename = os.path.basename(current_path)
-        # 匹配 screenCap_数字.png
-        match = re.search(r"(screenCap_\d+)\.png", current_filename)
-        if match:
-            screen_cap_name = match.group(1) + ".png"
-            # 构造原始current图片路径
-            orig_current_path = os.path.join(r"D:\Code\HapTest\day10_simple", app_name, screen_cap_name)
-            if os.path.exists(orig_current_path):
-                paths['current'] = orig_current_path
-
-    # for state in ['before', 'current', 'after']:
-    #     print(f"  {state}: {paths.get(state)}")
-
-    return paths
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        if image_paths[state]:
+            base64_image, image_hash, mime_type = encode_image(image_paths[state], preprocess, model_names)
+            image_hashes.append(image_hash)
+            messages_content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mime_type};base64,{base64_image}"
+                }
+            })
+    return messages_content, image_hashes
+
+def parse_ai_response(raw_text, model_name):
+    """Validates a raw model response and returns the annotation dict, or None after printing why it was rejected."""
+    first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
+    if first_brace == -1 or last_brace == -1:
+        print(f"  -> JSON parsing error ({model_name}): No valid JSON structure found in model response. Response: {raw_text}"); return None
+    json_str = raw_text[first_brace : last_brace + 1]
+    try:
+        result = json.loads(json_str)
+    except json.JSONDecodeError as e:
+        print(f"  -> JSON parsing error ({model_name}): Could not parse extracted string. Error: {e}. Extracted content: '{json_str}'"); return None
+
+    if isinstance(result, dict) and 'label' in result and 'reason' in result and 'solution' in result and result['label'] in ['Yes', 'No']:
+        print(f"  -> Success: AI classified as {result['label']} ({model_name}).")
+        result['annotator'] = 'AI'
+        result['model_used'] = model_name
+        result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        return result
+    else:
+        print(f"  -> Parsing error ({model_name}): AI response JSON is invalid or missing keys. Response: {raw_text}"); return None
+
+def request_annotation(client, model_name, messages_content, image_hashes):
+    try:
+        cache_key = response_cache.make_key(model_name, PROMPT_INSTRUCTIONS, image_hashes)
+        raw_text = RESPONSE_CACHE.get(cache_key)
+        if raw_text is not None:
+            print(f"  -> Cache hit: reusing stored response ({model_name}).")
+        else:
+            limiter = get_rate_limiter(model_name)
+            completion = limiter.call(lambda: client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": messages_content
+                    }
+                ],
+                extra_headers={
+                    "HTTP-Referer": "https://your-app-domain.com",
+                    "X-Title": "Mobile App Performance Annotation Tool",
+                },
+                timeout=240.0 # Increased timeout for potentially larger models
+            ), tokens=rate_limiter.estimate_tokens(PROMPT_INSTRUCTIONS, n_images=3))
+            raw_text = completion.choices[0].message.content
+
+        result = parse_ai_response(raw_text, model_name)
+        if result:
+            RESPONSE_CACHE.put(cache_key, raw_text, model_name)
+        return result
+    except Exception as e:
+        print(f"  -> API or other unknown error ({model_name}): {e}")
+        return None
 
 def annotate_sample_with_ai(client, app_name, sample_id, model_name):
     print(f"Processing: {app_name} / {sample_id} (Model: {model_name})")
     image_paths = find_image_paths(app_name, sample_id)
     if not all(image_paths.values()): print(f"  -> Skipping: Could not find all three images."); return None
 
-    messages_content = []
-    messages_content.append({"type": "text", "text": PROMPT_INSTRUCTIONS})
-
     try:
-        for state in ['before', 'current', 'after']:
-            if image_paths[state]:
-                base64_image = encode_image(image_paths[state])
-                messages_content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{base64_image}"
-                    }
-                })
+        messages_content, image_hashes = build_message_content(image_paths, get_model_config(model_name).get("preprocess"), [model_name])
     except IOError as e:
         print(f"  -> Skipping: Error reading image file. Error: {e}")
         return None
+    return request_annotation(client, model_name, messages_content, image_hashes)
 
-    try:
-        completion = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {
-                    "role": "user",
-                    "content": messages_content
-                }
-            ],
-            extra_headers={
-                "HTTP-Referer": "https://your-app-domain.com",
-                "X-Title": "Mobile App Performance Annotation Tool",
-            },
-            timeout=240.0 # Increased timeout for potentially larger models
-        )
-        raw_text = completion.choices[0].message.content
+def has_annotation(annotations, app_name, sample_id, model_name):
+    return 'ai' in annotations.get(app_name, {}).get(sample_id, {}) and \
+           annotations[app_name][sample_id]['ai'].get('model_used') == model_name
 
-        first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
-        if first_brace == -1 or last_brace == -1:
-            print(f"  -> JSON parsing error: No valid JSON structure found in model response. Response: {raw_text}"); return None
-        json_str = raw_text[first_brace : last_brace + 1]
-        result = json.loads(json_str)
+def iter_pending_samples(annotations, model_name):
+    """Yields (app_name, sample_id) pairs that still need an annotation from model_name."""
+    manifest = get_manifest()
+    for app_name in manifest.apps():
+        for sample_id in manifest.sample_ids(app_name):
+            if has_annotation(annotations, app_name, sample_id, model_name):
+                print(f"Skipping {app_name}/{sample_id}: Already has AI annotation result for model {model_name}.")
+                continue
+            yield app_name, sample_id
+
+def record_result(annotations, journal, app_name, sample_id, ai_result):
+    annotations[app_name][sample_id]['ai'] = ai_result
+    journal.append(app_name, sample_id, 'ai', ai_result)
+
+def run_sequential(client, annotations, journal, model_name):
+    for app_name, sample_id in iter_pending_samples(annotations, model_name):
+        ai_result = annotate_sample_with_ai(client, app_name, sample_id, model_name)
+        if ai_result:
+            record_result(annotations, journal, app_name, sample_id, ai_result)
+
+async def run_concurrent(client, annotations, journal, model_name, concurrency):
+    """
+    Keeps up to `concurrency` requests in flight. Each request runs the blocking
+    annotate_sample_with_ai in a worker thread; results are written back on the
+    event loop thread as soon as each one finishes, so journal writes never race.
+    """
+    loop = asyncio.get_running_loop()
+    pending = iter_pending_samples(annotations, model_name)
 
-        if 'label' in result and 'reason' in result and 'solution' in result and result['label'] in ['Yes', 'No']:
-            print(f"  -> Success: AI classified as {result['label']}.")
-            result['annotator'] = 'AI'
-            result['model_used'] = model_name
-            result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
-            return result
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        async def worker():
+            # All workers share one generator; this is safe because next() only runs on the loop thread.
+            for app_name, sample_id in pending:
+                ai_result = await loop.run_in_executor(pool, annotate_sample_with_ai, client, app_name, sample_id, model_name)
+                if ai_result:
+                    record_result(annotations, journal, app_name, sample_id, ai_result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+def iter_pending_fanout(targets):
+    """Yields (app_name, sample_id, targets) where targets are the selected models still missing the sample."""
+    manifest = get_manifest()
+    for app_name in manifest.apps():
+        for sample_id in manifest.sample_ids(app_name):
+            missing = [t for t in targets if not has_annotation(t['annotations'], app_name, sample_id, t['model_name'])]
+            if not missing:
+                print(f"Skipping {app_name}/{sample_id}: Already has AI annotation results for all selected models.")
+                continue
+            yield app_name, sample_id, missing
+
+async def run_fanout(client, targets, concurrency):
+    """
+    Multi-model mode. Each sample's images are read and encoded once (once per distinct
+    "preprocess" setting among the models) and the same payload is sent to every model
+    that still needs the sample, concurrently. Up to `concurrency` samples are in flight;
+    each result is routed to its own model's journal.
+    """
+    loop = asyncio.get_running_loop()
+    pending = iter_pending_fanout(targets)
+
+    with ThreadPoolExecutor(max_workers=concurrency * (len(targets) + 1)) as pool:
+        async def worker():
+            for app_name, sample_id, missing in pending:
+                print(f"Processing: {app_name} / {sample_id} (Models: {', '.join(t['model_name'] for t in missing)})")
+                image_paths = find_image_paths(app_name, sample_id)
+                if not all(image_paths.values()): print(f"  -> Skipping: Could not find all three images."); continue
+
+                groups = {}
+                for t in missing:
+                    preprocess = t['config'].get("preprocess")
+                    groups.setdefault(json.dumps(preprocess, sort_keys=True), (preprocess, []))[1].append(t)
+                requests = []
+                for preprocess, group in groups.values():
+                    try:
+                        messages_content, image_hashes = await loop.run_in_executor(
+                            pool, build_message_content, image_paths, preprocess, [t['model_name'] for t in group])
+                    except IOError as e:
+                        print(f"  -> Skipping: Error reading image file. Error: {e}")
+                        continue
+                    for t in group:
+                        requests.append((t, loop.run_in_executor(pool, request_annotation, client, t['model_name'], messages_content, image_hashes)))
+
+                results = await asyncio.gather(*(request for _, request in requests))
+                for (t, _), ai_result in zip(requests, results):
+                    if ai_result:
+                        record_result(t['annotations'], t['journal'], app_name, sample_id, ai_result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+def ingest_batch(batch_client, state, batch_id, target, poll_interval):
+    """Waits for one submitted batch and journals every valid response like a live result."""
+    model_name = target['model_name']
+    batch = batch_annotate.wait_openai_batch(batch_client, batch_id, poll_interval)
+    image_hashes = state.batches[batch_id]["requests"]
+    ingested = failed = 0
+    for custom_id, raw_text, error in batch_annotate.iter_openai_batch_results(batch_client, batch):
+        app_name, sample_id = batch_annotate.split_custom_id(custom_id)
+        print(f"Batch result: {app_name} / {sample_id} (Model: {model_name})")
+        ai_result = parse_ai_response(raw_text, model_name) if raw_text is not None else None
+        if ai_result:
+            record_result(target['annotations'], target['journal'], app_name, sample_id, ai_result)
+            if custom_id in image_hashes:
+                RESPONSE_CACHE.put(response_cache.make_key(model_name, PROMPT_INSTRUCTIONS, image_hashes[custom_id]), raw_text, model_name)
+            ingested += 1
         else:
-            print(f"  -> Parsing error: AI response JSON is invalid or missing keys. Response: {raw_text}"); return None
-            
-    except json.JSONDecodeError as e:
-        print(f"  -> JSON parsing error: Could not parse extracted string. Error: {e}. Extracted content: '{json_str}'"); return None
-    except Exception as e:
-        print(f"  -> API or other unknown error: {e}")
-        return None
+            if error: print(f"  -> Batch request failed: {error}")
+            failed += 1
+    state.mark_done(batch_id, batch.status)
+    print(f"Batch {batch_id} {batch.status}: {ingested} results ingested, {failed} failed (will be retried on the next run).")
+
+def batch_model_name(config):
+    """
+    Model name on the batch provider (OpenAI), or None if there is none. "openai/gpt-4o-mini" on
+    OpenRouter maps to "gpt-4o-mini"; other models need an explicit "batch_model_name".
+    """
+    if config.get("batch_model_name"):
+        return config["batch_model_name"]
+    provider, _, name = config["model_name"].partition('/')
+    return name if provider == "openai" and name else None
+
+def submit_batches(batch_client, target):
+    """
+    Batch mode for one model: pending samples become OpenAI batch JSONL files that are
+    submitted and recorded in the model's BatchState. Responses already in the response cache
+    are used directly and never batched; samples in a batch still in flight from an earlier,
+    interrupted run are not submitted again. Returns every batch id to ingest, resumed ones first.
+    """
+    model_name = target['model_name']
+    provider_model_name = batch_model_name(target['config'])
+    state = target['batch_state'] = batch_annotate.BatchState(target['annotations_file'])
+    batch_ids = state.unfinished("openai", model_name)
+    for batch_id in batch_ids:
+        print(f"Resuming batch {batch_id} from a previous run...")
+    in_flight = state.in_flight_custom_ids("openai", model_name)
+
+    image_hashes_by_id = {}
+
+    def pending_requests():
+        for app_name, sample_id in iter_pending_samples(target['annotations'], model_name):
+            custom_id = batch_annotate.make_custom_id(app_name, sample_id)
+            if custom_id in in_flight: continue
+            image_paths = find_image_paths(app_name, sample_id)
+            if not all(image_paths.values()): print(f"  -> Skipping {app_name}/{sample_id}: Could not find all three images."); continue
+            try:
+                messages_content, image_hashes = build_message_content(image_paths, target['config'].get("preprocess"), [model_name])
+            except IOError as e:
+                print(f"  -> Skipping {app_name}/{sample_id}: Error reading image file. Error: {e}"); continue
+            raw_text = RESPONSE_CACHE.get(response_cache.make_key(model_name, PROMPT_INSTRUCTIONS, image_hashes))
+            if raw_text is not None:
+                ai_result = parse_ai_response(raw_text, model_name)
+                if ai_result:
+                    record_result(target['annotations'], target['journal'], app_name, sample_id, ai_result)
+                    continue
+            image_hashes_by_id[custom_id] = image_hashes
+            yield custom_id, batch_annotate.openai_request_line(custom_id, provider_model_name, messages_content)
+
+    path_prefix = os.path.join(ANNOTATIONS_DIR, "batches", os.path.splitext(target['config']["annotations_file"])[0])
+    batch_files = batch_annotate.write_batch_files(pending_requests(), path_prefix)
+    if not batch_files:
+        print(f"No pending samples to batch for model {model_name}.")
+    for path, custom_ids in batch_files:
+        batch_id = batch_annotate.submit_openai_batch(batch_client, path)
+        state.add(batch_id, "openai", model_name, path, {cid: image_hashes_by_id[cid] for cid in custom_ids})
+        batch_ids.append(batch_id)
+    return batch_ids
+
+def run_batch(batch_client, targets, poll_interval):
+    """Submits the batches of every model first, so they all run on the provider side at once, then polls and ingests them."""
+    submitted = [(t, submit_batches(batch_client, t)) for t in targets]
+    for t, batch_ids in submitted:
+        for batch_id in batch_ids:
+            ingest_batch(batch_client, t['batch_state'], batch_id, t, poll_interval)
+
+def run_queue(client, target, queue, worker_id, concurrency):
+    """
+    Shared-queue mode for one model: samples are leased from a SQLite queue that other hosts
+    use too, so no sample is annotated (or billed) twice. Up to `concurrency` leases are
+    worked on at a time; a heartbeat thread keeps them alive. Once the queue is drained,
+    results committed by the other workers are pulled into the local annotations file.
+    """
+    model_name = target['model_name']
+    annotations = target['annotations']
+    manifest = get_manifest()
+    samples, local_results = [], {}
+    for app_name in manifest.apps():
+        for sample_id in manifest.sample_ids(app_name):
+            samples.append((app_name, sample_id))
+            if has_annotation(annotations, app_name, sample_id, model_name):
+                local_results[(app_name, sample_id)] = annotations[app_name][sample_id]['ai']
+    added = queue.enqueue(model_name, samples, local_results)
+    print(f"Queue {queue.db_path}: {added} new task(s) for model {model_name}; working as {worker_id}.")
+
+    lost_leases = 0
+    heartbeat = queue.start_heartbeat(worker_id)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            in_flight = {}
+            while True:
+                if len(in_flight) < concurrency:
+                    for app_name, sample_id in queue.lease(model_name, worker_id, concurrency - len(in_flight)):
+                        future = pool.submit(annotate_sample_with_ai, client, app_name, sample_id, model_name)
+                        in_flight[future] = (app_name, sample_id)
+                if not in_flight:
+                    if queue.outstanding(model_name) == 0:
+                        break
+                    # Everything left is leased by other workers; wait in case one of them dies and its lease expires
+                    time.sleep(min(30.0, queue.lease_seconds / 4))
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    app_name, sample_id = in_flight.pop(future)
+                    ai_result = future.result()
+                    if ai_result:
+                        if queue.complete(model_name, app_name, sample_id, worker_id, ai_result):
+                            record_result(annotations, target['journal'], app_name, sample_id, ai_result)
+                        else:
+                            # Our lease expired and another worker committed first: keep the queue's result
+                            # (pulled in below) so the local file agrees with every other worker
+                            lost_leases += 1
+                            print(f"  -> Lost lease on {app_name}/{sample_id} ({model_name}): another worker finished it first; discarding this result.")
+                    else:
+                        queue.release(model_name, app_name, sample_id, worker_id)
+    finally:
+        heartbeat.stop()
+        queue.release_all(worker_id)
+
+    pulled = 0
+    for app_name, sample_id, ai_result in queue.results(model_name):
+        if not has_annotation(annotations, app_name, sample_id, model_name):
+            record_result(annotations, target['journal'], app_name, sample_id, ai_result)
+            pulled += 1
+    print(f"Pulled {pulled} result(s) produced by other workers for model {model_name}"
+          f"{f' ({lost_leases} lost lease(s) discarded)' if lost_leases else ''}.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Annotate mobile app UI screenshots for performance using OpenRouter API.")
-    parser.add_argument(
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument(
         "--model",
         type=str,
         choices=MODEL_CONFIGS.keys(),
-        required=True,
         help=f"Specify the model type to use. Options: {', '.join(MODEL_CONFIGS.keys())}"
     )
+    model_group.add_argument(
+        "--models",
+        type=str,
+        help="Comma-separated model types (e.g. openai,qwen,llama,gemini_pro). Each sample is read and encoded "
+             "once and sent to all of them concurrently; results go to each model's own annotations file."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of requests (samples, with --models) kept in flight at once. 1 (default) keeps the original sequential loop."
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit pending samples through the provider batch API instead of live requests, then poll and ingest the results."
+    )
+    parser.add_argument(
+        "--batch-base-url",
+        type=str,
+        default=OPENAI_BATCH_BASE_URL,
+        help=f"Batch API base URL (default: {OPENAI_BATCH_BASE_URL}). Use http://127.0.0.1:8765/v1 with mock_batch_server.py."
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between batch status checks in --batch mode."
+    )
+    parser.add_argument(
+        "--queue",
+        type=str,
+        help="SQLite work-queue file on a shared volume. Workers on several hosts lease samples from it, so none is annotated twice."
+    )
+    parser.add_argument(
+        "--worker-id",
+        type=str,
+        default=work_queue.default_worker_id(),
+        help="Name of this worker in --queue mode (default: <hostname>-<pid>)."
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=work_queue.DEFAULT_LEASE_SECONDS,
+        help="How long a leased sample stays reserved without a heartbeat in --queue mode."
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        help="SQLite annotation store (see annotation_store.py) to read and write instead of the JSON annotations files."
+    )
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.queue and args.batch:
+        parser.error("--queue and --batch cannot be combined")
 
-    selected_config = MODEL_CONFIGS.get(args.model)
-    if not selected_config:
-        print(f"Error: Unsupported model type '{args.model}'.")
-        exit(1)
-    
-    selected_model_name = selected_config["model_name"]
-    # 在这里拼接完整路径
-    selected_annotations_file = os.path.join(ANNOTATIONS_DIR, selected_config["annotations_file"])
+    if args.models:
+        model_types = [m.strip() for m in args.models.split(',') if m.strip()]
+        unknown = [m for m in model_types if m not in MODEL_CONFIGS]
+        if unknown or not model_types:
+            parser.error(f"Unsupported model type(s) in --models: {', '.join(unknown)}. Options: {', '.join(MODEL_CONFIGS.keys())}")
+    else:
+        model_types = [args.model]
+
+    for m in model_types:
+        try:
+            image_preprocess.validate_settings(MODEL_CONFIGS[m].get("preprocess"))
+        except ValueError as e:
+            parser.error(f"MODEL_CONFIGS[{m!r}]: {e}")
 
-    if not OPENAI_API_KEY or "YOUR_OPENROUTER_API_KEY_HERE" in OPENAI_API_KEY:
+    if args.batch:
+        unbatchable = [m for m in model_types if not batch_model_name(MODEL_CONFIGS[m])]
+        if unbatchable:
+            parser.error(f"--batch submits to the OpenAI batch API; set \"batch_model_name\" in MODEL_CONFIGS for: {', '.join(unbatchable)}")
+
+    is_local_batch = args.batch and args.batch_base_url.startswith(("http://127.0.0.1", "http://localhost"))
+    if args.batch and not is_local_batch and "YOUR_OPENAI_API_KEY_HERE" in OPENAI_BATCH_API_KEY:
+        print("Error: Please replace 'YOUR_OPENAI_API_KEY_HERE' with your actual OpenAI API key (OPENAI_BATCH_API_KEY) to use --batch.")
+        exit(1)
+    elif not args.batch and (not OPENAI_API_KEY or "YOUR_OPENROUTER_API_KEY_HERE" in OPENAI_API_KEY):
         print("Error: Please replace 'YOUR_OPENROUTER_API_KEY_HERE' with your actual OpenRouter API key in auto_annotate_merged.py.")
         exit(1)
     else:
@@ -223,21 +575,54 @@ if __name__ == "__main__":
             base_url=OPENROUTER_BASE_URL,
             api_key=OPENAI_API_KEY,
         )
-        print(f"Starting AI performance annotation process (Model: {selected_model_name}, Annotation File: {selected_annotations_file})...")
-        annotations = load_annotations(selected_annotations_file)
-        
-        app_dirs = [d for d in os.listdir(IMAGE_DATA_ROOT) if os.path.isdir(os.path.join(IMAGE_DATA_ROOT, d))]
-        for app_name in app_dirs:
-            sample_ids = set(f.split('__')[0] for f in os.listdir(os.path.join(IMAGE_DATA_ROOT, app_name)) if f.lower().endswith('.png'))
-            for sample_id in sorted(list(sample_ids)):
-                if 'ai' in annotations.get(app_name, {}).get(sample_id, {}) and \
-                   annotations[app_name][sample_id]['ai'].get('model_used') == selected_model_name:
-                    print(f"Skipping {app_name}/{sample_id}: Already has AI annotation result for model {selected_model_name}.")
-                    continue
-                
-                ai_result = annotate_sample_with_ai(client, app_name, sample_id, selected_model_name)
-                if ai_result:
-                    annotations[app_name][sample_id]['ai'] = ai_result
-                    save_annotations(annotations, selected_annotations_file)
-                time.sleep(1)
+        store = annotation_store.AnnotationStore(args.store) if args.store else None
+        targets = []
+        for model_type in dict.fromkeys(model_types):
+            selected_config = MODEL_CONFIGS[model_type]
+            # 在这里拼接完整路径
+            selected_annotations_file = os.path.join(ANNOTATIONS_DIR, selected_config["annotations_file"])
+            target = {
+                "config": selected_config,
+                "model_name": selected_config["model_name"],
+                "annotations_file": selected_annotations_file,
+            }
+            if store:
+                # Results are stored under the short model name (annotations_llama.json -> "llama"), like the merged files
+                store_model = annotation_store.model_key_for_file(selected_annotations_file)
+                print(f"Starting AI performance annotation process (Model: {selected_config['model_name']}, Store: {args.store} [{store_model}])...")
+                target["annotations"] = store.to_nested(model=store_model)
+                target["journal"] = store.writer(store_model)
+            else:
+                print(f"Starting AI performance annotation process (Model: {selected_config['model_name']}, Annotation File: {selected_annotations_file})...")
+                target["annotations"] = load_annotations(selected_annotations_file)
+                target["journal"] = result_journal.ResultJournal(selected_annotations_file)
+            targets.append(target)
+
+        try:
+            if args.batch:
+                batch_client = OpenAI(base_url=args.batch_base_url, api_key=OPENAI_BATCH_API_KEY)
+                run_batch(batch_client, targets, args.poll_interval)
+            elif args.queue:
+                queue = work_queue.WorkQueue(args.queue, lease_seconds=args.lease_seconds)
+                for t in targets:
+                    run_queue(client, t, queue, args.worker_id, args.concurrency)
+            elif len(targets) > 1:
+                print(f"Fanning out to {len(targets)} models with {args.concurrency} sample(s) in flight.")
+                asyncio.run(run_fanout(client, targets, args.concurrency))
+            elif args.concurrency > 1:
+                t = targets[0]
+                print(f"Running with {args.concurrency} concurrent requests.")
+                asyncio.run(run_concurrent(client, t['annotations'], t['journal'], t['model_name'], args.concurrency))
+            else:
+                t = targets[0]
+                run_sequential(client, t['annotations'], t['journal'], t['model_name'])
+        finally:
+            # Compaction: fold each journal into its annotations file, then drop it (store writes are already in place)
+            for t in targets:
+                t['journal'].close()
+                if not store:
+                    save_annotations(t['annotations'], t['annotations_file'])
+                    t['journal'].truncate()
+        print(RESPONSE_CACHE.summary())
+        if image_preprocess.summary(): print(image_preprocess.summary())
         print("\nAI performance annotation process finished.")
\ No newline at end of file
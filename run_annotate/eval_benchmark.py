@@ -1,78 +1,99 @@
-import os
 import json
+import argparse
+import annotation_store
+import label_matrix
+import eval_cache
+import annotation_columns
 
 benchmark_path = 'Benchmark/benchmark_full.json'
 anno_dir = 'anno_human_ai_2'
+# 也可以直接查询 SQLite 标注库 (annotation_store.py)，例如 'annotations.db'；设置后不再读取 anno_dir
+anno_db = None
+# 也可以读取 annotation_columns.py 导出的列式文件 (.npz/.parquet)，不解析任何 JSON；设置后不再读取 anno_dir
+anno_columns = None
+# 也可以读取 merge_ai_human.py --consolidated 写出的单个合并文件 (所有模型在同一文件中)；设置后不再读取 anno_dir
+anno_merged = None
 
-with open(benchmark_path, 'r', encoding='utf-8') as f:
-    benchmark = json.load(f)
+# 输出: 默认打印表格；json_output 设为文件路径时另外写出完整结果（'-' 表示打印到 stdout），per_app 同时按 app 统计
+json_output = None
+per_app = False
+# 显著性: bootstrap 重采样次数 (0 表示关闭)。开启后输出每个指标的置信区间，以及模型两两之间的 McNemar 检验
+bootstrap = 0
+# 评估缓存目录 (eval_cache.py)，None 表示 '<anno_dir>.eval_cache'。只有变化过的标注文件会被重新解析
+cache_dir = None
 
-# Ground truth: 只要有一个模型文件中 human.label == '高成本渲染组件遮挡'，就算作正例
-all_samples = set()
-ground_truth = set()
+parser = argparse.ArgumentParser(description="Evaluate every model in anno_dir (or anno_db) against the human ground truth.")
+parser.add_argument("--benchmark", default=benchmark_path, help="Benchmark JSON ({app: [sample, ...]}).")
+parser.add_argument("--anno-dir", default=anno_dir, help="Directory of merged <model>.json files.")
+parser.add_argument("--anno-db", default=anno_db, help="SQLite annotation store; overrides --anno-dir.")
+parser.add_argument("--columns", default=anno_columns, help="Columnar export from annotation_columns.py; overrides --anno-dir.")
+parser.add_argument("--merged", default=anno_merged, help="Consolidated file from merge_ai_human.py --consolidated; overrides --anno-dir.")
+parser.add_argument("--json", default=json_output, metavar="PATH", help="Also write the results as JSON ('-' for stdout).")
+parser.add_argument("--per-app", action="store_true", default=per_app, help="Add per-app metrics to the table and JSON.")
+parser.add_argument("--bootstrap", type=int, nargs="?", const=2000, default=bootstrap, metavar="N",
+                    help="Bootstrap N resamples (default 2000) for metric CIs, and run pairwise McNemar tests.")
+parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the bootstrap intervals.")
+parser.add_argument("--seed", type=int, default=0, help="Random seed of the bootstrap resamples.")
+parser.add_argument("--cache-dir", default=cache_dir, help="Evaluation cache directory (default: <anno-dir>.eval_cache).")
+parser.add_argument("--no-cache", action="store_true", help="Parse every file again and do not touch the cache.")
+args = parser.parse_args()
 
-for filename in os.listdir(anno_dir):
-    if not filename.endswith('.json'):
-        continue
-    filepath = os.path.join(anno_dir, filename)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    for app, samples in data.items():
-        for sample, info in samples.items():
-            if app not in benchmark or sample not in benchmark[app]:
-                continue
-            all_samples.add((app, sample))
-            if info.get('human', {}).get('label') == '高成本渲染组件遮挡':
-                ground_truth.add((app, sample))
+def compute_results():
+    with open(args.benchmark, 'r', encoding='utf-8') as f:
+        benchmark = json.load(f)
 
-# 针对每个模型单独评估
-results = {}
-for filename in os.listdir(anno_dir):
-    if not filename.endswith('.json'):
-        continue
-    model_name = filename.replace('.json', '')
-    filepath = os.path.join(anno_dir, filename)
-    ai_predict = set()
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    for app, samples in data.items():
-        for sample, info in samples.items():
-            if app not in benchmark or sample not in benchmark[app]:
-                continue
-            if info.get('ai', {}).get('label') == 'Yes':
-                ai_predict.add((app, sample))
-    TP = len(ground_truth & ai_predict)
-    FP = len(ai_predict - ground_truth)
-    FN = len(ground_truth - ai_predict)
-    TN = len(all_samples - ground_truth - ai_predict)
-    P = len(ground_truth)
-    N = len(all_samples) - P
-    accuracy = (TP + TN) / (P + N) if (P + N) > 0 else 0
-    precision = TP / (TP + FP) if (TP + FP) > 0 else 0
-    recall = TP / P if P > 0 else 0
-    f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
-    false_positive_rate = FP / N if N > 0 else 0
-    results[model_name] = {
-        'TP': TP, 'FP': FP, 'FN': FN, 'TN': TN,
-        'accuracy': accuracy,
-        'precision': precision,
-        'recall': recall,
-        'f1': f1,
-        'false_positive_rate': false_positive_rate,
-        'predict_yes': len(ai_predict),
-        'total': len(all_samples)
-    }
+    # 标签矩阵: 行 = 样本, 列 = 模型, 外加 ground truth 向量 (见 label_matrix.py)
+    # Ground truth: 只要有一个模型文件中 human.label == '高成本渲染组件遮挡'，就算作正例
+    if args.anno_db:
+        # 直接用索引查询 human 正例和每个模型的 Yes，不再逐个解析合并后的 JSON
+        matrix = label_matrix.load_from_store(annotation_store.AnnotationStore(args.anno_db), benchmark)
+    elif args.merged:
+        matrix = label_matrix.load_from_merged(args.merged, benchmark, cache=cache)
+    elif args.columns:
+        matrix = label_matrix.load_from_columns(annotation_columns.load_columns(args.columns), benchmark)
+    else:
+        matrix = label_matrix.load_from_dir(args.anno_dir, benchmark, cache=cache)
 
-for model, res in results.items():
-    print(f"\n模型: {model}")
-    print(f"  总样本数: {res['total']}")
-    print(f"  TP(命中): {res['TP']}")
-    print(f"  FP(误报): {res['FP']}")
-    print(f"  FN(漏报): {res['FN']}")
-    print(f"  TN(真负): {res['TN']}")
-    print(f"  AI预测为Yes数: {res['predict_yes']}")
-    print(f"  准确率(Accuracy): {res['accuracy']:.4f}")
-    print(f"  精确率(Precision): {res['precision']:.4f}")
-    print(f"  召回率(Recall): {res['recall']:.4f}")
-    print(f"  F1分数: {res['f1']:.4f}")
-    print(f"  误报率(False Positive Rate): {res['false_positive_rate']:.4f}") 
\ No newline at end of file
+    # 所有模型（以及所有 app）的指标一次性向量化计算
+    results = label_matrix.evaluate(matrix, per_app=args.per_app)
+    if args.bootstrap:
+        results['bootstrap'] = {'resamples': args.bootstrap, 'confidence': args.confidence, 'seed': args.seed,
+                                'models': label_matrix.bootstrap_intervals(matrix, args.bootstrap, args.confidence, args.seed)}
+        results['mcnemar'] = label_matrix.mcnemar_tests(matrix)
+    return results
+
+# SQLite 标注库和列式文件本身就不需要解析，不经过缓存
+cache = None
+if not args.no_cache and not args.anno_db and not args.columns:
+    cache = eval_cache.EvalCache(args.cache_dir or eval_cache.default_cache_dir(args.merged or args.anno_dir))
+if cache:
+    # 输入文件和选项都没变时直接复用上次的结果；否则只重新解析内容变化过的文件
+    inputs = [args.merged] if args.merged else label_matrix.annotation_files(args.anno_dir)
+    result_key = cache.result_key([args.benchmark] + inputs,
+                                  {'per_app': args.per_app, 'bootstrap': args.bootstrap,
+                                   'confidence': args.confidence, 'seed': args.seed})
+    results = cache.get_result(result_key)
+    if results is None:
+        results = compute_results()
+        cache.put_result(result_key, results)
+    cache.save()
+else:
+    results = compute_results()
+
+if args.json == '-':
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+else:
+    print(f"样本数: {results['samples']}，正例(高成本渲染组件遮挡): {results['positives']}\n")
+    print(label_matrix.format_table(results['models']))
+    if args.bootstrap:
+        print(f"\nBootstrap 置信区间 ({args.bootstrap} 次重采样):")
+        print(label_matrix.format_intervals(results['models'], results['bootstrap']['models'], args.confidence))
+        print("\nMcNemar 配对检验 (a_only/b_only: 只有该模型判对的样本数，* 表示 p < 0.05，未做多重比较校正):")
+        print(label_matrix.format_mcnemar(results['mcnemar']))
+    for app, rows in results.get('apps', {}).items():
+        print()
+        print(label_matrix.format_table(rows, title=f"[{app}]"))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已写入 {args.json}")
@@ -0,0 +1,116 @@
+# eval_cache.py (评估缓存：按文件内容哈希复用解析结果)
+#
+# eval_benchmark.py and make_benchmark.py used to json.load every merged annotation file on
+# every run. This cache (`<anno_dir>.eval_cache/` by default) keeps:
+#
+#   files/<sha256>.json    the parsed label vectors of one annotation file (its samples, the
+#                          human positives and the AI "Yes" answers), keyed by content hash;
+#   results/<key>.json     a finished evaluation, keyed by the hashes of all its inputs and
+#                          its options;
+#   index.json             path -> (mtime, size, sha256), so unchanged files are not even
+#                          re-hashed.
+#
+# After one model's file changes only that file is parsed again. Confusion counts are cached
+# per evaluation rather than per model: the ground truth is the union of the human labels in
+# all files, so any changed file can move every model's counts.
+
+import os
+import json
+import hashlib
+
+from result_journal import write_json_atomic
+
+MAX_RESULTS = 32
+
+
+def default_cache_dir(anno_dir):
+    return os.path.normpath(anno_dir) + ".eval_cache"
+
+
+class EvalCache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._index_path = os.path.join(cache_dir, "index.json")
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._index = {}
+        self._dirty = False
+        self.parsed_hits = 0
+        self.parsed_misses = 0
+
+    def file_hash(self, path):
+        """sha256 of the file's content; reused from the index while mtime and size are unchanged."""
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        memo = self._index.get(key)
+        if memo and memo["mtime_ns"] == st.st_mtime_ns and memo["size"] == st.st_size:
+            return memo["sha256"]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        self._index[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest.hexdigest()}
+        self._dirty = True
+        return digest.hexdigest()
+
+    def parsed(self, path, parse):
+        """parse(path) for an annotation file, served from the cache when the content is unchanged."""
+        entry_path = os.path.join(self.cache_dir, "files", f"{self.file_hash(path)}.json")
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            self.parsed_hits += 1
+            return entry
+        except (OSError, json.JSONDecodeError):
+            pass
+        entry = parse(path)
+        write_json_atomic(entry, entry_path, indent=None)
+        self.parsed_misses += 1
+        return entry
+
+    def result_key(self, paths, options):
+        """Key of a result computed from `paths` (names and contents) with the given JSON-serializable options."""
+        material = json.dumps([[os.path.basename(p), self.file_hash(p)] for p in paths] + [options],
+                              sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get_result(self, key):
+        path = os.path.join(self.cache_dir, "results", f"{key}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            os.utime(path)  # keeps recently used results from being pruned
+            return result
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put_result(self, key, result):
+        results_dir = os.path.join(self.cache_dir, "results")
+        write_json_atomic(result, os.path.join(results_dir, f"{key}.json"), indent=None)
+        entries = sorted(os.scandir(results_dir), key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[MAX_RESULTS:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def save(self):
+        """Persists the hash index and drops parsed entries that no existing file maps to any more."""
+        for key in [k for k in self._index if not os.path.exists(k)]:
+            del self._index[key]
+            self._dirty = True
+        if not self._dirty: return
+        write_json_atomic(self._index, self._index_path, indent=None)
+        self._dirty = False
+        live = {memo["sha256"] for memo in self._index.values()}
+        files_dir = os.path.join(self.cache_dir, "files")
+        if os.path.isdir(files_dir):
+            for entry in os.scandir(files_dir):
+                if entry.name.endswith(".json") and entry.name[:-len(".json")] not in live:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
@@ -3,10 +3,13 @@
 import os
 import json
 import time
-import glob
 import base64 # 用于将图片编码为Base64
 from collections import defaultdict
 from openai import OpenAI # 导入OpenAI库
+import rate_limiter # 共用的自适应限速器
+import result_journal # 追加式结果日志
+import response_cache # 按内容寻址的响应缓存
+import sample_manifest # 预先构建的样本清单
 
 # --- 配置 (OpenAI / OpenRouter) ---
 OPENAI_API_KEY = "YOUR_OPENROUTER_API_KEY_HERE" # 替换为你的OpenRouter API Key
@@ -16,6 +19,8 @@ OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 # --- 常量 ---
 IMAGE_DATA_ROOT = "overlap_visualizations_3_sampled_complete"
+ORIGINAL_CURRENT_ROOT = r"D:\Code\HapTest\day10_simple" # 原始 current 截图目录（所有脚本共用同一份清单）
+RESPONSE_CACHE = response_cache.ResponseCache() # 以模型、Prompt 和图片哈希为键
 ANNOTATIONS_FILE = "annotations_gemini.json" # 修改：新的标注文件
 MODEL_NAME = "google/gemini-2.5-flash-preview-05-20:thinking" # 修改：使用OpenRouter上的Gemini模型
 
@@ -57,6 +62,12 @@ PROMPT_INSTRUCTIONS = """
 def deep_defaultdict(): return defaultdict(deep_defaultdict)
 
 def load_annotations():
+    # 先读取快照，再回放上次压缩之后追加到日志中的结果
+    annotations = load_annotations_snapshot()
+    result_journal.replay_journal(annotations, ANNOTATIONS_FILE)
+    return annotations
+
+def load_annotations_snapshot():
     if not os.path.exists(ANNOTATIONS_FILE): return deep_defaultdict()
     try:
         with open(ANNOTATIONS_FILE, 'r', encoding='utf-8') as f: data = json.load(f)
@@ -76,42 +87,27 @@ def save_annotations(data):
         if isinstance(item, defaultdict): return {k: convert_to_dict(v) for k, v in item.items()}
         return item
     regular_dict = convert_to_dict(data)
-    with open(ANNOTATIONS_FILE, 'w', encoding='utf-8') as f: json.dump(regular_dict, f, indent=4, ensure_ascii=False)
+    result_journal.write_json_atomic(regular_dict, ANNOTATIONS_FILE)
 
-def find_image_paths(app_name, sample_id):
-    paths = {};
-    for state in ['before', 'current', 'after']:
-        pattern = os.path.join(IMAGE_DATA_ROOT, app_name, f"{sample_id}__{state}*.png")
-        found_files = glob.glob(pattern);
-        if found_files: paths[state] = found_files[0]
-        else: paths[state] = None
-
-    # 对于current需要转换一下，
-    # overlap_visualizations_3_sampled_complete\cn.icheny.wechat\sample_01__current_sample_01_overlap_vis_screenCap_393455447524.png_1.png
-    # day10_simple\cn.damai.hongmeng\screenCap_392252181613.png
-    # D:\Code\HapTest\day10_simple\cn.damai.hongmeng\screenCap_392252181613.png
-    # 如果current图片路径存在且文件名包含"screenCap_"，则尝试还原原始current图片路径
-    import re
-    if paths['current']:
-        current_path = paths['current']
-        current_filename = os.path.basename(current_path)
-        # 匹配 screenCap_数字.png
-        match = re.search(r"(screenCap_\d+)\.png", current_filename)
-        if match:
-            screen_cap_name = match.group(1) + ".png"
-            # 构造原始current图片路径
-            orig_current_path = os.path.join(r"D:\Code\HapTest\day10_simple", app_name, screen_cap_name)
-            if os.path.exists(orig_current_path):
-                paths['current'] = orig_current_path
+_manifest = None
 
-    print(paths)
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = sample_manifest.load_manifest(IMAGE_DATA_ROOT, original_root=ORIGINAL_CURRENT_ROOT)
+    return _manifest
 
+def find_image_paths(app_name, sample_id):
+    # 从预先构建的清单中查找，不再对每个状态执行一次 glob；若存在原始 screenCap 图片则替换 current
+    paths = get_manifest().image_paths(app_name, sample_id, use_original_current=True)
+    print(paths)
     return paths
 
-# 用于将图片编码为Base64
 def encode_image(image_path):
+    # 返回 base64 编码以及原始字节的 SHA-256（用作响应缓存的键）
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        image_bytes = image_file.read()
+    return base64.b64encode(image_bytes).decode('utf-8'), response_cache.sha256_bytes(image_bytes)
 
 def annotate_sample_with_ai(client, app_name, sample_id):
     print(f"正在处理: {app_name} / {sample_id}")
@@ -119,6 +115,7 @@ def annotate_sample_with_ai(client, app_name, sample_id):
     if not all(image_paths.values()): print(f"  -> 跳过: 未能找到全部三张图片。"); return None
 
     messages_content = []
+    image_hashes = []
     # 首先添加文本指令
     messages_content.append({"type": "text", "text": PROMPT_INSTRUCTIONS})
 
@@ -126,7 +123,8 @@ def annotate_sample_with_ai(client, app_name, sample_id):
     try:
         for state in ['before', 'current', 'after']:
             if image_paths[state]:
-                base64_image = encode_image(image_paths[state])
+                base64_image, image_hash = encode_image(image_paths[state])
+                image_hashes.append(image_hash)
                 messages_content.append({
                     "type": "image_url",
                     "image_url": {
@@ -139,22 +137,29 @@ def annotate_sample_with_ai(client, app_name, sample_id):
         return None
 
     try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": messages_content
-                }
-            ],
-            # OpenRouter 专属头部
-            extra_headers={
-                "HTTP-Referer": "https://your-app-domain.com", # 请替换为你的应用域名
-                "X-Title": "Mobile App Performance Annotation Tool", # 请替换为你的工具名称
-            },
-            timeout=180.0 # 适当增加超时时间，大型模型可能需要更长时间
-        )
-        raw_text = completion.choices[0].message.content
+        cache_key = response_cache.make_key(MODEL_NAME, PROMPT_INSTRUCTIONS, image_hashes)
+        raw_text = RESPONSE_CACHE.get(cache_key)
+        if raw_text is not None:
+            print("  -> 命中缓存: 复用已保存的响应。")
+        else:
+            # 按 429 / Retry-After 自适应限速，替代固定的 time.sleep
+            limiter = rate_limiter.get_limiter("openrouter", MODEL_NAME)
+            completion = limiter.call(lambda: client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": messages_content
+                    }
+                ],
+                # OpenRouter 专属头部
+                extra_headers={
+                    "HTTP-Referer": "https://your-app-domain.com", # 请替换为你的应用域名
+                    "X-Title": "Mobile App Performance Annotation Tool", # 请替换为你的工具名称
+                },
+                timeout=180.0 # 适当增加超时时间，大型模型可能需要更长时间
+            ), tokens=rate_limiter.estimate_tokens(PROMPT_INSTRUCTIONS, n_images=3))
+            raw_text = completion.choices[0].message.content
 
         first_brace, last_brace = raw_text.find('{'), raw_text.rfind('}')
         if first_brace == -1 or last_brace == -1:
@@ -167,6 +172,7 @@ def annotate_sample_with_ai(client, app_name, sample_id):
             result['annotator'] = 'AI'
             result['model_used'] = MODEL_NAME
             result['annotation_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            RESPONSE_CACHE.put(cache_key, raw_text, MODEL_NAME)
             return result
         else:
             print(f"  -> 解析错误: AI响应的JSON无效或缺少键。响应: {raw_text}"); return None
@@ -188,16 +194,22 @@ if __name__ == "__main__":
         )
         print("开始AI性能标注流程 (包含解决方案，模型: Gemini via OpenRouter)...")
         annotations = load_annotations()
-        app_dirs = [d for d in os.listdir(IMAGE_DATA_ROOT) if os.path.isdir(os.path.join(IMAGE_DATA_ROOT, d))]
-        for app_name in app_dirs:
-            sample_ids = set(f.split('__')[0] for f in os.listdir(os.path.join(IMAGE_DATA_ROOT, app_name)) if f.lower().endswith('.png'))
-            for sample_id in sorted(list(sample_ids)):
-                if 'ai' in annotations.get(app_name, {}).get(sample_id, {}):
-                    print(f"跳过 {app_name}/{sample_id}: 已有AI标注结果。")
-                    continue
-                ai_result = annotate_sample_with_ai(client, app_name, sample_id)
-                if ai_result:
-                    annotations[app_name][sample_id]['ai'] = ai_result
-                    save_annotations(annotations)
-                time.sleep(2) # 保持休眠，避免频繁请求导致API限速
+        journal = result_journal.ResultJournal(ANNOTATIONS_FILE)
+        try:
+            manifest = get_manifest()
+            for app_name in manifest.apps():
+                for sample_id in manifest.sample_ids(app_name):
+                    if 'ai' in annotations.get(app_name, {}).get(sample_id, {}):
+                        print(f"跳过 {app_name}/{sample_id}: 已有AI标注结果。")
+                        continue
+                    ai_result = annotate_sample_with_ai(client, app_name, sample_id)
+                    if ai_result:
+                        annotations[app_name][sample_id]['ai'] = ai_result
+                        journal.append(app_name, sample_id, 'ai', ai_result)
+        finally:
+            # 压缩: 把日志合并进标注文件，然后清空日志
+            journal.close()
+            save_annotations(annotations)
+            journal.truncate()
+        print(RESPONSE_CACHE.summary())
         print("\nAI性能标注流程结束。")
\ No newline at end of file
@@ -0,0 +1,196 @@
+# image_preprocess.py (上传前的截图缩放与重新压缩)
+#
+# Screenshots are sent to the models as full-resolution PNGs, so upload size and vision-token
+# cost are dominated by pixels the models never look at. A model can opt into preprocessing
+# with a "preprocess" entry in MODEL_CONFIGS, e.g.
+#
+#     "preprocess": {"max_edge": 1280, "format": "JPEG", "quality": 85}
+#
+# Processed images are cached on disk next to the sample manifest
+# (`<image_root>.preprocessed/`), keyed by source path, mtime, size and settings.
+# Pillow is optional: without it images are sent unchanged.
+
+import io
+import os
+import json
+import math
+import mimetypes
+import struct
+import hashlib
+import threading
+from collections import namedtuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FORMAT_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+FORMAT_EXT = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+PreparedImage = namedtuple("PreparedImage", "data mime original_bytes width height original_width original_height")
+
+_warned_missing_pillow = False
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def default_cache_dir(image_root):
+    return os.path.normpath(image_root) + ".preprocessed"
+
+
+def _png_size(data):
+    # Width/height live in the IHDR chunk right after the 8-byte signature.
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    return None, None
+
+
+def _sniff_mime(data, image_path):
+    """MIME type from the magic bytes, falling back to the file extension (manifests admit .png/.jpg/.jpeg)."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n": return "image/png"
+    if data[:3] == b"\xff\xd8\xff": return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP": return "image/webp"
+    return mimetypes.guess_type(image_path)[0] or "image/png"
+
+
+def _cache_key(image_path, settings):
+    st = os.stat(image_path)
+    material = json.dumps([os.path.abspath(image_path), st.st_mtime_ns, st.st_size, sorted(settings.items())])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _read_original(image_path):
+    with open(image_path, "rb") as f:
+        data = f.read()
+    # Only PNG headers are parsed for the size; other formats report None
+    width, height = _png_size(data)
+    return PreparedImage(data, _sniff_mime(data, image_path), len(data), width, height, width, height)
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def validate_settings(settings):
+    """
+    Checks a "preprocess" config before any image is touched, so a typo fails at startup
+    instead of mid-run. Raises ValueError; returns the settings unchanged.
+    """
+    if not settings:
+        return settings
+    if not isinstance(settings, dict):
+        raise ValueError(f"preprocess settings must be a dict, got {settings!r}")
+    fmt = settings.get("format", "JPEG")
+    if not isinstance(fmt, str) or fmt.upper() not in FORMAT_MIME:
+        raise ValueError(f"Unsupported preprocess format {fmt!r}; supported formats: {', '.join(FORMAT_MIME)}")
+    for key in ("max_edge", "quality"):
+        value = settings.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            raise ValueError(f"preprocess '{key}' must be a positive integer, got {value!r}")
+    return settings
+
+
+def preprocess_image(image_path, settings=None, cache_dir=None):
+    """
+    Returns a PreparedImage for `image_path`. With `settings` None (or Pillow missing)
+    the original bytes are returned untouched.
+
+    Args:
+        settings (dict): {"max_edge": int, "format": "JPEG" | "WEBP" | "PNG", "quality": int}.
+        cache_dir (str): Where processed images are cached; no caching when None.
+    """
+    global _warned_missing_pillow
+    if not settings:
+        return _read_original(image_path)
+    validate_settings(settings)
+    if Image is None:
+        if not _warned_missing_pillow:
+            print("  -> Warning: Pillow is not installed, sending images without preprocessing.")
+            _warned_missing_pillow = True
+        return _read_original(image_path)
+
+    fmt = settings.get("format", "JPEG").upper()
+    cache_base = None
+    if cache_dir:
+        key = _cache_key(image_path, settings)
+        cache_base = os.path.join(cache_dir, key[:2], key)
+        try:
+            with open(cache_base + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(cache_base + FORMAT_EXT[fmt], "rb") as f:
+                return PreparedImage(f.read(), FORMAT_MIME[fmt], **meta)
+        except (OSError, json.JSONDecodeError, TypeError):
+            pass
+
+    original_bytes = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        original_width, original_height = img.size
+        max_edge = settings.get("max_edge")
+        if max_edge and max(img.size) > max_edge:
+            scale = max_edge / max(img.size)
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        save_kwargs = {"optimize": True} if fmt == "PNG" else {"quality": settings.get("quality", 85)}
+        img.save(buffer, format=fmt, **save_kwargs)
+        width, height = img.size
+    data = buffer.getvalue()
+    meta = {"original_bytes": original_bytes, "width": width, "height": height,
+            "original_width": original_width, "original_height": original_height}
+
+    if cache_base:
+        # Written via temp files and os.replace: several processes (e.g. web server workers) may
+        # fill the same entry at once, and a reader must never see a half-written image
+        os.makedirs(os.path.dirname(cache_base), exist_ok=True)
+        _write_atomic(cache_base + FORMAT_EXT[fmt], data)
+        _write_atomic(cache_base + ".json", json.dumps(meta).encode("utf-8"))
+    return PreparedImage(data, FORMAT_MIME[fmt], **meta)
+
+
+def estimate_image_tokens(width, height, model_name):
+    """Rough vision-token cost of one image, following each provider's published sizing rules."""
+    if not width or not height:
+        return 0
+    model = model_name.lower()
+    if model.startswith("openai/") or "gpt" in model:
+        # High detail: fit into 2048x2048, shortest side to 768, then 170 tokens per 512px tile + 85.
+        scale = min(1.0, 2048 / max(width, height))
+        w, h = width * scale, height * scale
+        scale = min(1.0, 768 / min(w, h))
+        w, h = w * scale, h * scale
+        return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+    if "gemini" in model or "gemma" in model:
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    # Other providers mostly bill by pixel area; ~750 pixels per token is a common rule of thumb.
+    return math.ceil(width * height / 750)
+
+
+def record(model_name, prepared):
+    """Accumulates bytes and estimated tokens, before and after preprocessing, for one model."""
+    with _stats_lock:
+        s = _stats.setdefault(model_name, {"images": 0, "original_bytes": 0, "sent_bytes": 0,
+                                           "original_tokens": 0, "sent_tokens": 0})
+        s["images"] += 1
+        s["original_bytes"] += prepared.original_bytes
+        s["sent_bytes"] += len(prepared.data)
+        s["original_tokens"] += estimate_image_tokens(prepared.original_width, prepared.original_height, model_name)
+        s["sent_tokens"] += estimate_image_tokens(prepared.width, prepared.height, model_name)
+
+
+def summary():
+    lines = []
+    with _stats_lock:
+        for model_name, s in _stats.items():
+            saved_bytes = s["original_bytes"] - s["sent_bytes"]
+            saved_tokens = s["original_tokens"] - s["sent_tokens"]
+            lines.append(f"Image preprocessing ({model_name}): {s['images']} images, "
+                         f"{saved_bytes / 1024 / 1024:.1f} MB saved of {s['original_bytes'] / 1024 / 1024:.1f} MB, "
+                         f"~{saved_tokens} of ~{s['original_tokens']} estimated image tokens saved.")
+    return "\n".join(lines)
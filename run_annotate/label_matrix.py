@@ -0,0 +1,340 @@
+# label_matrix.py (样本 × 模型 的标签矩阵与向量化评估)
+#
+# eval_benchmark.py used to keep one Python set of (app, sample) pairs per model and compute
+# the metrics model by model. Here every model file is parsed once into a boolean matrix:
+#
+#     predictions[i, j]  model j answered "Yes" for sample i
+#     ground_truth[i]    a human labelled sample i as a high-cost overlap
+#     app_index[i]       position of sample i's app in `apps`
+#
+# so the confusion counts of all models (overall and per app) come out of a few array
+# operations, however many models or samples there are.
+
+import os
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import annotation_stream
+
+POSITIVE_HUMAN_LABEL = '高成本渲染组件遮挡'
+METRICS = ('accuracy', 'precision', 'recall', 'f1', 'false_positive_rate')
+
+LabelMatrix = namedtuple("LabelMatrix", "samples models apps app_index predictions ground_truth")
+
+
+def _build(samples, models, positives, yes_by_model):
+    """samples: sorted [(app, sample)]; positives: set of pairs; yes_by_model: {model: set of pairs}."""
+    row = {pair: i for i, pair in enumerate(samples)}
+    apps = sorted({app for app, _ in samples})
+    app_row = {app: i for i, app in enumerate(apps)}
+    predictions = np.zeros((len(samples), len(models)), dtype=bool)
+    for j, model_name in enumerate(models):
+        rows = [row[pair] for pair in yes_by_model[model_name] if pair in row]
+        predictions[rows, j] = True
+    ground_truth = np.zeros(len(samples), dtype=bool)
+    ground_truth[[row[pair] for pair in positives if pair in row]] = True
+    app_index = np.fromiter((app_row[app] for app, _ in samples), dtype=np.int64, count=len(samples))
+    return LabelMatrix(samples, list(models), apps, app_index, predictions, ground_truth)
+
+
+def annotation_files(anno_dir):
+    """Sorted paths of the merged `<model>.json` files in anno_dir."""
+    return [os.path.join(anno_dir, name) for name in sorted(os.listdir(anno_dir)) if name.endswith('.json')]
+
+
+def parse_annotation_file(path):
+    """
+    Label vectors of one merged annotation file, independent of any benchmark:
+    {"samples": [[app, sample], ...], "human_positive": [i, ...], "ai_yes": [i, ...]}.
+    """
+    samples, human_positive, ai_yes = [], [], []
+    # Streamed record by record (annotation_stream.py), so the parsed file is never held whole
+    for app, sample, info in annotation_stream.iter_records(path):
+        if info.get('human', {}).get('label') == POSITIVE_HUMAN_LABEL:
+            human_positive.append(len(samples))
+        if info.get('ai', {}).get('label') == 'Yes':
+            ai_yes.append(len(samples))
+        samples.append([app, sample])
+    return {"samples": samples, "human_positive": human_positive, "ai_yes": ai_yes}
+
+
+def parse_merged_file(path):
+    """
+    Label vectors of a consolidated merge_ai_human.py file ({"human": ..., "ai": {model: result}}):
+    {"samples": [[app, sample], ...], "human_positive": [i, ...], "ai_yes": {model: [i, ...]}}.
+    """
+    samples, human_positive, ai_yes = [], [], {}
+    for app, sample, info in annotation_stream.iter_records(path):
+        if info.get('human', {}).get('label') == POSITIVE_HUMAN_LABEL:
+            human_positive.append(len(samples))
+        for model_name, result in annotation_stream.model_results(info.get('ai'), None).items():
+            rows = ai_yes.setdefault(model_name, [])
+            if result.get('label') == 'Yes':
+                rows.append(len(samples))
+        samples.append([app, sample])
+    return {"samples": samples, "human_positive": human_positive, "ai_yes": ai_yes}
+
+
+def load_from_dir(anno_dir, benchmark, cache=None):
+    """
+    Reads every merged `<model>.json` in anno_dir once (or takes its label vectors from an
+    eval_cache.EvalCache). A sample belongs to the evaluation if it is in the benchmark and in
+    at least one model file; it is positive if any file carries the positive human label for it.
+    """
+    samples, positives, yes_by_model = set(), set(), {}
+    for path in annotation_files(anno_dir):
+        entry = cache.parsed(path, parse_annotation_file) if cache else parse_annotation_file(path)
+        pairs = [(app, sample) for app, sample in entry["samples"]]
+        in_benchmark = [sample in benchmark.get(app, ()) for app, sample in pairs]
+        samples.update(pair for pair, keep in zip(pairs, in_benchmark) if keep)
+        positives.update(pairs[i] for i in entry["human_positive"] if in_benchmark[i])
+        yes_by_model[os.path.basename(path)[:-len('.json')]] = {pairs[i] for i in entry["ai_yes"] if in_benchmark[i]}
+    return _build(sorted(samples), list(yes_by_model), positives, yes_by_model)
+
+
+def load_from_merged(path, benchmark, cache=None):
+    """Same matrix from one consolidated merge_ai_human.py file, with the rules of load_from_dir."""
+    entry = cache.parsed(path, parse_merged_file) if cache else parse_merged_file(path)
+    pairs = [(app, sample) for app, sample in entry["samples"]]
+    in_benchmark = [sample in benchmark.get(app, ()) for app, sample in pairs]
+    samples = {pair for pair, keep in zip(pairs, in_benchmark) if keep}
+    positives = {pairs[i] for i in entry["human_positive"] if in_benchmark[i]}
+    yes_by_model = {model_name: {pairs[i] for i in rows if in_benchmark[i]} for model_name, rows in sorted(entry["ai_yes"].items())}
+    return _build(sorted(samples), list(yes_by_model), positives, yes_by_model)
+
+
+def load_from_store(store, benchmark):
+    """Same matrix from an annotation_store.AnnotationStore, using its indexed queries."""
+    benchmark_pairs = {(app, sample) for app, app_samples in benchmark.items() for sample in app_samples}
+    samples = set(store.sample_pairs()) & benchmark_pairs
+    positives = store.human_label_pairs(POSITIVE_HUMAN_LABEL)
+    models = store.models()
+    yes_by_model = {model_name: store.ai_label_pairs(model_name, 'Yes') for model_name in models}
+    return _build(sorted(samples), models, positives, yes_by_model)
+
+
+def load_from_columns(columns, benchmark):
+    """
+    Same matrix from an annotation_columns.AnnotationColumns export, without parsing any JSON:
+    rows are mapped to samples and models through their dictionary codes.
+    """
+    app_codes, sample_codes, model_codes = columns.codes['app'], columns.codes['sample'], columns.codes['model']
+    n_sample_names = max(len(columns.dictionary('sample')), 1)
+    pair_ids = app_codes.astype(np.int64) * n_sample_names + sample_codes
+    benchmark_ids = [columns.code('app', app) * n_sample_names + columns.code('sample', sample)
+                     for app, app_samples in benchmark.items() if columns.code('app', app) is not None
+                     for sample in app_samples if columns.code('sample', sample) is not None]
+    rows = np.flatnonzero(np.isin(pair_ids, np.array(benchmark_ids, dtype=np.int64)))
+    unique_ids, row_sample = np.unique(pair_ids[rows], return_inverse=True)
+    # Samples in (app, sample) string order, as the other loaders produce them
+    apps, sample_names = columns.dictionary('app'), columns.dictionary('sample')
+    pairs = [(apps[i // n_sample_names], sample_names[i % n_sample_names]) for i in unique_ids.tolist()]
+    order = sorted(range(len(pairs)), key=pairs.__getitem__)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    row_sample = position[row_sample.reshape(-1)]
+    samples = [pairs[i] for i in order]
+
+    # Model columns in name order, as the other loaders produce them
+    present_models = np.unique(model_codes[model_codes >= 0])
+    present_models = present_models[np.argsort([columns.dictionary('model')[c] for c in present_models.tolist()], kind='stable')]
+    models = [columns.dictionary('model')[c] for c in present_models.tolist()]
+    model_column = np.full(len(columns.dictionary('model')) + 1, -1, dtype=np.int64)
+    model_column[present_models] = np.arange(len(present_models))
+    model_column = model_column[model_codes[rows]]
+    yes = columns.equals('ai_label', 'Yes')[rows]
+    positive = columns.equals('human_label', POSITIVE_HUMAN_LABEL)[rows]
+
+    predictions = np.zeros((len(samples), len(models)), dtype=bool)
+    predictions[row_sample[yes], model_column[yes]] = True
+    ground_truth = np.zeros(len(samples), dtype=bool)
+    ground_truth[row_sample[positive]] = True
+    app_names = sorted({app for app, _ in samples})
+    app_row = {app: i for i, app in enumerate(app_names)}
+    app_index = np.fromiter((app_row[app] for app, _ in samples), dtype=np.int64, count=len(samples))
+    return LabelMatrix(samples, models, app_names, app_index, predictions, ground_truth)
+
+
+def confusion_counts(predictions, ground_truth):
+    """
+    TP/FP/FN/TN per model for a (samples, models) prediction matrix. Extra leading axes on both
+    inputs are carried through, e.g. (resamples, samples, models) with (resamples, samples).
+    """
+    gt = ground_truth[..., None]
+    tp = np.count_nonzero(predictions & gt, axis=-2)
+    predicted_yes = np.count_nonzero(predictions, axis=-2)
+    positives = np.count_nonzero(ground_truth, axis=-1)[..., None]
+    total = ground_truth.shape[-1]
+    fp = predicted_yes - tp
+    fn = positives - tp
+    tn = total - tp - fp - fn
+    return tp, fp, fn, tn
+
+
+def _ratio(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator > 0)
+
+
+def metrics_from_counts(tp, fp, fn, tn):
+    """Metric arrays (same shape as the counts); an undefined ratio is 0, as in the original script."""
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    return {
+        'accuracy': _ratio(tp + tn, tp + fp + fn + tn),
+        'precision': precision,
+        'recall': recall,
+        'f1': _ratio(2 * precision * recall, precision + recall),
+        'false_positive_rate': _ratio(fp, fp + tn),
+    }
+
+
+def per_app_counts(matrix):
+    """(apps, models) arrays of TP/FP/FN/TN, from one bincount per cell type."""
+    n_apps, n_models = len(matrix.apps), len(matrix.models)
+    gt = matrix.ground_truth[:, None]
+    pred = matrix.predictions
+    # Flattened (app, model) bin of every sample/model cell
+    bins = (matrix.app_index[:, None] * n_models + np.arange(n_models)[None, :]).ravel()
+
+    def count(mask):
+        return np.bincount(bins, weights=mask.ravel(), minlength=n_apps * n_models).astype(np.int64).reshape(n_apps, n_models)
+
+    return count(pred & gt), count(pred & ~gt), count(~pred & gt), count(~pred & ~gt)
+
+
+def _result_rows(models, tp, fp, fn, tn):
+    metrics = metrics_from_counts(tp, fp, fn, tn)
+    rows = {}
+    for j, model_name in enumerate(models):
+        row = {'TP': int(tp[j]), 'FP': int(fp[j]), 'FN': int(fn[j]), 'TN': int(tn[j])}
+        row.update({name: float(metrics[name][j]) for name in METRICS})
+        row['predict_yes'] = int(tp[j] + fp[j])
+        row['total'] = int(tp[j] + fp[j] + fn[j] + tn[j])
+        rows[model_name] = row
+    return rows
+
+
+def evaluate(matrix, per_app=False):
+    """
+    {"models": {model: {TP, FP, FN, TN, accuracy, precision, recall, f1, false_positive_rate,
+    predict_yes, total}}, "samples": n, "positives": n} plus, with per_app, "apps": {app: {model: ...}}.
+    """
+    result = {
+        'samples': len(matrix.samples),
+        'positives': int(np.count_nonzero(matrix.ground_truth)),
+        'models': _result_rows(matrix.models, *confusion_counts(matrix.predictions, matrix.ground_truth)),
+    }
+    if per_app:
+        tp, fp, fn, tn = per_app_counts(matrix)
+        result['apps'] = {app: _result_rows(matrix.models, tp[a], fp[a], fn[a], tn[a]) for a, app in enumerate(matrix.apps)}
+    return result
+
+
+def bootstrap_intervals(matrix, n_resamples=2000, confidence=0.95, seed=0, chunk_size=250):
+    """
+    Percentile bootstrap CIs for every metric of every model: {model: {metric: [low, high]}}.
+
+    Each resample is stored as a vector of per-sample draw counts, so the confusion counts of a
+    chunk of resamples are matrix products of a (chunk, samples) count matrix with the
+    (samples, models) cell indicators, with no Python loop over resamples or samples.
+    """
+    n, n_models = matrix.predictions.shape
+    if n == 0 or n_models == 0:
+        return {}
+    rng = np.random.default_rng(seed)
+    pred = matrix.predictions.astype(np.float32)
+    gt = matrix.ground_truth.astype(np.float32)
+    tp_cells = pred * gt[:, None]
+    values = {name: [] for name in METRICS}
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        draws = rng.integers(0, n, size=(size, n))
+        # Row r of `weights` counts how often each sample was drawn in resample r
+        weights = np.bincount((draws + np.arange(size)[:, None] * n).ravel(), minlength=size * n)
+        weights = weights.reshape(size, n).astype(np.float32)
+        tp = weights @ tp_cells
+        predicted_yes = weights @ pred
+        positives = (weights @ gt)[:, None]
+        fp = predicted_yes - tp
+        fn = positives - tp
+        tn = n - tp - fp - fn
+        for name, array in metrics_from_counts(tp, fp, fn, tn).items():
+            values[name].append(array)
+    alpha = (1 - confidence) / 2
+    bounds = {name: np.quantile(np.concatenate(arrays), [alpha, 1 - alpha], axis=0) for name, arrays in values.items()}
+    return {model_name: {name: [float(bounds[name][0, j]), float(bounds[name][1, j])] for name in METRICS}
+            for j, model_name in enumerate(matrix.models)}
+
+
+def _mcnemar_p_value(b, c):
+    """Exact two-sided binomial test for small discordant counts, chi-square with continuity correction otherwise."""
+    n = b + c
+    if n == 0:
+        return 1.0, None, 'exact'
+    if n < 25:
+        tail = sum(math.comb(n, k) for k in range(min(b, c) + 1)) / 2 ** n
+        return min(1.0, 2 * tail), None, 'exact'
+    statistic = (abs(b - c) - 1) ** 2 / n
+    return math.erfc(math.sqrt(statistic / 2)), statistic, 'chi2'
+
+
+def mcnemar_tests(matrix):
+    """
+    Paired McNemar test for every pair of models on the same samples. The discordant counts of
+    all pairs come from one (models, models) product of the per-sample correctness matrix.
+    p-values are not corrected for multiple comparisons.
+    """
+    correct = (matrix.predictions == matrix.ground_truth[:, None]).astype(np.int64)
+    # only_correct[a, b]: samples model a got right and model b got wrong
+    only_correct = correct.T @ (1 - correct)
+    tests = []
+    for a in range(len(matrix.models)):
+        for b in range(a + 1, len(matrix.models)):
+            b_count, c_count = int(only_correct[a, b]), int(only_correct[b, a])
+            p_value, statistic, method = _mcnemar_p_value(b_count, c_count)
+            tests.append({'model_a': matrix.models[a], 'model_b': matrix.models[b],
+                          'a_only_correct': b_count, 'b_only_correct': c_count,
+                          'statistic': statistic, 'p_value': p_value, 'method': method})
+    return tests
+
+
+def format_intervals(rows, intervals, confidence):
+    """Point estimate and bootstrap interval of each metric per model, best F1 first."""
+    names = ['precision', 'recall', 'f1', 'false_positive_rate']
+    headers = ['model'] + [f"{name} ({confidence:.0%} CI)" for name in names]
+    body = []
+    for model_name, r in sorted(rows.items(), key=lambda item: -item[1]['f1']):
+        ci = intervals[model_name]
+        body.append([model_name] + [f"{r[name]:.4f} [{ci[name][0]:.4f}, {ci[name][1]:.4f}]" for name in names])
+    return _format_rows(headers, body)
+
+
+def format_mcnemar(tests, alpha=0.05):
+    headers = ['model_a', 'model_b', 'a_only', 'b_only', 'p_value', '']
+    body = [[t['model_a'], t['model_b'], t['a_only_correct'], t['b_only_correct'], f"{t['p_value']:.4g}",
+             '*' if t['p_value'] < alpha else ''] for t in sorted(tests, key=lambda t: t['p_value'])]
+    return _format_rows(headers, body)
+
+
+def _format_rows(headers, body, title=None):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *body)]
+    lines = [title] if title else []
+    lines.append("  ".join(str(h).ljust(w) if i == 0 else str(h).rjust(w) for i, (h, w) in enumerate(zip(headers, widths))))
+    lines.append("  ".join("-" * w for w in widths))
+    for cells in body:
+        lines.append("  ".join(str(c).ljust(w) if i == 0 else str(c).rjust(w) for i, (c, w) in enumerate(zip(cells, widths))))
+    return "\n".join(lines)
+
+
+def format_table(rows, title=None):
+    """Fixed-width text table of {model: metrics} rows, best F1 first."""
+    headers = ['model', 'total', 'TP', 'FP', 'FN', 'TN', 'yes', 'acc', 'prec', 'recall', 'f1', 'fpr']
+    body = []
+    for model_name, r in sorted(rows.items(), key=lambda item: -item[1]['f1']):
+        body.append([model_name, r['total'], r['TP'], r['FP'], r['FN'], r['TN'], r['predict_yes'],
+                     *(f"{r[name]:.4f}" for name in METRICS)])
+    return _format_rows(headers, body, title)
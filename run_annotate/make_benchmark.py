@@ -1,29 +1,60 @@
 import os
 import json
+import annotation_store
+import label_matrix
+import eval_cache
+import annotation_columns
+import annotation_query
 
 input_dir = 'anno_human_ai_2'
+# 也可以直接查询 SQLite 标注库 (annotation_store.py)，例如 'annotations.db'；设置后不再读取 input_dir
+input_db = None
+# 也可以读取 annotation_columns.py 导出的列式文件 (.npz/.parquet)，例如 'annotations.npz'；设置后不再读取 input_dir
+input_columns = None
+# 列式文件上用 annotation_query.py 的过滤表达式选出 benchmark 样本：至少一个模型答 Yes，或人工标为正例
+benchmark_query = 'ai_yes_count>=1 | human=true'
+# 也可以读取 merge_ai_human.py --consolidated 写出的单个合并文件；设置后不再读取 input_dir
+input_merged = None
+# 评估缓存 (eval_cache.py)，与 eval_benchmark.py 共用：只有内容变化过的标注文件会被重新解析。None 表示 '<input_dir>.eval_cache'
+use_cache = True
+cache_dir = None
 output_dir = 'Benchmark'
 os.makedirs(output_dir, exist_ok=True)
 
 # {(app, sample): {'ai': set([model1, model2]), 'human': True/False}}
 benchmark = {}
 
-for filename in os.listdir(input_dir):
-    if not filename.endswith('.json'):
-        continue
-    model_name = filename.replace('.json', '')
-    filepath = os.path.join(input_dir, filename)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    for app, samples in data.items():
-        for sample, info in samples.items():
-            key = (app, sample)
-            ai_label = info.get('ai', {}).get('label')
-            human_label = info.get('human', {}).get('label')
-            if ai_label == 'Yes':
-                benchmark.setdefault(key, {'ai': set(), 'human': False})['ai'].add(model_name)
-            if human_label == '高成本渲染组件遮挡':
-                benchmark.setdefault(key, {'ai': set(), 'human': False})['human'] = True
+if input_columns:
+    index = annotation_query.AnnotationIndex(annotation_columns.load_columns(input_columns))
+    benchmark = index.entries(index.query(benchmark_query))
+elif input_db:
+    store = annotation_store.AnnotationStore(input_db)
+    for model_name in store.models():
+        for key in store.ai_label_pairs(model_name, 'Yes'):
+            benchmark.setdefault(key, {'ai': set(), 'human': False})['ai'].add(model_name)
+    for key in store.human_label_pairs('高成本渲染组件遮挡'):
+        benchmark.setdefault(key, {'ai': set(), 'human': False})['human'] = True
+else:
+    cache = eval_cache.EvalCache(cache_dir or eval_cache.default_cache_dir(input_merged or input_dir)) if use_cache else None
+    # [(entry, [(model_name, ai_yes)])]: a consolidated file is one entry holding every model
+    if input_merged:
+        entry = cache.parsed(input_merged, label_matrix.parse_merged_file) if cache else label_matrix.parse_merged_file(input_merged)
+        entries = [(entry, sorted(entry['ai_yes'].items()))]
+    else:
+        entries = []
+        for filepath in label_matrix.annotation_files(input_dir):
+            model_name = os.path.basename(filepath).replace('.json', '')
+            entry = cache.parsed(filepath, label_matrix.parse_annotation_file) if cache else label_matrix.parse_annotation_file(filepath)
+            entries.append((entry, [(model_name, entry['ai_yes'])]))
+    for entry, models in entries:
+        samples = entry['samples']
+        for model_name, ai_yes in models:
+            for i in ai_yes:
+                benchmark.setdefault(tuple(samples[i]), {'ai': set(), 'human': False})['ai'].add(model_name)
+        # 人工正例每个文件只处理一次，与模型数量无关 (合并文件里没有任何模型结果时也要保留)
+        for i in entry['human_positive']:
+            benchmark.setdefault(tuple(samples[i]), {'ai': set(), 'human': False})['human'] = True
+    if cache: cache.save()
 
 # 分类统计
 only_ai = []
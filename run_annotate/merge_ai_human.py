@@ -1,5 +1,7 @@
 import json
 import os
+import argparse
+import annotation_stream
 
 # 输入文件路径
 HUMAN_ANNOTATIONS_PATH = 'gt2.json'
@@ -7,23 +9,22 @@ HUMAN_ANNOTATIONS_PATH = 'gt2.json'
 AI_ANNOTATIONS_DIR = './annotations_2'
 # 输出合并结果的目录
 OUTPUT_MERGED_DIR = './anno_human_ai_2'
-
-# 确保输出目录存在
-os.makedirs(OUTPUT_MERGED_DIR, exist_ok=True)
+# 合并后的单个文件 {app: {sample: {"human": {...}, "ai": {model: {...}, ...}}}}，human 标注只存一份；None 表示不写
+CONSOLIDATED_OUTPUT_PATH = None
+# 是否同时写出每个模型一个文件的视图 (OUTPUT_MERGED_DIR/<model>.json，旧的输出格式)
+WRITE_MODEL_VIEWS = True
 
 # 读取 human 文件
 def load_human_annotations(file_path):
     """
     加载人类标注文件，并提取 'human' 字段的数据。
+    文件是流式读取的 (annotation_stream.py)，内存中只保留 human 字段，不会整棵加载其它字段。
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
         result = {}
-        for app, samples in data.items():
-            for sample, info in samples.items():
-                if isinstance(info, dict) and 'human' in info:
-                    result.setdefault(app, {})[sample] = {'human': info['human']}
+        for app, sample, info in annotation_stream.iter_records(file_path):
+            if isinstance(info, dict) and 'human' in info:
+                result.setdefault(app, {})[sample] = {'human': info['human']}
         print(f"成功加载人类标注文件: {file_path}")
         return result
     except FileNotFoundError:
@@ -33,19 +34,17 @@ def load_human_annotations(file_path):
         print(f"错误: 人类标注文件 {file_path} 不是有效的 JSON 格式。")
         return None
 
-# 读取 AI 文件
+# 索引 AI 文件
 def load_ai_annotations(file_path):
     """
-    加载 AI 标注文件，并提取 'ai' 字段的数据。
+    流式扫描 AI 标注文件，只记录每条含 'ai' 字段的记录在文件中的位置: {(app, sample): (offset, length)}。
+    记录本身在合并时再按位置读取，AI 结果不会整体驻留内存。
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
         result = {}
-        for app, samples in data.items():
-            for sample, info in samples.items():
-                if isinstance(info, dict) and 'ai' in info:
-                    result.setdefault(app, {})[sample] = {'ai': info['ai']}
+        for app, sample, info, offset, length in annotation_stream.iter_records(file_path, with_offsets=True):
+            if isinstance(info, dict) and 'ai' in info:
+                result[(app, sample)] = (offset, length)
         print(f"成功加载 AI 标注文件: {file_path}")
         return result
     except FileNotFoundError:
@@ -55,66 +54,80 @@ def load_ai_annotations(file_path):
         print(f"错误: AI 标注文件 {file_path} 不是有效的 JSON 格式。")
         return None
 
-# 合并 human 和 AI 数据
-def merge_annotations(human_dict, ai_dict):
-    """
-    合并人类标注和 AI 标注数据。
-    """
-    if human_dict is None or ai_dict is None:
-        return None
-
-    merged = {}
-    # 获取所有 app 名称（human 和 AI 数据中的并集）
-    apps = set(human_dict.keys()) | set(ai_dict.keys())
-
-    for app in apps:
-        # 获取当前 app 下的所有 sample 名称
-        samples = set(human_dict.get(app, {}).keys()) | set(ai_dict.get(app, {}).keys())
-        for sample in samples:
-            merged.setdefault(app, {})[sample] = {}
-            # 如果 human 数据中存在，则添加 human 标注
-            if app in human_dict and sample in human_dict[app]:
-                merged[app][sample].update(human_dict[app][sample])
-            # 如果 AI 数据中存在，则添加 AI 标注
-            if app in ai_dict and sample in ai_dict[app]:
-                merged[app][sample].update(ai_dict[app][sample])
-    return merged
-
-def process_model_annotations(model_file_name, human_annotations):
+# 单遍合并 human 和所有模型的 AI 数据
+def merge_all_models(human_dict, model_file_names, consolidated_path=None, write_views=True):
     """
-    处理单个 AI 模型文件，并将其与人类标注合并。
+    先为每个 AI 模型文件建立偏移索引，再按 (app, sample) 顺序遍历一次所有样本，
+    每条 AI 记录只读取一次，同时写出合并文件和各模型视图。
     Args:
-        model_file_name (str): AI 模型注释文件名，例如 'annotations_llama.json'。
-        human_annotations (dict): 预先加载的人类标注数据。
+        human_dict (dict): 预先加载的人类标注数据。
+        model_file_names (list): AI 模型注释文件名，例如 ['annotations_llama.json', ...]。
+        consolidated_path (str): 合并文件的输出路径；None 表示不写。
+        write_views (bool): 是否写出 OUTPUT_MERGED_DIR/<model>.json 视图，内容与逐模型合并完全相同。
     """
-    model_name = model_file_name.replace('annotations_', '').replace('.json', '')
-    ai_input_path = os.path.join(AI_ANNOTATIONS_DIR, model_file_name)
-    output_path = os.path.join(OUTPUT_MERGED_DIR, f'{model_name}.json')
-
-    print(f"\n--- 正在处理 {model_name} 模型数据 ---")
-
-    ai_dict = load_ai_annotations(ai_input_path)
-    if ai_dict is None:
-        print(f"跳过 {model_name} 的合并，因为 AI 标注加载失败。")
-        return
-
-    merged_data = merge_annotations(human_annotations, ai_dict)
-
-    if merged_data is None:
-        print(f"跳过 {model_name} 的合并，因为合并操作失败。")
-        return
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(merged_data, f, ensure_ascii=False, indent=2, sort_keys=True)
-    print(f"已输出合并结果到 {output_path}")
-    print(f"--- {model_name} 模型数据处理完成 ---\n")
+    ai_indexes = {}  # {model_name: (path, {(app, sample): (offset, length)})}
+    for model_file_name in model_file_names:
+        model_name = model_file_name.replace('annotations_', '').replace('.json', '')
+        ai_input_path = os.path.join(AI_ANNOTATIONS_DIR, model_file_name)
+        ai_index = load_ai_annotations(ai_input_path)
+        if ai_index is None:
+            print(f"跳过 {model_name} 的合并，因为 AI 标注加载失败。")
+            continue
+        ai_indexes[model_name] = (ai_input_path, ai_index)
+
+    # 所有 (app, sample) 为 human 和各模型 AI 数据中的并集
+    keys = {(app, sample) for app, samples in human_dict.items() for sample in samples}
+    for _, ai_index in ai_indexes.values():
+        keys.update(ai_index)
+
+    ai_files = {model_name: open(path, 'rb') for model_name, (path, _) in ai_indexes.items()}
+    writers = {}
+    try:
+        if consolidated_path:
+            writers[None] = annotation_stream.NestedJsonWriter(consolidated_path)
+        if write_views:
+            for model_name in ai_indexes:
+                writers[model_name] = annotation_stream.NestedJsonWriter(os.path.join(OUTPUT_MERGED_DIR, f'{model_name}.json'))
+        for app, sample in sorted(keys):
+            human_record = human_dict.get(app, {}).get(sample, {})
+            ai_results = {model_name: annotation_stream.read_record(ai_files[model_name], *ai_index[(app, sample)])['ai']
+                          for model_name, (_, ai_index) in ai_indexes.items() if (app, sample) in ai_index}
+            if consolidated_path:
+                record = dict(human_record)
+                if ai_results: record['ai'] = ai_results
+                writers[None].write(app, sample, record)
+            if write_views:
+                # 视图只包含 human 或该模型出现过的样本，与原来的逐模型合并一致
+                for model_name in ai_indexes:
+                    if model_name in ai_results:
+                        writers[model_name].write(app, sample, {**human_record, 'ai': ai_results[model_name]})
+                    elif human_record:
+                        writers[model_name].write(app, sample, dict(human_record))
+        for writer in writers.values():
+            writer.close()
+            print(f"已输出合并结果到 {writer.path} ({writer.count} 个样本)")
+        writers.clear()
+    finally:
+        for writer in writers.values():
+            writer.abort()
+        for f in ai_files.values():
+            f.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge human labels with the AI results of every model in one pass.")
+    parser.add_argument("--consolidated", default=CONSOLIDATED_OUTPUT_PATH, metavar="PATH",
+                        help="Write one file with every model's result under 'ai' (keyed by model name).")
+    parser.add_argument("--no-views", dest="views", action="store_false", default=WRITE_MODEL_VIEWS,
+                        help=f"Do not write the per-model files in {OUTPUT_MERGED_DIR}.")
+    args = parser.parse_args()
+
     # 预加载人类标注数据，因为它是所有合并的基础
     human_data = load_human_annotations(HUMAN_ANNOTATIONS_PATH)
 
     if human_data is None:
         print("无法加载人类标注数据，程序将退出。")
+    elif not args.consolidated and not args.views:
+        print("没有要写出的结果：请指定 --consolidated 或去掉 --no-views。")
     else:
         # 定义需要处理的 AI 模型文件列表
         # 您可以根据实际的 AI 标注文件名进行扩展
@@ -126,7 +139,6 @@ if __name__ == "__main__":
             # 添加更多 AI 模型的文件名
         ]
 
-        for ai_file in ai_model_files:
-            process_model_annotations(ai_file, human_data)
+        merge_all_models(human_data, ai_model_files, consolidated_path=args.consolidated, write_views=args.views)
 
-    print("\n所有指定模型的合并处理已完成。")
\ No newline at end of file
+    print("\n所有指定模型的合并处理已完成。")
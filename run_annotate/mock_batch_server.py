@@ -0,0 +1,277 @@
+# mock_batch_server.py (离线测试用的 OpenAI / Gemini Batch API 替身)
+#
+# Implements just enough of the OpenAI Files and Batches endpoints (/v1/...) and of the Gemini
+# Developer API files / batchGenerateContent endpoints (/v1beta/..., as used by google-genai)
+# for batch mode to run end to end without network access or an API key:
+#
+#     python mock_batch_server.py --port 8765
+#     python en_auto_annotate_three.py --model openai --batch --batch-base-url http://127.0.0.1:8765/v1 --poll-interval 1
+#     python auto_annotate_gemini.py --batch --base-url http://127.0.0.1:8765 --poll-interval 1
+#     python auto_annotate_aistudio.py --batch --base-url http://127.0.0.1:8765 --poll-interval 1
+#
+# Every request in a batch is answered with a fixed, valid annotation. A batch reports
+# "in_progress" (Gemini: BATCH_STATE_RUNNING) until --delay seconds after creation, then
+# "completed" (BATCH_STATE_SUCCEEDED).
+
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from email import message_from_bytes
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_ANSWER = {"label": "No", "reason": "No high-cost component detected", "solution": "No optimization needed"}
+
+_files = {}    # file_id -> {"filename", "purpose", "content" (bytes), "created_at"}
+_batches = {}  # batch_id -> batch object (dict)
+_gemini_uploads = {}  # upload_id -> {"metadata" (dict), "content" (bytearray)}
+_gemini_files = {}    # "files/<id>" -> {"display_name", "mime_type", "content" (bytes), "created_at"}
+_gemini_batches = {}  # "batches/<id>" -> {"display_name", "model", "input_file", "state", "created_at", "output_file"}
+_lock = threading.Lock()
+_delay = 2.0
+
+
+def _file_object(file_id):
+    f = _files[file_id]
+    return {"id": file_id, "object": "file", "bytes": len(f["content"]), "created_at": f["created_at"],
+            "filename": f["filename"], "purpose": f["purpose"], "status": "processed"}
+
+
+def _complete_batch(batch):
+    """Builds the output file for a batch whose simulated processing time has elapsed."""
+    input_lines = [json.loads(l) for l in _files[batch["input_file_id"]]["content"].decode('utf-8').splitlines() if l.strip()]
+    output_lines = []
+    for request in input_lines:
+        body = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("body", {}).get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(MOCK_ANSWER)}}],
+        }
+        output_lines.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                                        "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body},
+                                        "error": None}))
+    output_id = f"file-{uuid.uuid4().hex[:24]}"
+    _files[output_id] = {"filename": "batch_output.jsonl", "purpose": "batch_output",
+                         "content": ("\n".join(output_lines) + "\n").encode('utf-8'), "created_at": int(time.time())}
+    now = int(time.time())
+    batch.update({"status": "completed", "output_file_id": output_id, "completed_at": now, "finalizing_at": now,
+                  "request_counts": {"total": len(input_lines), "completed": len(input_lines), "failed": 0}})
+
+
+def _rfc3339(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def _gemini_file_object(name):
+    f = _gemini_files[name]
+    return {"name": name, "displayName": f["display_name"], "mimeType": f["mime_type"],
+            "sizeBytes": str(len(f["content"])), "createTime": _rfc3339(f["created_at"]), "state": "ACTIVE",
+            "downloadUri": f"download/v1beta/{name}:download?alt=media"}
+
+
+def _gemini_batch_object(name):
+    """A batch as returned by batchGenerateContent / batches.get (a long-running operation wrapping it)."""
+    batch = _gemini_batches[name]
+    if batch["state"] == "BATCH_STATE_RUNNING" and time.time() - batch["created_at"] >= _delay:
+        _complete_gemini_batch(batch)
+    metadata = {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch",
+                "name": name, "displayName": batch["display_name"], "model": batch["model"], "state": batch["state"],
+                "createTime": _rfc3339(batch["created_at"]), "updateTime": _rfc3339(time.time())}
+    if batch["output_file"]:
+        metadata["endTime"] = metadata["updateTime"]
+        metadata["output"] = {"responsesFile": batch["output_file"]}
+    return {"name": name, "metadata": metadata, "done": batch["state"] != "BATCH_STATE_RUNNING"}
+
+
+def _complete_gemini_batch(batch):
+    """Builds the responses file ({"key", "response"} per input line) of a finished Gemini batch."""
+    input_lines = [json.loads(l) for l in _gemini_files[batch["input_file"]]["content"].decode('utf-8').splitlines() if l.strip()]
+    output_lines = [json.dumps({"key": request["key"], "response": {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": json.dumps(MOCK_ANSWER)}]}, "finishReason": "STOP"}],
+        "modelVersion": batch["model"].split("/")[-1]}}) for request in input_lines]
+    output_name = f"files/batch-{uuid.uuid4().hex[:12]}"
+    _gemini_files[output_name] = {"display_name": "batch_output.jsonl", "mime_type": "application/jsonl",
+                                  "content": ("\n".join(output_lines) + "\n").encode('utf-8'), "created_at": time.time()}
+    batch.update({"state": "BATCH_STATE_SUCCEEDED", "output_file": output_name})
+
+
+class MockBatchHandler(BaseHTTPRequestHandler):
+
+    def _send_json(self, obj, status=200):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _gemini_post(self, path, query, body):
+        """Gemini routes; returns False if the path is not one of them."""
+        if path == "/upload/v1beta/files":
+            # Resumable upload: "start" opens a session at X-Goog-Upload-URL, then "upload, finalize" sends the bytes
+            command = self.headers.get("X-Goog-Upload-Command", "")
+            if "start" in command:
+                upload_id = uuid.uuid4().hex
+                _gemini_uploads[upload_id] = {"metadata": json.loads(body or b"{}").get("file", {}), "content": bytearray()}
+                self.send_response(200)
+                self.send_header("X-Goog-Upload-URL", f"http://{self.headers['Host']}/upload/v1beta/files?upload_id={upload_id}")
+                self.send_header("X-Goog-Upload-Status", "active")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return True
+            upload = _gemini_uploads.get(query.get("upload_id", [""])[0])
+            if upload is None:
+                self._send_json({"error": {"code": 404, "message": "upload session not found"}}, 404)
+                return True
+            upload["content"] += body
+            status, response = "active", {}
+            if "finalize" in command:
+                name = f"files/{uuid.uuid4().hex[:12]}"
+                _gemini_files[name] = {"display_name": upload["metadata"].get("displayName", name),
+                                       "mime_type": upload["metadata"].get("mimeType", "application/octet-stream"),
+                                       "content": bytes(upload["content"]), "created_at": time.time()}
+                status, response = "final", {"file": _gemini_file_object(name)}
+            data = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Goog-Upload-Status", status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return True
+
+        match = re.fullmatch(r"/v1beta/(models/[^/:]+):batchGenerateContent", path)
+        if match:
+            batch = json.loads(body or b"{}").get("batch", {})
+            input_file = batch.get("inputConfig", {}).get("fileName")
+            if input_file not in _gemini_files:
+                self._send_json({"error": {"code": 404, "message": "input file not found"}}, 404)
+                return True
+            name = f"batches/{uuid.uuid4().hex[:12]}"
+            _gemini_batches[name] = {"display_name": batch.get("displayName", name), "model": match.group(1),
+                                     "input_file": input_file, "state": "BATCH_STATE_RUNNING",
+                                     "created_at": time.time(), "output_file": None}
+            self._send_json(_gemini_batch_object(name))
+            return True
+
+        match = re.fullmatch(r"/v1beta/(batches/[^/:]+):cancel", path)
+        if match and match.group(1) in _gemini_batches:
+            batch = _gemini_batches[match.group(1)]
+            if batch["state"] == "BATCH_STATE_RUNNING": batch["state"] = "BATCH_STATE_CANCELLED"
+            self._send_json({})
+            return True
+        return False
+
+    def _gemini_get(self, path):
+        """Gemini routes; returns False if the path is not one of them."""
+        match = re.fullmatch(r"/v1beta/(batches/[^/:]+)", path)
+        if match and match.group(1) in _gemini_batches:
+            self._send_json(_gemini_batch_object(match.group(1)))
+            return True
+
+        match = re.fullmatch(r"(?:/download)?/v1beta/(files/[^/:]+):download", path)
+        if match and match.group(1) in _gemini_files:
+            data = _gemini_files[match.group(1)]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return True
+
+        match = re.fullmatch(r"/v1beta/(files/[^/:]+)", path)
+        if match and match.group(1) in _gemini_files:
+            self._send_json(_gemini_file_object(match.group(1)))
+            return True
+        return False
+
+    def do_POST(self):
+        body = self._read_body()
+        url = urlsplit(self.path)
+        with _lock:
+            if self._gemini_post(url.path, parse_qs(url.query), body):
+                return
+            if self.path == "/v1/files":
+                # multipart/form-data with "purpose" and "file" fields
+                message = message_from_bytes(b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body,
+                                             policy=default_policy)
+                fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                file_id = f"file-{uuid.uuid4().hex[:24]}"
+                _files[file_id] = {"filename": fields["file"].get_filename() or "upload.jsonl",
+                                   "purpose": fields["purpose"].get_content().strip() if "purpose" in fields else "batch",
+                                   "content": fields["file"].get_payload(decode=True), "created_at": int(time.time())}
+                return self._send_json(_file_object(file_id))
+
+            if self.path == "/v1/batches":
+                request = json.loads(body or b"{}")
+                if request.get("input_file_id") not in _files:
+                    return self._send_json({"error": {"message": "input file not found"}}, 404)
+                batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+                n = sum(1 for l in _files[request["input_file_id"]]["content"].splitlines() if l.strip())
+                _batches[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+                    "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window", "24h"),
+                    "status": "in_progress", "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+                    "request_counts": {"total": n, "completed": 0, "failed": 0},
+                }
+                return self._send_json(_batches[batch_id])
+
+            match = re.fullmatch(r"/v1/batches/([^/]+)/cancel", self.path)
+            if match and match.group(1) in _batches:
+                _batches[match.group(1)]["status"] = "cancelled"
+                return self._send_json(_batches[match.group(1)])
+        self._send_json({"error": {"message": f"unknown endpoint {self.path}"}}, 404)
+
+    def do_GET(self):
+        with _lock:
+            if self._gemini_get(urlsplit(self.path).path):
+                return
+            match = re.fullmatch(r"/v1/batches/([^/]+)", self.path)
+            if match and match.group(1) in _batches:
+                batch = _batches[match.group(1)]
+                if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= _delay:
+                    _complete_batch(batch)
+                return self._send_json(batch)
+
+            match = re.fullmatch(r"/v1/files/([^/]+)/content", self.path)
+            if match and match.group(1) in _files:
+                data = _files[match.group(1)]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            match = re.fullmatch(r"/v1/files/([^/]+)", self.path)
+            if match and match.group(1) in _files:
+                return self._send_json(_file_object(match.group(1)))
+        self._send_json({"error": {"message": f"unknown endpoint {self.path}"}}, 404)
+
+    def log_message(self, fmt, *args):
+        print(f"[mock-batch] {self.address_string()} {fmt % args}")
+
+
+def make_server(host="127.0.0.1", port=8765, delay=2.0):
+    global _delay
+    _delay = delay
+    return ThreadingHTTPServer((host, port), MockBatchHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI Files/Batches and Gemini batch APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=2.0, help="Seconds a batch stays in_progress before completing.")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.delay)
+    print(f"Mock batch server listening on http://{args.host}:{args.port} (OpenAI: /v1, Gemini: /v1beta)")
+    server.serve_forever()
@@ -0,0 +1,212 @@
+# rate_limiter.py (所有标注脚本共用的自适应限速器)
+#
+# Each (provider, model) pair gets one token bucket for requests per minute and an
+# optional one for tokens per minute. Buckets start at the configured RPM/TPM, shrink
+# when the provider answers 429 (honouring Retry-After), and ramp back up after a run
+# of successful calls, so the runners stay close to the provider's real limit instead
+# of sleeping a fixed 1-2 seconds between samples.
+
+import re
+import time
+import threading
+from email.utils import parsedate_to_datetime
+
+# OpenRouter allows 20 requests/minute on ":free" models; paid models are far less strict.
+DEFAULT_RPM = {
+    "openrouter": 60,
+    "openrouter:free": 20,
+    "gemini": 10,
+}
+# Rough per-image token cost used when a caller does not know the exact figure.
+DEFAULT_IMAGE_TOKENS = 1500
+# A typical annotation request: three screenshots plus the prompt. Sets the default TPM floor.
+TYPICAL_REQUEST_TOKENS = 3 * DEFAULT_IMAGE_TOKENS + 1000
+# The TPM floor is also never below this fraction of the configured TPM.
+MIN_TPM_FRACTION = 0.1
+
+MAX_RATE_LIMIT_RETRIES = 5
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Bucket:
+    """Plain token bucket. Not thread-safe on its own; AdaptiveRateLimiter holds the lock."""
+
+    def __init__(self, rate_per_minute, burst_seconds=2.0):
+        self.rate_per_minute = float(rate_per_minute)
+        self.burst_seconds = burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate_per_minute / 60.0 * self.burst_seconds)
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_minute / 60.0)
+
+    def wait_time(self, amount):
+        # A single request larger than the bucket would never fit; let it through once the bucket is full.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.rate_per_minute
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe limiter for one (provider, model) pair.
+
+    Args:
+        rpm (float): Starting requests per minute.
+        tpm (float): Starting tokens per minute, or None to only limit requests.
+        max_rpm (float): Ceiling the limiter may ramp up to. Defaults to `rpm`.
+        min_rpm (float): Floor the limiter never backs off below.
+        min_tpm (float): Token-rate floor. Defaults to the larger of min_rpm typical requests
+            (TYPICAL_REQUEST_TOKENS each) and MIN_TPM_FRACTION of `tpm`, but never above `tpm`.
+        backoff_factor (float): Multiplier applied to the rates on every 429.
+        ramp_factor (float): Multiplier applied after `ramp_after` consecutive successes.
+    """
+
+    def __init__(self, rpm, tpm=None, max_rpm=None, min_rpm=1.0, min_tpm=None,
+                 backoff_factor=0.5, ramp_factor=1.1, ramp_after=20):
+        self.max_rpm = float(max_rpm or rpm)
+        self.min_rpm = float(min_rpm)
+        self.max_tpm = float(tpm) if tpm else None
+        if min_tpm is None and tpm:
+            min_tpm = min(float(tpm), max(self.min_rpm * TYPICAL_REQUEST_TOKENS, float(tpm) * MIN_TPM_FRACTION))
+        self.min_tpm = float(min_tpm) if min_tpm else None
+        self.backoff_factor = backoff_factor
+        self.ramp_factor = ramp_factor
+        self.ramp_after = ramp_after
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm) if tpm else None
+        self._blocked_until = 0.0
+        self._success_streak = 0
+        self._lock = threading.Lock()
+
+    @property
+    def rpm(self):
+        return self._requests.rate_per_minute
+
+    def acquire(self, tokens=0):
+        """Blocks until one request (and `tokens` tokens, if TPM is limited) may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._requests.refill(now)
+                wait = max(self._blocked_until - now, self._requests.wait_time(1))
+                if self._tokens is not None and tokens:
+                    self._tokens.refill(now)
+                    wait = max(wait, self._tokens.wait_time(tokens))
+                if wait <= 0:
+                    self._requests.tokens -= 1
+                    if self._tokens is not None and tokens:
+                        self._tokens.tokens -= min(tokens, self._tokens.capacity)
+                    return
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._success_streak += 1
+            if self._success_streak < self.ramp_after:
+                return
+            self._success_streak = 0
+            self._requests.rate_per_minute = min(self.max_rpm, self._requests.rate_per_minute * self.ramp_factor)
+            if self._tokens is not None:
+                self._tokens.rate_per_minute = min(self.max_tpm, self._tokens.rate_per_minute * self.ramp_factor)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._lock:
+            self._success_streak = 0
+            self._requests.rate_per_minute = max(self.min_rpm, self._requests.rate_per_minute * self.backoff_factor)
+            self._requests.tokens = min(self._requests.tokens, 0.0)
+            if self._tokens is not None:
+                self._tokens.rate_per_minute = max(self.min_tpm, self._tokens.rate_per_minute * self.backoff_factor)
+            # Without a Retry-After hint, pause for one request interval at the reduced rate.
+            pause = retry_after if retry_after is not None else 60.0 / self._requests.rate_per_minute
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            print(f"  -> Rate limited: backing off to {self._requests.rate_per_minute:.1f} RPM, pausing {pause:.1f}s.")
+
+    def call(self, fn, tokens=0, max_retries=MAX_RATE_LIMIT_RETRIES):
+        """
+        Runs fn() under the limiter. Rate-limit errors shrink the rate and are retried up to
+        `max_retries` times; any other exception is re-raised unchanged for the caller to handle.
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                is_rate_limited, retry_after = rate_limit_info(e)
+                if not is_rate_limited or attempt == max_retries:
+                    raise
+                self.on_rate_limited(retry_after)
+                continue
+            self.on_success()
+            return result
+
+
+def default_rpm(provider, model_name=None):
+    if model_name and model_name.endswith(":free") and f"{provider}:free" in DEFAULT_RPM:
+        return DEFAULT_RPM[f"{provider}:free"]
+    return DEFAULT_RPM.get(provider, 30)
+
+
+def get_limiter(provider, model_name, rpm=None, tpm=None):
+    """Returns the shared limiter for (provider, model_name), creating it on first use."""
+    key = (provider, model_name)
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = AdaptiveRateLimiter(rpm or default_rpm(provider, model_name), tpm=tpm)
+        return _registry[key]
+
+
+def estimate_tokens(prompt_text, n_images=0, tokens_per_image=DEFAULT_IMAGE_TOKENS):
+    # ~4 characters per token is close enough for budgeting purposes.
+    return len(prompt_text) // 4 + n_images * tokens_per_image
+
+
+def _parse_retry_after(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_info(exc):
+    """
+    Returns (is_rate_limited, retry_after_seconds) for an exception raised by the
+    openai or google-genai clients. retry_after_seconds is None when no hint was given.
+    """
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    message = str(exc)
+    is_rate_limited = status == 429 or "RESOURCE_EXHAUSTED" in message or re.search(r"\b429\b", message) is not None
+    if not is_rate_limited:
+        return False, None
+
+    retry_after = None
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers:
+        if headers.get("retry-after-ms") is not None:
+            retry_after = _parse_retry_after(headers.get("retry-after-ms"))
+            retry_after = retry_after / 1000.0 if retry_after is not None else None
+        if retry_after is None:
+            retry_after = _parse_retry_after(headers.get("retry-after"))
+    if retry_after is None:
+        # Gemini puts the hint in the error body, e.g. "retryDelay": "17s".
+        match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", message)
+        if match:
+            retry_after = float(match.group(1))
+    return True, retry_after
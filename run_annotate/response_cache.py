@@ -0,0 +1,117 @@
+# response_cache.py (按内容寻址的 LLM 响应缓存)
+#
+# A response is stored under sha256(model_name, sha256(prompt), sha256(image_1), ...),
+# so re-running a runner after moving the dataset, switching ANNOTATIONS_DIR or merging
+# files returns the stored answer without a network call, and two MODEL_CONFIGS entries
+# that share a model_name share their cache entries. Each entry is one small JSON file;
+# its mtime doubles as the LRU timestamp and is bumped on every hit.
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+DEFAULT_CACHE_DIR = "llm_response_cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(model_name, prompt_text, image_hashes):
+    prompt_hash = sha256_bytes(prompt_text.encode('utf-8'))
+    material = json.dumps([model_name, prompt_hash, list(image_hashes)], separators=(',', ':'))
+    return sha256_bytes(material.encode('utf-8'))
+
+
+class ResponseCache:
+    """
+    On-disk cache of raw model responses with size-based LRU eviction.
+
+    Args:
+        cache_dir (str): Directory holding the entries (created on first write).
+        max_bytes (int): Total size above which the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None  # computed lazily on first write
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached raw response text, or None on a miss."""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (OSError, json.JSONDecodeError):
+            with self._lock: self.misses += 1
+            return None
+        with self._lock: self.hits += 1
+        return entry.get('raw_text')
+
+    def put(self, key, raw_text, model_name=None):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"model": model_name, "raw_text": raw_text, "created": time.strftime('%Y-%m-%d %H:%M:%S')}
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += os.path.getsize(path) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _iter_entries(self):
+        if not os.path.isdir(self.cache_dir): return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir(): continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and entry.name.endswith('.json'):
+                    yield entry
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._iter_entries())
+
+    def _evict(self):
+        # Drop least recently used entries until we are 10% under the limit, so eviction is not re-run on every put.
+        entries = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in self._iter_entries()))
+        target = self.max_bytes * 0.9
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target: break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return f"Response cache: {s['hits']} hits, {s['misses']} misses (hit rate {s['hit_rate']:.1%}), {s['evictions']} evictions."
@@ -0,0 +1,182 @@
+# result_journal.py (标注结果的追加式 JSONL 日志)
+#
+# Runners append one line per finished sample to `<annotations_file>.jsonl` instead of
+# re-dumping the whole annotations JSON after every sample. The JSON file is only
+# rewritten on compaction (atomically, via a temp file and os.replace), and
+# load_annotations replays the journal on top of it so resuming stays exact.
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+
+def journal_path_for(annotations_file):
+    return os.path.splitext(annotations_file)[0] + ".jsonl"
+
+
+def to_plain_dict(item):
+    if isinstance(item, defaultdict): return {k: to_plain_dict(v) for k, v in item.items()}
+    return item
+
+
+def write_json_atomic(data, path, indent=4):
+    """Writes JSON to a temp file next to `path`, fsyncs it and renames it into place."""
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def iter_journal(journal_path):
+    """Yields (app, sample_id, key, value) records. A torn last line from a crash is skipped."""
+    if not os.path.exists(journal_path): return
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                record = json.loads(line)
+                yield record['app'], record['sample'], record['key'], record['value']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+
+
+def read_journal_from(journal_path, offset=0):
+    """
+    Reads the complete records written after byte `offset`. Returns (records, new_offset);
+    a trailing line without its newline is left for the next call.
+    """
+    records = []
+    try:
+        with open(journal_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return records, offset
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        if not line.strip(): continue
+        try:
+            record = json.loads(line)
+            records.append((record['app'], record['sample'], record['key'], record['value']))
+        except (json.JSONDecodeError, KeyError, TypeError):
+            continue
+    return records, offset + end
+
+
+def repair_tail(journal_path, chunk_size=65536):
+    """
+    Makes sure the journal ends with a newline, so the next append starts a fresh line instead
+    of being glued onto a line torn by a crash mid-write. A torn line is cut back to the last
+    newline; a complete record that only lost its newline keeps it and gets the newline.
+    """
+    try:
+        f = open(journal_path, 'r+b')
+    except FileNotFoundError:
+        return
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0: return
+        f.seek(size - 1)
+        if f.read(1) == b"\n": return
+        # look backwards for the start of the last line
+        start, tail = size, b""
+        while start > 0:
+            step = min(chunk_size, start)
+            start -= step
+            f.seek(start)
+            tail = f.read(step) + tail
+            newline = tail.rfind(b"\n")
+            if newline >= 0:
+                start += newline + 1
+                tail = tail[newline + 1:]
+                break
+        try:
+            record = json.loads(tail)
+            record['app'], record['sample'], record['key'], record['value']
+        except (ValueError, KeyError, TypeError):
+            f.truncate(start)
+        else:
+            f.seek(size)
+            f.write(b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def append_durable(journal_path, app, sample_id, key, value):
+    """Appends one record and fsyncs it before returning. Returns the journal size afterwards."""
+    return append_many_durable(journal_path, [(app, sample_id, key, value)])
+
+
+def append_many_durable(journal_path, records):
+    """Appends (app, sample_id, key, value) records with a single write and fsync. Returns the journal size afterwards."""
+    lines = "".join(json.dumps({"app": app, "sample": sample_id, "key": key, "value": value}, ensure_ascii=False) + "\n"
+                    for app, sample_id, key, value in records)
+    repair_tail(journal_path)
+    with open(journal_path, 'ab') as f:
+        f.write(lines.encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def replay_journal(annotations, annotations_file):
+    """Applies the journal of `annotations_file` onto a deep_defaultdict. Returns the record count."""
+    count = 0
+    for app, sample_id, key, value in iter_journal(journal_path_for(annotations_file)):
+        annotations[app][sample_id][key] = value
+        count += 1
+    return count
+
+
+class ResultJournal:
+    """
+    Append-only writer. Every append is flushed to the OS immediately; fsync happens
+    every `fsync_every` records or `fsync_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, annotations_file, fsync_every=20, fsync_interval=5.0):
+        self.annotations_file = annotations_file
+        self.path = journal_path_for(annotations_file)
+        directory = os.path.dirname(self.path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        repair_tail(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, app, sample_id, key, value):
+        line = json.dumps({"app": app, "sample": sample_id, "key": key, "value": value}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed: return
+            self._file.flush()
+            self._sync()
+            self._file.close()
+
+    def truncate(self):
+        """Drops the journal once its records have been folded into the annotations file."""
+        self.close()
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
@@ -0,0 +1,148 @@
+# sample_manifest.py (数据集样本清单: app -> sample -> before/current/after 图片)
+#
+# One os.scandir pass per app directory replaces the three glob.glob calls per sample in
+# find_image_paths and the os.path.exists probe for the original screenCap image. The
+# result is persisted as JSON next to the dataset directory and refreshed incrementally:
+# an app is rescanned only when its directory mtime (or that of its original-screenshot
+# directory) changed since the last run.
+
+import os
+import re
+import json
+
+MANIFEST_VERSION = 1
+STATES = ('before', 'current', 'after')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+SCREENCAP_PATTERN = re.compile(r"(screenCap_\d+)\.png")
+
+
+def default_manifest_path(image_root):
+    return os.path.normpath(image_root) + ".manifest.json"
+
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _list_files(path):
+    try:
+        with os.scandir(path) as it:
+            return [entry.name for entry in it if entry.is_file()]
+    except OSError:
+        return []
+
+
+def scan_app_dir(app_path, original_app_path=None):
+    """Returns {sample_id: {"before": fname, "current": fname, "after": fname, "original_current": path}}."""
+    original_names = set(_list_files(original_app_path)) if original_app_path else set()
+    samples = {}
+    # Sorted so that, like the natsorted listing in AnnotationWeb, the choice between duplicates is stable; .png wins over .jpg
+    for name in sorted(_list_files(app_path), key=lambda n: (not n.lower().endswith('.png'), n)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS): continue
+        sample_id, sep, rest = name.partition('__')
+        if not sep: continue
+        state = next((s for s in STATES if rest.startswith(s)), None)
+        if state is None: continue
+        record = samples.setdefault(sample_id, {s: None for s in STATES})
+        if record[state] is None: record[state] = name
+
+    for record in samples.values():
+        record['original_current'] = None
+        if record['current'] and original_names:
+            # e.g. sample_01__current_sample_01_overlap_vis_screenCap_393455447524.png_1.png -> screenCap_393455447524.png
+            match = SCREENCAP_PATTERN.search(record['current'])
+            if match and match.group(1) + ".png" in original_names:
+                record['original_current'] = os.path.join(original_app_path, match.group(1) + ".png")
+    return samples
+
+
+class SampleManifest:
+    """
+    Loaded manifest for one dataset root.
+
+    Args:
+        image_root (str): Dataset directory with one sub-directory per app.
+        manifest_path (str): Where the manifest JSON lives. Defaults to `<image_root>.manifest.json`.
+        original_root (str): Optional tree holding the unannotated screenCap_*.png files per app.
+    """
+
+    def __init__(self, image_root, manifest_path=None, original_root=None):
+        self.image_root = image_root
+        self.manifest_path = manifest_path or default_manifest_path(image_root)
+        self.original_root = original_root
+        self.apps_data = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get('version') == MANIFEST_VERSION and data.get('original_root') == self.original_root:
+            self.apps_data = data.get('apps', {})
+
+    def save(self):
+        data = {"version": MANIFEST_VERSION, "original_root": self.original_root, "apps": self.apps_data}
+        tmp_path = f"{self.manifest_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def refresh(self):
+        """Rescans apps whose directory mtime changed. Returns the number of apps rescanned or dropped."""
+        if not os.path.isdir(self.image_root):
+            return 0
+        with os.scandir(self.image_root) as it:
+            app_names = [entry.name for entry in it if entry.is_dir()]
+        rescanned = 0
+        for app_name in app_names:
+            app_path = os.path.join(self.image_root, app_name)
+            original_app_path = os.path.join(self.original_root, app_name) if self.original_root else None
+            mtime = _dir_mtime(app_path)
+            original_mtime = _dir_mtime(original_app_path) if original_app_path else None
+            cached = self.apps_data.get(app_name)
+            if cached and cached.get('mtime') == mtime and cached.get('original_mtime') == original_mtime:
+                continue
+            self.apps_data[app_name] = {
+                "mtime": mtime,
+                "original_mtime": original_mtime,
+                "samples": scan_app_dir(app_path, original_app_path if original_mtime is not None else None),
+            }
+            rescanned += 1
+        removed = set(self.apps_data) - set(app_names)
+        for app_name in removed:
+            del self.apps_data[app_name]
+        if rescanned or removed:
+            self.save()
+        return rescanned + len(removed)
+
+    def apps(self):
+        return sorted(self.apps_data)
+
+    def samples(self, app_name):
+        return self.apps_data.get(app_name, {}).get('samples', {})
+
+    def sample_ids(self, app_name):
+        return sorted(self.samples(app_name))
+
+    def image_paths(self, app_name, sample_id, states=STATES, use_original_current=False):
+        """Same shape as the runners' find_image_paths: {state: path or None}."""
+        record = self.samples(app_name).get(sample_id, {})
+        paths = {}
+        for state in states:
+            name = record.get(state)
+            paths[state] = os.path.join(self.image_root, app_name, name) if name else None
+        if use_original_current and 'current' in paths and record.get('original_current'):
+            paths['current'] = record['original_current']
+        return paths
+
+
+def load_manifest(image_root, manifest_path=None, original_root=None):
+    """Loads the persisted manifest and brings it up to date with the directory tree."""
+    manifest = SampleManifest(image_root, manifest_path=manifest_path, original_root=original_root)
+    manifest.refresh()
+    return manifest
@@ -1,12 +1,16 @@
 import os
 import json
+import numpy as np
 from tabulate import tabulate
 import matplotlib.pyplot as plt
+import annotation_columns
+from annotation_store import model_key_for_file
 
 def stat_yes_labels(directory):
     app_yes_counts = {}  # {app: yes_count}
     app_samples = {}     # {app: [(filename, sample, label)]}
-    for filename in os.listdir(directory):
+    # 按文件名顺序读取：同一应用出现在多个文件中时，以最后读到的文件为准
+    for filename in sorted(os.listdir(directory)):
         if filename.endswith('.json'):
             filepath = os.path.join(directory, filename)
             try:
@@ -30,9 +34,39 @@ def stat_yes_labels(directory):
                 print(f"{filename} 解析出错: {e}")
     return app_yes_counts, app_samples
 
+def stat_yes_labels_columns(columns_path):
+    """
+    stat_yes_labels 的快速路径：直接读取 annotation_columns.py 导出的列式文件，不解析 JSON。
+    结果与 stat_yes_labels 相同：按文件名顺序处理每个源文件，同一应用以最后一个含 Yes 的文件为准；
+    merge_ai_human.py 的合并文件 (ai 下按模型嵌套) 与 stat_yes_labels 一样不计入。
+    """
+    columns = annotation_columns.load_columns(columns_path)
+    model_names = columns.dictionary('model')
+    app_yes_counts, app_samples = {}, {}
+    for source_code, filename in sorted(enumerate(columns.dictionary('source')), key=lambda item: item[1]):
+        # 单模型文件的每一行都属于由文件名得到的模型；合并文件的行属于 ai 下的各个模型
+        model_name = model_key_for_file(filename)
+        if model_name not in model_names: continue
+        model_code = model_names.index(model_name)
+        rows = np.flatnonzero((columns.codes['source'] == source_code) & (columns.codes['model'] == model_code))
+        file_samples = {}
+        for app, sample, label in zip(columns.values('app', rows), columns.values('sample', rows), columns.values('ai_label', rows)):
+            file_samples.setdefault(app, []).append((filename, sample, label if label is not None else 'N/A'))
+        for app, sample_list in file_samples.items():
+            yes_count = sum(1 for _, _, label in sample_list if label == 'Yes')
+            if yes_count > 0:
+                app_yes_counts[app] = yes_count
+                app_samples[app] = sample_list
+    return app_yes_counts, app_samples
+
 if __name__ == "__main__":
     directory = "annotations_2"
-    app_yes_counts, app_samples = stat_yes_labels(directory)
+    # 设为 annotation_columns.py 导出的 .npz/.parquet 文件时走快速路径
+    columns_path = None
+    if columns_path:
+        app_yes_counts, app_samples = stat_yes_labels_columns(columns_path)
+    else:
+        app_yes_counts, app_samples = stat_yes_labels(directory)
 
     # 输出表格
     table = []
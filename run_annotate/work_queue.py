@@ -0,0 +1,252 @@
+# work_queue.py (多机协同标注的租约式任务队列)
+#
+# Several hosts running the same --model against one dataset would each annotate (and pay
+# for) every sample, because the only coordination is the "skip if 'ai' in annotations"
+# check against a local JSON file. With --queue the runners share a SQLite database on a
+# shared volume instead:
+#
+#   * every host enqueues the samples of the manifest (idempotent, INSERT OR IGNORE) and
+#     marks the ones it already has locally as done;
+#   * a worker leases a sample for `lease_seconds`, a background heartbeat keeps extending
+#     the leases it holds, and a lease that runs out (crashed or stalled host) becomes
+#     available to other workers again;
+#   * results are committed to the queue, so at the end every host can pull the results
+#     produced by the others into its own annotations file.
+#
+# The database uses SQLite's default rollback journal rather than WAL, because WAL needs
+# shared memory and does not work across hosts on a network filesystem. SQLite's file
+# locking is only as good as the filesystem's; on NFS make sure locking is enabled.
+#
+#     python work_queue.py --queue /mnt/shared/annotate_queue.db            # progress per model
+#     python work_queue.py --queue /mnt/shared/annotate_queue.db --requeue-failed
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    model         TEXT NOT NULL,
+    app           TEXT NOT NULL,
+    sample        TEXT NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'pending',  -- pending | leased | done | failed
+    worker        TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    result        TEXT,
+    updated       REAL,
+    PRIMARY KEY (model, app, sample)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (model, status, lease_expires);
+"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Lease-based queue of (model, app, sample) tasks in a SQLite file.
+
+    Args:
+        db_path (str): Database file; put it on a volume every worker can reach.
+        lease_seconds (float): How long a lease lasts without a heartbeat.
+        max_attempts (int): Leases per task before it is marked failed instead of retried.
+    """
+
+    def __init__(self, db_path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(db_path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # One short-lived connection per operation: safe to use from the heartbeat thread and
+        # from worker threads, and no lock is held between operations.
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 60000")
+        return _Transaction(conn)
+
+    def enqueue(self, model_name, samples, results=None):
+        """
+        Adds (app, sample) pairs for model_name. `results` maps (app, sample) -> result dict
+        for samples this host already annotated; those are recorded as done so no other
+        worker annotates them again. Returns the number of newly added tasks.
+        """
+        now = time.time()
+        results = results or {}
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.execute("SELECT COUNT(*) FROM tasks WHERE model = ?", (model_name,)).fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (model, app, sample, updated) VALUES (?, ?, ?, ?)",
+                ((model_name, app, sample, now) for app, sample in samples))
+            conn.executemany(
+                "INSERT INTO tasks (model, app, sample, status, result, updated) VALUES (?, ?, ?, 'done', ?, ?) "
+                "ON CONFLICT (model, app, sample) DO UPDATE SET status = 'done', result = excluded.result, "
+                "worker = NULL, lease_expires = NULL, updated = excluded.updated WHERE tasks.status != 'done'",
+                ((model_name, app, sample, json.dumps(result, ensure_ascii=False), now)
+                 for (app, sample), result in results.items()))
+            after = conn.execute("SELECT COUNT(*) FROM tasks WHERE model = ?", (model_name,)).fetchone()[0]
+        return after - before
+
+    def lease(self, model_name, worker_id, n=1):
+        """Leases up to n pending (or expired) tasks. Returns a list of (app, sample)."""
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers can never select the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT app, sample FROM tasks WHERE model = ? AND attempts < ? "
+                "AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                "ORDER BY app, sample LIMIT ?",
+                (model_name, self.max_attempts, now, n)).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated = ? "
+                "WHERE model = ? AND app = ? AND sample = ?",
+                ((worker_id, now + self.lease_seconds, now, model_name, app, sample) for app, sample in rows))
+            # Expired leases that used up their attempts will never be leased again
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', worker = NULL, updated = ? "
+                "WHERE model = ? AND status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, model_name, now, self.max_attempts))
+        return [tuple(row) for row in rows]
+
+    def heartbeat(self, worker_id):
+        """Extends every lease held by worker_id. Returns the number of leases extended."""
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated = ? WHERE worker = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, worker_id)).rowcount
+
+    def complete(self, model_name, app, sample, worker_id, result):
+        """
+        Commits a result. The first result wins: a worker whose lease already expired still
+        commits (the call was paid for) unless another worker finished the sample first.
+        Returns False if the sample was already done.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, worker = ?, lease_expires = NULL, updated = ? "
+                "WHERE model = ? AND app = ? AND sample = ? AND status != 'done'",
+                (json.dumps(result, ensure_ascii=False), worker_id, now, model_name, app, sample)).rowcount == 1
+
+    def release(self, model_name, app, sample, worker_id):
+        """Gives a lease back after a failed attempt; it is retried until max_attempts is reached."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_expires = NULL, updated = ? "
+                "WHERE model = ? AND app = ? AND sample = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, now, model_name, app, sample, worker_id))
+
+    def release_all(self, worker_id):
+        """Returns every lease still held by worker_id to the queue (on shutdown), without using up an attempt."""
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated = ? WHERE worker = ? AND status = 'leased'",
+                (now, worker_id)).rowcount
+
+    def requeue_failed(self, model_name=None):
+        with self._connect() as conn:
+            if model_name is None:
+                return conn.execute("UPDATE tasks SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+            return conn.execute("UPDATE tasks SET status = 'pending', attempts = 0 WHERE status = 'failed' AND model = ?",
+                                (model_name,)).rowcount
+
+    def outstanding(self, model_name):
+        """Tasks that are not finished yet: pending or leased, including leases held by other workers."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM tasks WHERE model = ? AND (status = 'leased' OR (status = 'pending' AND attempts < ?))",
+                                (model_name, self.max_attempts)).fetchone()[0]
+
+    def results(self, model_name):
+        """Yields (app, sample, result_dict) for every completed task of model_name."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT app, sample, result FROM tasks WHERE model = ? AND status = 'done'",
+                                (model_name,)).fetchall()
+        for app, sample, result in rows:
+            yield app, sample, json.loads(result)
+
+    def stats(self):
+        """{model: {status: count}} over the whole queue."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT model, status, COUNT(*) FROM tasks GROUP BY model, status").fetchall()
+        stats = {}
+        for model_name, status, count in rows:
+            stats.setdefault(model_name, {})[status] = count
+        return stats
+
+    def start_heartbeat(self, worker_id, interval=None):
+        """Starts a daemon thread that renews worker_id's leases; call .stop() on the result when done."""
+        return _Heartbeat(self, worker_id, interval or self.lease_seconds / 3)
+
+
+class _Transaction:
+    """Context manager around a connection: commits (or rolls back) and always closes."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+
+class _Heartbeat(threading.Thread):
+
+    def __init__(self, queue, worker_id, interval):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.start()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.worker_id)
+            except sqlite3.Error as e:
+                # A missed heartbeat is not fatal as long as a later one lands before the lease expires
+                print(f"  -> Queue heartbeat failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show progress of (or requeue failed tasks in) a shared annotation queue.")
+    parser.add_argument("--queue", required=True, help="Path of the SQLite queue database.")
+    parser.add_argument("--requeue-failed", action="store_true", help="Move failed tasks back to pending with fresh attempts.")
+    args = parser.parse_args()
+    queue = WorkQueue(args.queue)
+    if args.requeue_failed:
+        print(f"Requeued {queue.requeue_failed()} failed task(s).")
+    for model_name, counts in sorted(queue.stats().items()):
+        total = sum(counts.values())
+        print(f"{model_name}: {counts.get('done', 0)}/{total} done, {counts.get('leased', 0)} leased, "
+              f"{counts.get('pending', 0)} pending, {counts.get('failed', 0)} failed")